@@ -0,0 +1,583 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the bots and the core operations of intelmq.
+
+bots:
+Runs the bots of the BOTS file and chains of bots against a generated or a
+recorded corpus of messages, using the Pythonlist pipeline or a local Redis.
+For every bot, the number of processed messages per second, the percentiles
+of the latency per message (from receiving to acknowledging it) and the
+peak memory usage are reported as JSON. Every bot runs in its own process.
+
+The results can be stored and later used as baseline: Bots which became
+slower than the threshold are listed as regressions and the exit code is 1.
+
+micro:
+Measures the harmonization types (is_valid and sanitize) and the methods of
+messages in operations per second, comparable to a baseline as well.
+"""
+import argparse
+import contextlib
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import time
+import traceback
+import warnings
+from collections import defaultdict
+from typing import Callable, Optional
+
+import pkg_resources
+
+import intelmq.lib.pipeline as pipeline
+import intelmq.lib.utils as utils
+from intelmq import CONFIG_DIR, PIPELINE_CONF_FILE, RUNTIME_CONF_FILE, __version__
+from intelmq.lib import microbench
+
+APPNAME = 'intelmq-bench'
+SOURCE_QUEUE = 'intelmq-bench-input'
+OUTPUT_QUEUE = 'intelmq-bench-output'
+# groups of bots which can be benchmarked, by type of the messages they receive
+GROUPS = {'Report': ('Parser', ),
+          'Event': ('Expert', 'Output'),
+          }
+# outputs write to external systems, they are only run if selected explicitly
+DEFAULT_GROUPS = ('Parser', 'Expert')
+# parameters for all benchmarked bots, failing messages are skipped
+# logging parameters would make the bot replace the handler counting the failures
+BENCHMARK_CONFIG = {'testing': False,
+                    'error_procedure': 'pass',
+                    'error_max_retries': 0,
+                    'error_dump_message': False,
+                    'error_log_message': False,
+                    'error_log_exception': False,
+                    }
+# parameters for all benchmarked bots, unless given in the BOTS file
+BENCHMARK_DEFAULTS = {'http_proxy': None,
+                      'https_proxy': None,
+                      'rate_limit': 0,
+                      'retry_delay': 0,
+                      'error_retry_delay': 0,
+                      'redis_cache_host': 'localhost',
+                      'redis_cache_port': 6379,
+                      'redis_cache_db': 4,
+                      'redis_cache_ttl': 10,
+                      }
+
+
+class BenchmarkFinished(KeyboardInterrupt):
+    """
+    Raised by the pipeline when all messages have been processed.
+
+    The bot handles it like an interrupt and stops itself.
+    """
+
+
+class BenchmarkPipelineMixin(object):
+    """
+    Counts and times the messages of a benchmark run.
+
+    The latency of a message is the time from its receipt to its acknowledgement.
+    When all messages are acknowledged, the next receive ends the run of the bot.
+    """
+
+    def prepare_benchmark(self, count: int, keep_output: bool = False):
+        self.remaining = count
+        self.latencies = []
+        self.sent = 0
+        self.output = [] if keep_output else None
+        self.received_at = None
+        self.finished_at = None
+        self.batch_length = 0
+
+    def receive(self):
+        if not self.remaining:
+            self.finished_at = time.perf_counter()
+            raise BenchmarkFinished()
+        if self.received_at is None:  # not a re-delivery
+            self.received_at = time.perf_counter()
+        return super().receive()
+
+    def acknowledge(self):
+        retval = super().acknowledge()
+        self.latencies.append(time.perf_counter() - self.received_at)
+        self.received_at = None
+        self.remaining -= 1
+        return retval
+
+    def receive_batch(self, count: int, timeout: int = 0):
+        if not self.remaining:
+            self.finished_at = time.perf_counter()
+            raise BenchmarkFinished()
+        if self.received_at is None:
+            self.received_at = time.perf_counter()
+        batch = super().receive_batch(min(count, self.remaining), timeout)
+        self.batch_length = len(batch)
+        return batch
+
+    def acknowledge_batch(self):
+        retval = super().acknowledge_batch()
+        self.latencies.extend([time.perf_counter() - self.received_at] * self.batch_length)
+        self.received_at = None
+        self.remaining -= self.batch_length
+        return retval
+
+
+class BenchmarkPythonlist(BenchmarkPipelineMixin, pipeline.Pythonlist):
+    """ Only keeps the sent messages if they are needed for the next bot of a chain. """
+
+    def fill(self, raw_messages: list):
+        self.state[self.source_queue] = [utils.encode(raw) for raw in raw_messages]
+
+    def send(self, message, path="_default", path_permissive=False):
+        if path not in self.destination_queues and path_permissive:
+            return
+        message = utils.encode(message)
+        self.sent += 1
+        if self.output is not None:
+            self.output.append(message)
+
+    def collect_output(self) -> list:
+        return [pipeline.decompress(self._decode(raw)) for raw in self.output or ()]
+
+
+class BenchmarkRedis(BenchmarkPipelineMixin, pipeline.Redis):
+
+    def fill(self, raw_messages: list, chunk_size: int = 1000):
+        for queue in (self.source_queue, self.internal_queue, OUTPUT_QUEUE):
+            self.clear_queue(queue)
+        for start in range(0, len(raw_messages), chunk_size):
+            self.pipe.lpush(self.source_queue,
+                            *[utils.encode(raw) for raw in raw_messages[start:start + chunk_size]])
+
+    def send(self, message, path="_default", path_permissive=False):
+        if path not in self.destination_queues and path_permissive:
+            return
+        super().send(message, path=path)
+        self.sent += 1
+
+    def collect_output(self) -> list:
+        self.flush()
+        output = []
+        if self.output is not None:
+            output = [pipeline.decompress(self._decode(raw))
+                      for raw in reversed(self.pipe.lrange(OUTPUT_QUEUE, 0, -1))]
+        self.clear_queue(OUTPUT_QUEUE)
+        return output
+
+
+class ErrorCounter(logging.Handler):
+    """ Counts the failed messages and keeps the first error message. """
+
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+        self.failures = 0
+        self.first_error = None
+
+    def emit(self, record: logging.LogRecord):
+        message = record.getMessage()
+        if message == 'Bot has found a problem.':
+            self.failures += 1
+        elif self.first_error is None:
+            self.first_error = message
+
+
+class Parameters(object):
+    pass
+
+
+def benchmark_configuration(bot_id: str, group: str, module: str,
+                            parameters: dict) -> Callable[[str], dict]:
+    """
+    Returns a replacement of `utils.load_configuration` for the benchmarked bot.
+
+    The pipeline and runtime configuration only contain the bot, the defaults
+    and the harmonization are the ones shipped with intelmq.
+    """
+    load_configuration = utils.load_configuration
+
+    def load(conf_file: str) -> dict:
+        if conf_file == PIPELINE_CONF_FILE:
+            return {bot_id: {'source-queue': SOURCE_QUEUE,
+                             'destination-queues': {'_default': [OUTPUT_QUEUE]}}}
+        elif conf_file == RUNTIME_CONF_FILE:
+            return {bot_id: {'description': 'Benchmarked bot.',
+                             'group': group,
+                             'module': module,
+                             'name': bot_id,
+                             'parameters': parameters,
+                             }}
+        elif conf_file.startswith(CONFIG_DIR):
+            return load_configuration(pkg_resources.resource_filename(
+                'intelmq', os.path.join('etc', os.path.basename(conf_file))))
+        return load_configuration(conf_file)
+
+    return load
+
+
+@contextlib.contextmanager
+def injected_configuration(load_configuration: Callable[[str], dict], logger: logging.Logger):
+    """
+    Replaces the configuration files and the logger of the bots initialized
+    in this context, similar to the BotDebugger.
+    """
+    original = utils.load_configuration, utils.log
+
+    def log(name, log_path=None, log_level=None, stream=None, syslog=None):
+        logger.setLevel(log_level)
+        return logger
+
+    utils.load_configuration, utils.log = load_configuration, log
+    try:
+        yield
+    finally:
+        utils.load_configuration, utils.log = original
+
+
+def load_corpus(filename: str) -> list:
+    """
+    Loads recorded messages, one JSON message per line, e.g. the output of the file output bot.
+    Messages without type are events.
+    """
+    messages = []
+    with open(filename) as handle:
+        for line in handle:
+            if not line.strip():
+                continue
+            message = json.loads(line)
+            message.setdefault('__type', 'Event')
+            messages.append(json.dumps(message))
+    return messages
+
+
+def load_bots() -> dict:
+    """ Returns the bots of the BOTS file as dict of 'group/name' to the bot's definition. """
+    with open(pkg_resources.resource_filename('intelmq', 'bots/BOTS')) as handle:
+        groups = json.load(handle)
+    bots = {}
+    for group, group_bots in groups.items():
+        for name, definition in group_bots.items():
+            bots['%s/%s' % (group, name)] = dict(definition, group=group)
+    return bots
+
+
+def find_bot(bots: dict, selector: str) -> str:
+    """ Finds a bot by 'group/name', name or module, case-insensitive. """
+    for key, definition in bots.items():
+        if selector.lower() in (key.lower(), key.split('/', 1)[1].lower(),
+                                definition['module'].lower()):
+            return key
+    raise ValueError('Unknown bot %r.' % selector)
+
+
+def percentiles(values: list) -> dict:
+    if not values:
+        return {}
+    values = sorted(values)
+    result = {'p%d' % percent: values[min(len(values) - 1, int(len(values) * percent / 100))]
+              for percent in (50, 90, 99)}
+    result['max'] = values[-1]
+    return result
+
+
+def run_bot(key: str, definition: dict, raw_messages: list, broker: str = 'pythonlist',
+            redis_options: Optional[dict] = None, keep_output: bool = False) -> dict:
+    """
+    Runs the bot once over all messages, in the current process.
+
+    Returns the results and, with keep_output, the sent messages.
+    """
+    bot_id = 'intelmq-bench-' + ''.join(char if char.isalnum() else '-' for char in key.lower())
+    parameters = dict(BENCHMARK_DEFAULTS, **definition.get('parameters', {}))
+    parameters.update(BENCHMARK_CONFIG)
+    config = benchmark_configuration(bot_id, definition['group'], definition['module'], parameters)
+
+    logger = logging.getLogger(bot_id)
+    logger.propagate = False
+    errors = ErrorCounter()
+    logger.addHandler(errors)
+
+    pipeline_parameters = Parameters()
+    for queues_type in ('source', 'destination'):
+        for option, value in (redis_options or {}).items():
+            setattr(pipeline_parameters, '%s_pipeline_%s' % (queues_type, option), value)
+    pipe_class = BenchmarkRedis if broker == 'redis' else BenchmarkPythonlist
+    pipe = pipe_class(pipeline_parameters, logger)
+    pipe.set_queues(SOURCE_QUEUE, 'source')
+    pipe.set_queues({'_default': [OUTPUT_QUEUE]}, 'destination')
+    # bots may send to any path
+    pipe.destination_queues = defaultdict(lambda: [OUTPUT_QUEUE], pipe.destination_queues)
+    if broker == 'redis':
+        pipe.connect()
+    pipe.fill(raw_messages)
+    pipe.prepare_benchmark(len(raw_messages), keep_output=keep_output)
+
+    with injected_configuration(config, logger):
+        try:
+            bot = getattr(importlib.import_module(definition['module']), 'BOT')(bot_id)
+        except SystemExit:
+            return {'error': 'Initialization failed: %s' % (errors.first_error or 'see the log output')}, []
+        if broker == 'pythonlist':
+            # without Redis, writing the statistics would only measure the connection timeouts
+            bot._Bot__stats_cache = None
+        start = time.perf_counter()
+        try:
+            with warnings.catch_warnings():
+                # e.g. about not dumped messages
+                warnings.simplefilter('ignore')
+                bot.start(error_on_pipeline=False, source_pipeline=pipe,
+                          destination_pipeline=pipe)
+        except SystemExit:
+            pass
+        # the shutdown of the bot is not measured
+        seconds = (pipe.finished_at or time.perf_counter()) - start
+
+    processed = len(raw_messages) - pipe.remaining
+    result = {'module': definition['module'],
+              'messages': processed,
+              'sent': pipe.sent,
+              'failures': errors.failures,
+              'seconds': seconds,
+              'events_per_second': processed / seconds if seconds else None,
+              'latency': percentiles(pipe.latencies),
+              # kilobytes on Linux
+              'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+              }
+    if errors.failures and errors.first_error:
+        result['first_error'] = errors.first_error
+    return result, pipe.collect_output()
+
+
+def _run_bot_process(connection, *args, **kwargs):
+    try:
+        connection.send(run_bot(*args, **kwargs))
+    except BaseException:
+        connection.send(({'error': traceback.format_exc().splitlines()[-1]}, []))
+
+
+def run_bot_process(key: str, definition: dict, raw_messages: list, timeout: float = 600,
+                    **kwargs) -> tuple:
+    """ Runs the bot in a new process, see run_bot. """
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_run_bot_process,
+                                      args=(sender, key, definition, raw_messages),
+                                      kwargs=kwargs)
+    process.start()
+    sender.close()
+    if receiver.poll(timeout):
+        try:
+            result = receiver.recv()
+        except EOFError:
+            result = ({'error': 'Process exited with code %s.' % process.exitcode}, [])
+    else:
+        process.terminate()
+        result = ({'error': 'Timeout after %s seconds.' % timeout}, [])
+    process.join()
+    return result
+
+
+def run_chain(keys: list, bots: dict, raw_messages: list, **kwargs) -> dict:
+    """
+    Runs the bots one after another, each bot processes the output of the previous one.
+    """
+    stages = {}
+    total = 0.0
+    peak_rss = 0
+    messages = raw_messages
+    for index, key in enumerate(keys):
+        result, messages = run_bot_process(key, bots[key], messages,
+                                           keep_output=index < len(keys) - 1, **kwargs)
+        stages[key] = result
+        if 'error' in result:
+            return {'bots': stages, 'error': 'Bot %s failed: %s' % (key, result['error'])}
+        total += result['seconds']
+        peak_rss = max(peak_rss, result['peak_rss'])
+    return {'bots': stages,
+            'messages': len(raw_messages),
+            'seconds': total,
+            'events_per_second': len(raw_messages) / total if total else None,
+            'peak_rss': peak_rss,
+            }
+
+
+# measure of the throughput by kind of results
+RATES = {'bots': 'events_per_second',
+         'chains': 'events_per_second',
+         'micro': 'operations_per_second',
+         }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Adds the change of the throughput compared to the baseline in percent
+    and returns the bots, chains and microbenchmarks which are slower than the threshold.
+    """
+    regressions = []
+    for kind, rate in RATES.items():
+        for key, result in results.get(kind, {}).items():
+            old = baseline.get(kind, {}).get(key, {}).get(rate)
+            new = result.get(rate)
+            if not old or new is None:
+                continue
+            result['baseline_change'] = (new - old) / old * 100
+            if result['baseline_change'] < -threshold:
+                regressions.append(key)
+    return regressions
+
+
+def finish(results: dict, args) -> int:
+    """ Compares the results to the baseline, saves and prints them and returns the exit code. """
+    retval = 0
+    if args.baseline:
+        with open(args.baseline) as handle:
+            results['regressions'] = compare(results, json.load(handle), args.threshold)
+        if results['regressions']:
+            retval = 1
+
+    output = json.dumps(results, indent=4, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            handle.write(output)
+    print(output)
+    return retval
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog=APPNAME,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=__doc__,
+    )
+    parser.add_argument('-v', '--version', action='version', version=__version__)
+    subparsers = parser.add_subparsers(title='subcommands')
+
+    parser_results = argparse.ArgumentParser(add_help=False)
+    parser_results.add_argument('--output', '-o',
+                                help='also save the results to this file, e.g. as baseline')
+    parser_results.add_argument('--baseline',
+                                help='results of a previous run to compare to')
+    parser_results.add_argument('--threshold', type=float, default=10,
+                                help='slowdown compared to the baseline in percent '
+                                     'reported as regression, default: 10')
+
+    parser_bots = subparsers.add_parser('bots', help='Benchmark bots and chains of bots',
+                                        parents=[parser_results])
+    parser_bots.add_argument('--bot', '-b', action='append', default=[],
+                             help='bot to run, by name, group/name or module, '
+                                  'can be given multiple times, default: all bots of the groups')
+    parser_bots.add_argument('--group', '-g', action='append', choices=('Parser', 'Expert', 'Output'),
+                             help='run all bots of the group, default: %s' % ', '.join(DEFAULT_GROUPS))
+    parser_bots.add_argument('--chain', '-c', action='append', default=[],
+                             help='comma separated list of bots to run as chain, can be given multiple times')
+    parser_bots.add_argument('--parameters', '-p',
+                             help='JSON file with parameters by bot (name, group/name or module), '
+                                  'overriding the ones from the BOTS file')
+    parser_bots.add_argument('--corpus',
+                             help='file with recorded messages, one JSON message per line, '
+                                  'default: generated events')
+    parser_bots.add_argument('--count', '-n', type=int, default=10000,
+                             help='number of generated events, default: 10000')
+    parser_bots.add_argument('--seed', type=int, default=0,
+                             help='seed for the generated events, default: 0')
+    parser_bots.add_argument('--broker', choices=('pythonlist', 'redis'), default='pythonlist',
+                             help='pipeline to use, default: pythonlist')
+    parser_bots.add_argument('--redis-host', default='127.0.0.1')
+    parser_bots.add_argument('--redis-port', type=int, default=6379)
+    parser_bots.add_argument('--redis-db', type=int, default=2)
+    parser_bots.add_argument('--redis-password')
+    parser_bots.add_argument('--timeout', type=float, default=600,
+                             help='maximum run time per bot in seconds, default: 600')
+    parser_bots.set_defaults(func=bench_bots)
+
+    parser_micro = subparsers.add_parser('micro', help='Benchmark the harmonization types and the methods of messages',
+                                         parents=[parser_results])
+    parser_micro.add_argument('benchmarks', nargs='*', metavar='pattern',
+                              help='regular expressions selecting the benchmarks, default: all')
+    parser_micro.add_argument('--list', '-l', action='store_true',
+                              help='only list the benchmarks')
+    parser_micro.add_argument('--count', '-n', type=int, default=10000,
+                              help='number of operations per run, default: 10000')
+    parser_micro.add_argument('--repeat', '-r', type=int, default=5,
+                              help='number of runs, the best one is reported, default: 5')
+    parser_micro.add_argument('--seed', type=int, default=0,
+                              help='seed for the generated values, default: 0')
+    parser_micro.set_defaults(func=bench_micro)
+
+    args = parser.parse_args()
+    if 'func' not in args:
+        sys.exit(parser.print_help())
+    sys.exit(args.func(args))
+
+
+def bench_bots(args) -> int:
+    bots = load_bots()
+    if args.corpus:
+        raw_messages = load_corpus(args.corpus)
+        corpus = {'file': args.corpus}
+    else:
+        raw_messages = microbench.generate_events(args.count, seed=args.seed)
+        corpus = {'generated': args.count, 'seed': args.seed}
+    message_types = {json.loads(raw)['__type'] for raw in raw_messages[:1000]}
+    corpus['messages'] = len(raw_messages)
+    groups = {group for message_type in message_types for group in GROUPS.get(message_type, ())}
+
+    overrides = {}
+    if args.parameters:
+        with open(args.parameters) as handle:
+            for selector, parameters in json.load(handle).items():
+                overrides[find_bot(bots, selector)] = parameters
+    for key, parameters in overrides.items():
+        bots[key] = dict(bots[key], parameters=dict(bots[key]['parameters'], **parameters))
+
+    if args.bot:
+        selected = [find_bot(bots, selector) for selector in args.bot]
+    elif args.chain:
+        selected = []
+    else:
+        selected = [key for key, definition in bots.items()
+                    if definition['group'] in (args.group or DEFAULT_GROUPS)]
+    selected = [key for key in selected if bots[key]['group'] in groups]
+
+    kwargs = {'broker': args.broker, 'timeout': args.timeout}
+    if args.broker == 'redis':
+        kwargs['redis_options'] = {'host': args.redis_host, 'port': args.redis_port,
+                                   'db': args.redis_db, 'password': args.redis_password}
+
+    results = {'intelmq': __version__,
+               'python': sys.version.split()[0],
+               'broker': args.broker,
+               'corpus': corpus,
+               'bots': {},
+               'chains': {},
+               }
+    for key in selected:
+        results['bots'][key], _ = run_bot_process(key, bots[key], raw_messages, **kwargs)
+    for chain in args.chain:
+        keys = [find_bot(bots, selector.strip()) for selector in chain.split(',')]
+        results['chains'][chain] = run_chain(keys, bots, raw_messages, **kwargs)
+
+    return finish(results, args)
+
+
+def bench_micro(args) -> int:
+    names = microbench.select(args.benchmarks)
+    if args.list:
+        print('\n'.join(names))
+        return 0
+    results = {'intelmq': __version__,
+               'python': sys.version.split()[0],
+               'count': args.count,
+               'repeat': args.repeat,
+               'seed': args.seed,
+               'micro': microbench.run(names, count=args.count, repeat=args.repeat, seed=args.seed),
+               }
+    return finish(results, args)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
@@ -16,6 +16,8 @@
 import sys
 import time
 import xmlrpc.client
+from itertools import chain
+from typing import Optional
 from collections import OrderedDict
 
 import pkg_resources
@@ -24,9 +26,9 @@
 from intelmq import (BOTS_FILE, DEFAULT_LOGGING_LEVEL, DEFAULTS_CONF_FILE,
                      HARMONIZATION_CONF_FILE, PIPELINE_CONF_FILE,
                      RUNTIME_CONF_FILE, VAR_RUN_PATH)
-from intelmq.lib import utils
+from intelmq.lib import cache, profiling, stats, utils
 from intelmq.lib.bot_debugger import BotDebugger
-from intelmq.lib.pipeline import PipelineFactory
+from intelmq.lib.pipeline import Pipeline, PipelineFactory, internal_queue_names
 
 
 class Parameters(object):
@@ -120,6 +122,43 @@ def log_log_messages(messages):
                 pass
 
 
+def format_duration(seconds):
+    if seconds is None:
+        return '-'
+    if seconds == float('inf'):
+        return 'inf'
+    return '%.3gms' % (seconds * 1000)
+
+
+def log_bot_stats(bot_id, result):
+    if RETURN_TYPE == 'text':
+        logger.info('Bot %s processed %d messages successfully, %d failed, %.1f messages/s.',
+                    bot_id, result['success'], result['failure'], result['throughput'])
+        for path, total in sorted(result['paths'].items()):
+            logger.info('Sent to path %s: %d messages.', path, total)
+        for operation in stats.OPERATIONS:
+            summary = result['latency'].get(operation)
+            if not summary or not summary['count']:
+                continue
+            logger.info('%-12s count %d, mean %s, p50 %s, p90 %s, p99 %s.',
+                        operation, summary['count'],
+                        *(format_duration(summary[key]) for key in ('mean', 'p50', 'p90', 'p99')))
+        for name, summary in sorted(result['trace'].items()):
+            if name == 'end_to_end':
+                description = 'End-to-end latency'
+            else:
+                description = 'Waiting time in queue %s' % name[len('wait.'):]
+            logger.info('%s: count %d, mean %s, p50 %s, p90 %s, p99 %s.',
+                        description, summary['count'],
+                        *(format_duration(summary[key]) for key in ('mean', 'p50', 'p90', 'p99')))
+        for name, value in sorted(result['counters'].items()):
+            logger.info('Counter %s: %d.', name, value)
+        for queue, sizes in sorted(result['compression'].items()):
+            if sizes['ratio'] is not None:
+                logger.info('Sent to queue %s: %d bytes, %d bytes after compression (ratio %.2f).',
+                            queue, sizes['original'], sizes['sent'], sizes['ratio'])
+
+
 class IntelMQProcessManager:
     PIDDIR = VAR_RUN_PATH
     PIDFILE = os.path.join(PIDDIR, "{}.pid")
@@ -137,7 +176,7 @@ def __init__(self, runtime_configuration, logger, controller):
                                   'created: %s.', self.PIDDIR, exc)
 
     def bot_run(self, bot_id, run_subcommand=None, console_type=None, message_action_kind=None, dryrun=None, msg=None,
-                show_sent=None, loglevel=None):
+                show_sent=None, loglevel=None, profiler=None, profile_messages=None, profile_seconds=None):
         pid = self.__check_pid(bot_id)
         module = self.__runtime_configuration[bot_id]['module']
         status = self.__status_process(pid, module, bot_id) if pid else False
@@ -162,7 +201,8 @@ def bot_run(self, bot_id, run_subcommand=None, console_type=None, message_action
         try:
             BotDebugger(self.__runtime_configuration[bot_id], bot_id, run_subcommand,
                         console_type, message_action_kind, dryrun, msg, show_sent,
-                        loglevel=loglevel)
+                        loglevel=loglevel, profiler=profiler, profile_messages=profile_messages,
+                        profile_seconds=profile_seconds)
             retval = 0
         except KeyboardInterrupt:
             print('Keyboard interrupt.')
@@ -402,7 +442,7 @@ def __init__(self, runtime_configuration: dict, logger: logging.Logger, controll
         self.__controller = controller
 
     def bot_run(self, bot_id, run_subcommand=None, console_type=None, message_action_kind=None, dryrun=None, msg=None,
-                show_sent=None, loglevel=None):
+                show_sent=None, loglevel=None, profiler=None, profile_messages=None, profile_seconds=None):
         paused = False
         state = self._get_process_state(bot_id)
         if state in (self.ProcessState.STARTING, self.ProcessState.RUNNING, self.ProcessState.BACKOFF):
@@ -418,7 +458,8 @@ def bot_run(self, bot_id, run_subcommand=None, console_type=None, message_action
         try:
             BotDebugger(self.__runtime_configuration[bot_id], bot_id, run_subcommand,
                         console_type, message_action_kind, dryrun, msg, show_sent,
-                        loglevel=loglevel)
+                        loglevel=loglevel, profiler=profiler, profile_messages=profile_messages,
+                        profile_seconds=profile_seconds)
             retval = 0
         except KeyboardInterrupt:
             print("Keyboard interrupt.")
@@ -674,8 +715,10 @@ def __init__(self, interactive: bool = False, return_type: str = "python", quiet
         intelmqctl log bot-id [number-of-lines [log-level]]
         intelmqctl run bot-id message [get|pop|send]
         intelmqctl run bot-id process [--msg|--dryrun]
+        intelmqctl run bot-id profile [--messages|--seconds|--profiler]
         intelmqctl run bot-id console
         intelmqctl clear queue-id
+        intelmqctl stats bot-id
         intelmqctl check
 
 Starting a bot:
@@ -695,6 +738,8 @@ def __init__(self, interactive: bool = False, return_type: str = "python", quiet
     intelmqctl run bot-id console
 See the message that waits in the input queue.
     intelmqctl run bot-id message get
+Profile the bot while processing 1000 messages.
+    intelmqctl run bot-id profile --messages 1000
 See additional help for further explanation.
     intelmqctl run bot-id --help
 
@@ -727,6 +772,11 @@ def __init__(self, interactive: bool = False, return_type: str = "python", quiet
 Default is INFO. Number of lines defaults to 10, -1 gives all. Result
 can be longer due to our logging format!
 
+Get the statistics of a bot:
+    intelmqctl stats bot-id
+Shows the numbers of processed messages, the throughput, the durations of
+the operations of the bot and the compression ratios.
+
 Outputs are additionally logged to /opt/intelmq/var/log/intelmqctl'''
 
         # stolen functions from the bot file
@@ -794,6 +844,10 @@ def __init__(self, interactive: bool = False, return_type: str = "python", quiet
                                     choices=LOG_LEVEL.keys(), default='INFO', nargs='?')
             parser_log.set_defaults(func=self.read_bot_log)
 
+            parser_stats = subparsers.add_parser('stats', help='Get the statistics of a bot')
+            parser_stats.add_argument('bot_id', help='bot id')
+            parser_stats.set_defaults(func=self.read_bot_stats)
+
             parser_run = subparsers.add_parser('run', help='Run a bot interactively')
             parser_run.add_argument('bot_id',
                                     choices=self.runtime_configuration.keys())
@@ -826,6 +880,19 @@ def __init__(self, interactive: bool = False, return_type: str = "python", quiet
                                             help='Trick the bot to process this JSON '
                                                  'instead of the Message in its pipeline.')
             parser_run_process.set_defaults(run_subcommand="process")
+
+            parser_run_profile = parser_run_subparsers.add_parser('profile',
+                                                                  help='Run the bot under a profiler for a number of '
+                                                                       'messages or seconds.')
+            parser_run_profile.add_argument('--messages', '-n', type=int, dest='profile_messages',
+                                            help='Stop after this number of processed messages.')
+            parser_run_profile.add_argument('--seconds', '-t', type=float, dest='profile_seconds',
+                                            help='Stop after this number of seconds.')
+            parser_run_profile.add_argument('--profiler', '-p', choices=profiling.PROFILERS, default='cprofile',
+                                            help='cprofile (default) writes a pstats file, sampling has a lower '
+                                                 'overhead and writes collapsed stacks. The results are written '
+                                                 'to the logging path.')
+            parser_run_profile.set_defaults(run_subcommand="profile")
             parser_run.set_defaults(func=self.bot_run)
 
             parser_check = subparsers.add_parser('check',
@@ -1112,12 +1179,25 @@ def list_bots(self):
                     'description': self.runtime_configuration[bot_id].get('description')}
                    for bot_id in sorted(self.runtime_configuration.keys())]
 
-    def get_queues(self, with_internal_queues=False):
+    def get_internal_queues(self, source_queue: str, pipeline: Optional[Pipeline] = None) -> list:
+        """
+        :return: The internal queues of the source queue, `[source-queue]-internal` and, if
+        a connected pipeline is given, the existing ones of worker processes of bots with
+        `instances_processes`, `[source-queue]-internal.[n]`. These include the internal
+        queues of former worker processes, e.g. after reducing the number of processes.
+        """
+        internal_queues = {source_queue + '-internal'}
+        if pipeline:
+            internal_queues.update(pipeline.find_internal_queues(source_queue))
+        return sorted(internal_queues)
+
+    def get_queues(self, with_internal_queues=False, pipeline: Optional[Pipeline] = None):
         """
         :return: 4-tuple of source, destination, internal queues, and all queues combined.
         The returned values are only queue names, not their paths. I.E. if there is a bot with
         destination queues = {"_default": "one", "other": ["two", "three"]}, only set of {"one", "two", "three"} gets returned.
         (Note that the "_default" path has single string and the "other" path has a list that gets flattened.)
+        The internal queues of worker processes are only found with a connected pipeline, see get_internal_queues.
         """
         source_queues = set()
         destination_queues = set()
@@ -1127,7 +1207,7 @@ def get_queues(self, with_internal_queues=False):
             if 'source-queue' in value:
                 source_queues.add(value['source-queue'])
                 if with_internal_queues:
-                    internal_queues.add(value['source-queue'] + '-internal')
+                    internal_queues.update(self.get_internal_queues(value['source-queue'], pipeline))
             if 'destination-queues' in value:
                 # flattens ["one", "two"] → {"one", "two"}, {"_default": "one", "other": ["two", "three"]} → {"one", "two", "three"}
                 destination_queues.update(utils.flatten_queues(value['destination-queues']))
@@ -1140,8 +1220,13 @@ def list_queues(self):
         pipeline = PipelineFactory.create(self.parameters, logger=self.logger)
         pipeline.set_queues(None, "source")
         pipeline.connect()
-        source_queues, destination_queues, internal_queues,\
-            all_queues = self.get_queues(with_internal_queues=pipeline.has_internal_queues)
+        source_queues, destination_queues, internal_queues, all_queues = self.get_queues()
+        bot_internal_queues = {}
+        if pipeline.has_internal_queues:
+            bot_internal_queues = {bot_id: self.get_internal_queues(info['source-queue'], pipeline)
+                                   for bot_id, info in self.pipeline_configuration.items()
+                                   if 'source-queue' in info}
+            all_queues.update(chain.from_iterable(bot_internal_queues.values()))
 
         counters = pipeline.count_queued_messages(*all_queues)
         pipeline.disconnect()
@@ -1155,7 +1240,8 @@ def list_queues(self):
                 return_dict[bot_id]['source_queue'] = (
                     info['source-queue'], counters[info['source-queue']])
                 if pipeline.has_internal_queues:
-                    return_dict[bot_id]['internal_queue'] = counters[info['source-queue'] + '-internal']
+                    return_dict[bot_id]['internal_queue'] = sum(
+                        counters[queue] for queue in bot_internal_queues[bot_id])
 
             if 'destination-queues' in info:
                 return_dict[bot_id]['destination_queues'] = []
@@ -1181,7 +1267,7 @@ def clear_queue(self, queue):
             if 'source-queue' in value:
                 queues.add(value['source-queue'])
                 if pipeline.has_internal_queues:
-                    queues.add(value['source-queue'] + '-internal')
+                    queues.update(self.get_internal_queues(value['source-queue'], pipeline))
             if 'destination-queues' in value:
                 queues.update(value['destination-queues'])
 
@@ -1252,6 +1338,62 @@ def read_bot_log(self, bot_id, log_level, number_of_lines):
         log_log_messages(messages[::-1])
         return 0, messages[::-1]
 
+    def read_bot_stats(self, bot_id):
+        """
+        Reads the statistics of a bot and all of its instances from the statistics database.
+
+        Counters are summed up and the latency histograms merged over all instances.
+        """
+        stats_cache = cache.Cache(host=getattr(self.parameters, "statistics_host", "127.0.0.1"),
+                                  port=getattr(self.parameters, "statistics_port", "6379"),
+                                  db=int(getattr(self.parameters, "statistics_database", 3)),
+                                  password=getattr(self.parameters, "statistics_password", None),
+                                  ttl=None)
+        try:
+            keys = sorted(stats_cache.redis.scan_iter(match=re.sub(r'([*?\[\]])', r'\\\1', bot_id) + '.*'))
+            values = stats_cache.redis.mget(keys) if keys else []
+        except Exception as exc:
+            logger.error('Could not read the statistics: %s', exc)
+            return 1, 'error'
+
+        result = {'success': 0, 'failure': 0, 'throughput': 0.0, 'paths': {},
+                  'latency': {}, 'trace': {}, 'compression': {}, 'counters': {}}
+        histograms = {'latency': {}, 'trace': {}}
+        for key, value in zip(keys, values):
+            if value is None:  # expired in the meantime
+                continue
+            name = utils.decode(key)[len(bot_id) + 1:]
+            value = utils.decode(value)
+            kind, _, name = name.partition('.')
+            if kind.isdigit():  # instance id of threads and processes
+                kind, _, name = name.partition('.')
+            if kind == 'stats' and name in ('success', 'failure'):
+                result[name] += int(value)
+            elif kind == 'stats' and name == 'throughput':
+                result['throughput'] += float(value)
+            elif kind == 'total':
+                result['paths'][name] = result['paths'].get(name, 0) + int(value)
+            elif kind in ('latency', 'trace'):
+                histogram = stats.Histogram.unserialize(value)
+                if name in histograms[kind]:
+                    histograms[kind][name].merge(histogram)
+                else:
+                    histograms[kind][name] = histogram
+            elif kind == 'counter':
+                result['counters'][name] = result['counters'].get(name, 0) + int(value)
+            elif kind == 'compression':
+                queue, _, size = name.rpartition('.')
+                sizes = result['compression'].setdefault(queue, {'original': 0, 'sent': 0})
+                sizes[size] += int(value)
+        for kind, kind_histograms in histograms.items():
+            for name, histogram in kind_histograms.items():
+                result[kind][name] = histogram.summary()
+        for sizes in result['compression'].values():
+            sizes['ratio'] = sizes['sent'] / sizes['original'] if sizes['original'] else None
+
+        log_bot_stats(bot_id, result)
+        return 0, result
+
     def check(self, no_connections=False):
         retval = 0
         if RETURN_TYPE == 'json':
@@ -1307,6 +1449,7 @@ def check(self, no_connections=False):
 
         check_logger.info('Checking runtime and pipeline configuration.')
         all_queues = set()
+        bot_source_queues = {}
         for bot_id, bot_config in files[RUNTIME_CONF_FILE].items():
             # pipeline keys
             for field in ['description', 'group', 'module', 'name']:
@@ -1344,12 +1487,35 @@ def check(self, no_connections=False):
                         retval = 1
                     else:
                         all_queues.add(files[PIPELINE_CONF_FILE][bot_id]['source-queue'])
-                        all_queues.add(files[PIPELINE_CONF_FILE][bot_id]['source-queue'] + '-internal')
+                        all_queues.update(self.get_internal_queues(files[PIPELINE_CONF_FILE][bot_id]['source-queue']))
+                        bot_source_queues[bot_id] = files[PIPELINE_CONF_FILE][bot_id]['source-queue']
+                for chained_bot_id in files[PIPELINE_CONF_FILE][bot_id].get('chain', []):
+                    if chained_bot_id not in files[RUNTIME_CONF_FILE]:
+                        check_logger.error('Misconfiguration: Bot %r of the chain of %r is not configured.',
+                                           chained_bot_id, bot_id)
+                        retval = 1
+                    elif files[RUNTIME_CONF_FILE][chained_bot_id].get('enabled', True):
+                        check_logger.warning('Bot %r is run in the chain of %r, but is enabled itself.',
+                                             chained_bot_id, bot_id)
+                        retval = 1
         if not no_connections:
             try:
                 pipeline = PipelineFactory.create(self.parameters, logger=self.logger)
                 pipeline.set_queues(None, "source")
                 pipeline.connect()
+                for bot_id, source_queue in bot_source_queues.items():
+                    internal_queues = pipeline.find_internal_queues(source_queue)
+                    all_queues.update(internal_queues)
+                    try:
+                        processes = int(files[RUNTIME_CONF_FILE][bot_id].get('parameters', {}).get('instances_processes', 1))
+                    except (TypeError, ValueError):
+                        processes = 1
+                    unused = sorted(set(internal_queues) - set(internal_queue_names(source_queue, processes)))
+                    if unused:
+                        check_logger.warning("Bot %r has unacknowledged messages in the internal queues '%s' of no current "
+                                             "worker process. They are moved back to the source queue when the bot starts.",
+                                             bot_id, "', '".join(unused))
+                        retval = 1
                 orphan_queues = "', '".join(pipeline.nonempty_queues() - all_queues)
             except Exception as exc:
                 error = utils.error_message_from_exc(exc)
@@ -3,8 +3,9 @@
 """
 """
 import argparse
+import base64
 import copy
-import fcntl
+import datetime
 import glob
 import json
 import os.path
@@ -12,12 +13,15 @@
 import re
 import readline
 import sys
+import time
 import traceback
-from collections import OrderedDict
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple, Union
 
+import dateutil.parser
 from termstyle import bold, green, inverted, red
 
 import intelmq.bin.intelmqctl as intelmqctl
+import intelmq.lib.dump as dump
 import intelmq.lib.exceptions as exceptions
 import intelmq.lib.message as message
 import intelmq.lib.pipeline as pipeline
@@ -30,8 +34,18 @@
 DESCRIPTION = """
 intelmqdump can inspect dumped messages, show, delete or reinject them into
 the pipeline. It's an interactive tool, directly start it to get a list of
-available dumps or call it with a known bot id as parameter."""
+available dumps or call it with a known bot id as parameter.
+With --recover, it recovers the dumps of the given bot or of all bots matching
+the filters without interaction, for example after an outage."""
 EPILOG = """
+Examples for the recovery without interaction:
+  > intelmqdump --recover
+  Recover the dumps of all bots to their source queues.
+  > intelmqdump --recover --bot 'parser$' --traceback 'ConnectionError' --since '2019-09-01 12:00'
+  Recover the dumps of all parsers with connection errors since the given time.
+  > intelmqdump deduplicator-expert --recover --queue file-output-queue
+  Recover all dumps of the bot deduplicator-expert to the given queue.
+
 Interactive actions after a file has been selected:
 - r, Recover by IDs
   > r id{,id} [queue name]
@@ -62,7 +76,11 @@
 """
 USAGE = '''
     intelmqdump [botid]
+    intelmqdump [botid] --recover [--queue QUEUE] [--bot REGEX] [--traceback REGEX]
+                [--since TIME] [--until TIME] [--batch-size N]
     intelmqdump [-h|--help]'''
+# number of messages recovered at once
+BATCH_SIZE = 500
 # shortcut: description, takes ids, available for corrupted files
 ACTIONS = {'r': ('(r)ecover by ids', True, False),
            'a': ('recover (a)ll', False, False),
@@ -75,60 +93,253 @@
 
 
 def dump_info(fname, file_descriptor=None):
+    """
+    Short description of the content of a dump file.
+
+    Parameters:
+        fname: Path of the dump file
+        file_descriptor: An opened intelmq.lib.dump.DumpFile of the file, opened otherwise
+    """
     info = red('unknown error')
     if not os.path.getsize(fname):
         info = red('empty file')
     else:
         try:
             if file_descriptor is None:
-                handle = open(fname, 'rt')
-                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                handle = dump.DumpFile(fname, timeout=0)
+                handle.open()
             else:
                 handle = file_descriptor
         except BlockingIOError:
             info = red('Dump file is locked.')
         except OSError as exc:
             info = red('unable to open file: {!s}'.format(exc))
+        except ValueError as exc:
+            info = red('unable to load JSON: {!s}'.format(exc))
         else:
-            try:
-                content = json.load(handle)
-            except ValueError as exc:
-                info = red('unable to load JSON: {!s}'.format(exc))
-            else:
-                try:
-                    info = "{!s} dumps".format(len(content.keys()))
-                except AttributeError as exc:
-                    info = red("unable to count dumps: {!s}".format(exc))
-        finally:
-            try:
-                if file_descriptor is None:
-                    handle.close()
-            except NameError:
-                pass
+            info = "{!s} dumps".format(len(handle))
+            if file_descriptor is None:
+                handle.close()
     return info
 
 
-def save_file(handle, content):
-    handle.truncate()
-    try:
-        json.dump(content, handle, indent=4, sort_keys=True)
-    except KeyboardInterrupt:
-        print('Got KeyboardInterrupt, saving file before exit.', file=sys.stderr)
-        json.dump(content, handle, indent=4, sort_keys=True)
-        sys.exit(1)
-    handle.seek(0)
-
-
-def load_meta(dump):
+def load_meta(dump_file):
+    """
+    Timestamps and the last lines of the tracebacks of all entries, read one by one.
+    """
     retval = []
-    for key, value in dump.items():
+    for position in range(len(dump_file)):
+        try:
+            value = dump_file[position]
+        except ValueError as exc:
+            retval.append(('', red('unable to load JSON: {!s}'.format(exc))))
+            continue
         if type(value['traceback']) is not list:
             error = value['traceback'].splitlines()[-1]
         else:
             error = value['traceback'][-1].strip()
         if len(error) > 200:
             error = error[:100] + '...' + error[-100:]
-        retval.append((key, error))
+        retval.append((value['timestamp'], error))
+    return retval
+
+
+def parse_time(value: str) -> str:
+    """
+    Converts a time given on the command line to the format of the timestamps
+    of the dumps, ISO 8601 in UTC without time zone.
+    """
+    timestamp = dateutil.parser.parse(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return timestamp.isoformat()
+
+
+def matches(entry: dict, bot: Optional[str] = None, traceback_pattern: Optional[str] = None,
+            since: Optional[str] = None, until: Optional[str] = None) -> bool:
+    """
+    If the dump entry matches all given filters.
+
+    Parameters:
+        bot: Regular expression for the bot id
+        traceback_pattern: Regular expression searched in the traceback
+        since, until: Range of the timestamps, see parse_time
+    """
+    if bot and not re.search(bot, entry['bot_id']):
+        return False
+    if since and entry['timestamp'] < since:
+        return False
+    if until and entry['timestamp'] > until:
+        return False
+    if traceback_pattern:
+        error = entry['traceback']
+        if type(error) is list:
+            error = ''.join(error)
+        if not re.search(traceback_pattern, error):
+            return False
+    return True
+
+
+def select_entries(dump_file, positions: Optional[Iterable[int]] = None,
+                   **filters) -> Iterator[Tuple[int, dict]]:
+    """
+    Streams the positions and entries of a dump file matching the filters.
+    Invalid entries are skipped.
+
+    Parameters:
+        dump_file: An opened intelmq.lib.dump.DumpFile
+        positions: Only these entries, all by default
+        filters: See matches
+    """
+    for position in range(len(dump_file)) if positions is None else positions:
+        try:
+            entry = dump_file[position]
+        except (ValueError, IndexError):
+            print(red('Could not load dump {}, skipping.'.format(position)))
+            continue
+        if matches(entry, **filters):
+            yield position, entry
+
+
+def is_event(msg: Union[str, bytes]) -> bool:
+    """ Returns True if the serialized message is an event, False for raw messages which are invalid. """
+    try:
+        return message.Message.unserialize(msg)['__type'] == 'Event'
+    except (ValueError, KeyError, TypeError):
+        return False
+
+
+def recover(entries: Iterable[Tuple[int, dict]], pipe, recovered: list,
+            queue_name: Optional[str] = None, runtime: Optional[dict] = None,
+            pipeline_pipes: Optional[dict] = None, batch_size: int = BATCH_SIZE,
+            progress: Optional[Callable[[int], None]] = None):
+    """
+    Sends the messages of the dump entries to their source queue or the given one.
+
+    The messages are pushed in batches, using the send buffer of the pipeline.
+    Events for parsers are converted to reports.
+
+    Parameters:
+        entries: Positions and dump entries, see select_entries
+        pipe: Connected pipeline, its send buffer should hold at least batch_size messages
+        recovered: The positions of the recovered entries are appended after each batch
+        queue_name: Destination queue instead of the source queues of the entries
+        runtime: The runtime configuration
+        pipeline_pipes: Mapping of the source queues to the bot ids
+        batch_size: Number of messages sent at once
+        progress: Called with the number of recovered entries after each batch
+
+    Raises:
+        intelmq.lib.exceptions.PipelineError: Sending a batch failed, its entries are not recovered
+    """
+    runtime = runtime or {}
+    pipeline_pipes = pipeline_pipes or {}
+    pending = []
+    for position, entry in entries:
+        if entry['message']:
+            msg = copy.copy(entry['message'])  # otherwise the message field gets converted
+            if isinstance(msg, dict):
+                msg = json.dumps(msg)
+            elif entry.get('message_encoding') == 'base64':
+                # raw binary message which could not be unserialized by the bot
+                msg = base64.b64decode(msg)
+        else:
+            print('No message here, deleting entry.')
+            recovered.append(position)
+            continue
+
+        destination = queue_name or entry['source_queue']
+        if destination in pipeline_pipes:
+            if runtime[pipeline_pipes[destination]]['group'] == 'Parser' and is_event(msg):
+                print('Event converted to Report automatically.')
+                msg = message.Report(message.MessageFactory.unserialize(msg)).serialize()
+        if destination not in pipe.destination_queues:
+            pipe.destination_queues[destination] = [destination]
+        pipe.send(msg, path=destination)
+        pending.append(position)
+        if len(pending) >= batch_size:
+            pipe.flush()
+            recovered.extend(pending)
+            pending = []
+            if progress:
+                progress(len(recovered))
+    pipe.flush()
+    recovered.extend(pending)
+    if progress:
+        progress(len(recovered))
+
+
+def create_pipeline(logger, batch_size: int = BATCH_SIZE):
+    """ Connected destination pipeline buffering batch_size messages. """
+    default = utils.load_configuration(DEFAULTS_CONF_FILE)
+    runtime = utils.load_configuration(RUNTIME_CONF_FILE)
+    params = utils.load_parameters(default, runtime)
+    # the batches are flushed explicitly
+    params.destination_pipeline_buffer_size = batch_size + 1
+    params.destination_pipeline_buffer_time = float('inf')
+    pipe = pipeline.PipelineFactory.create(params, logger, direction='destination', queues={})
+    pipe.connect()
+    return pipe, runtime
+
+
+def bulk_recover(filenames: List[str], args, logger, pipeline_pipes: dict) -> int:
+    """
+    Recovers the entries of the dump files matching the filters
+    given on the command line without interaction.
+
+    Returns the exit code.
+    """
+    filters = {'bot': args.bot, 'traceback_pattern': args.traceback,
+               'since': args.since and parse_time(args.since),
+               'until': args.until and parse_time(args.until)}
+    pipe, runtime = create_pipeline(logger, args.batch_size)
+    retval = 0
+    for fname in filenames:
+        try:
+            handle = dump.DumpFile(fname, timeout=0)
+            handle.open()
+        except BlockingIOError:
+            print(red('Dump file {} is currently locked, skipping.'.format(fname)))
+            retval = 1
+            continue
+        except ValueError as exc:
+            print(red('Could not load dump file {}, skipping: {!s}'.format(fname, exc)))
+            retval = 1
+            continue
+        total = len(handle)
+        start = time.monotonic()
+
+        def progress(count):
+            print('\rRecovered {} of {} dumps ({:.0f}/s)'
+                  ''.format(count, total, count / max(time.monotonic() - start, 1e-6)),
+                  end='', file=sys.stderr, flush=True)
+
+        print(bold('Recovering {}: {} dumps'.format(fname, total)))
+        recovered = []
+        interrupted = False
+        try:
+            recover(select_entries(handle, **filters), pipe, recovered, queue_name=args.queue,
+                    runtime=runtime, pipeline_pipes=pipeline_pipes,
+                    batch_size=args.batch_size, progress=progress)
+        except exceptions.PipelineError:
+            print(red('\nCould not reinject into queue: {}'.format(traceback.format_exc())))
+            retval = 1
+            interrupted = True
+        except KeyboardInterrupt:
+            print(red('\nInterrupted, removing the recovered dumps.'), file=sys.stderr)
+            retval = 1
+            interrupted = True
+        finally:
+            print(file=sys.stderr)
+            if len(recovered) == total:
+                handle.remove()
+                print(green('Recovered all {} dumps, deleted file {}.'.format(total, fname)))
+            else:
+                handle.delete(recovered)
+                handle.close()
+                print(green('Recovered {} of {} dumps.'.format(len(recovered), total)))
+        if interrupted:
+            break
     return retval
 
 
@@ -170,6 +381,16 @@ def main():
 
     parser.add_argument('botid', metavar='botid', nargs='?',
                         default=None, help='botid to inspect dumps of')
+    recovery = parser.add_argument_group('recovery without interaction')
+    recovery.add_argument('--recover', action='store_true',
+                          help='recover the matching dumps of the given bot or of all bots')
+    recovery.add_argument('--queue', help='queue to recover the messages to, the source queue by default')
+    recovery.add_argument('--bot', metavar='REGEX', help='only dumps of bots with matching ids')
+    recovery.add_argument('--traceback', metavar='REGEX', help='only dumps with matching tracebacks')
+    recovery.add_argument('--since', metavar='TIME', help='only dumps since this time (UTC if no time zone is given)')
+    recovery.add_argument('--until', metavar='TIME', help='only dumps until this time (UTC if no time zone is given)')
+    recovery.add_argument('--batch-size', type=int, default=BATCH_SIZE, metavar='N',
+                          help='number of messages sent at once, default: %(default)s')
     args = parser.parse_args()
 
     # Try to get log_level from defaults_configuration, else use default
@@ -193,6 +414,22 @@ def main():
     for bot, pipes in pipeline_config.items():
         pipeline_pipes[pipes.get('source-queue', '')] = bot
 
+    if args.recover:
+        if args.botid:
+            filenames = [os.path.join(DEFAULT_LOGGING_PATH, args.botid) + '.dump']
+            if not os.path.isfile(filenames[0]):
+                print(bold('Given file does not exist: {}'.format(filenames[0])))
+                exit(1)
+        else:
+            filenames = sorted(glob.glob(os.path.join(DEFAULT_LOGGING_PATH, '*.dump')))
+            if args.bot:
+                filenames = [fname for fname in filenames
+                             if re.search(args.bot, os.path.basename(fname)[:-5])]
+            if not filenames:
+                print(green('Nothing to recover from, no dump files found!'))
+                sys.exit(0)
+        sys.exit(bulk_recover(filenames, args, logger, pipeline_pipes))
+
     if args.botid is None:
         filenames = glob.glob(os.path.join(DEFAULT_LOGGING_PATH, '*.dump'))
         if not len(filenames):
@@ -235,14 +472,17 @@ def main():
     answer = None
     delete_file = False
     while True:
-        with open(fname, 'r+') as handle:
-            try:
-                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
-            except BlockingIOError:
-                print(red('Dump file is currently locked. Stopping.'))
-                break
-            info = dump_info(fname, file_descriptor=handle)
-            handle.seek(0)
+        try:
+            handle = dump.DumpFile(fname, timeout=0)
+            handle.open()
+        except BlockingIOError:
+            print(red('Dump file is currently locked. Stopping.'))
+            break
+        except ValueError:
+            # the restricted actions are shown below
+            handle = None
+        try:
+            info = dump_info(fname, file_descriptor=handle) if handle else red('unable to load JSON')
             available_answers = ACTIONS.keys()
             print('Processing {}: {}'.format(bold(botid), info))
 
@@ -251,14 +491,10 @@ def main():
                 available_answers = [k for k, v in ACTIONS.items() if v[2]]
                 print('Restricted actions.')
             else:
+                meta = load_meta(handle)
+                available_opts = [item[0] for item in ACTIONS.values()]
                 # don't display list after 'show' and 'recover' command
                 if not (answer and isinstance(answer, list) and answer[0] in ['s', 'r']):
-                    content = json.load(handle)
-                    handle.seek(0)
-                    content = OrderedDict(sorted(content.items(), key=lambda t: t[0]))  # sort by key here, #1280
-                    meta = load_meta(content)
-
-                    available_opts = [item[0] for item in ACTIONS.values()]
                     for count, line in enumerate(meta):
                         print('{:3}: {} {}'.format(count, *line))
 
@@ -306,49 +542,23 @@ def main():
                 break
             elif answer[0] == 'e':
                 # Delete entries
-                for entry in ids:
-                    del content[meta[entry][0]]
-                save_file(handle, content)
+                handle.delete(ids)
             elif answer[0] == 'r':
                 # recover entries
-                default = utils.load_configuration(DEFAULTS_CONF_FILE)
-                runtime = utils.load_configuration(RUNTIME_CONF_FILE)
-                params = utils.load_parameters(default, runtime)
-                pipe = pipeline.PipelineFactory.create(params, logger)
+                if queue_name is None and len(answer) == 3:
+                    queue_name = answer[2]
+                recovered = []
                 try:
-                    for i, (key, entry) in enumerate([item for (count, item)
-                                                      in enumerate(content.items()) if count in ids]):
-                        if entry['message']:
-                            msg = copy.copy(entry['message'])  # otherwise the message field gets converted
-                            if isinstance(msg, dict):
-                                msg = json.dumps(msg)
-                        else:
-                            print('No message here, deleting entry.')
-                            del content[key]
-                            continue
-
-                        if queue_name is None:
-                            if len(answer) == 3:
-                                queue_name = answer[2]
-                            else:
-                                queue_name = entry['source_queue']
-                        if queue_name in pipeline_pipes:
-                            if runtime[pipeline_pipes[queue_name]]['group'] == 'Parser' and json.loads(msg)['__type'] == 'Event':
-                                print('Event converted to Report automatically.')
-                                msg = message.Report(message.MessageFactory.unserialize(msg)).serialize()
-                        try:
-                            pipe.set_queues(queue_name, 'destination')
-                            pipe.connect()
-                            pipe.send(msg)
-                        except exceptions.PipelineError:
-                            print(red('Could not reinject into queue {}: {}'
-                                      ''.format(queue_name, traceback.format_exc())))
-                        else:
-                            del content[key]
-                            print(green('Recovered dump {}.'.format(i)))
+                    pipe, runtime = create_pipeline(logger)
+                    recover(select_entries(handle, positions=ids), pipe, recovered,
+                            queue_name=queue_name, runtime=runtime, pipeline_pipes=pipeline_pipes)
+                except exceptions.PipelineError:
+                    print(red('Could not reinject into queue {}: {}'
+                              ''.format(queue_name, traceback.format_exc())))
                 finally:
-                    save_file(handle, content)
-                if not content:
+                    handle.delete(recovered)
+                    print(green('Recovered {} dumps.'.format(len(recovered))))
+                if not len(handle):
                     delete_file = True
                     print('Deleting empty file {}'.format(fname))
                     break
@@ -359,14 +569,22 @@ def main():
                 break
             elif answer[0] == 's':
                 # Show entries by id
-                for count, (key, orig_value) in enumerate(content.items()):
-                    value = copy.copy(orig_value)  # otherwise the raw field gets truncated
-                    if count not in ids:
+                for count in ids:
+                    try:
+                        value = handle[count]
+                    except ValueError:
+                        print('=' * 100, '\nShowing id {}\n'.format(count), '-' * 50)
+                        print(handle.read_line(count))
                         continue
-                    print('=' * 100, '\nShowing id {} {}\n'.format(count, key),
+                    print('=' * 100, '\nShowing id {} {}\n'.format(count, value['timestamp']),
                           '-' * 50)
-                    if isinstance(value['message'], (bytes, str)):
-                        value['message'] = json.loads(value['message'])
+                    if isinstance(value['message'], (bytes, str)) and 'message_encoding' not in value:
+                        try:
+                            value['message'] = json.loads(value['message'])
+                        except ValueError:
+                            # raw message which could not be unserialized by the bot
+                            pass
+                    if isinstance(value['message'], dict):
                         if ('raw' in value['message'] and
                                 len(value['message']['raw']) > 1000):
                             value['message']['raw'] = value['message'][
@@ -374,8 +592,13 @@ def main():
                     if type(value['traceback']) is not list:
                         value['traceback'] = value['traceback'].splitlines()
                     pprint.pprint(value)
+        finally:
+            if handle and delete_file:
+                handle.remove()
+            elif handle:
+                handle.close()
 
-    if delete_file:
+    if delete_file and os.path.exists(fname):
         os.remove(fname)
 
 
@@ -1,13 +1,30 @@
 # -*- coding: utf-8 -*-
+"""
+Cymru Whois expert, adds network information to the events.
+
+Parameters:
+
+    parallel_queries: int default: 16
+                      maximum number of DNS queries in flight at once
+
+The results of the prefix queries and the AS names are cached separately,
+many prefixes belong to the same AS. With the parameter batch_size, all events
+of a batch are looked up at once: the cached results with one round trip to the
+cache and the missing ones with concurrent DNS queries, so a slow answer does not
+delay the queries for the other events. Identical queries in flight are only
+made once.
+"""
 import json
 
 from intelmq.bots.experts.cymru_whois.lib import Cymru
 from intelmq.lib.bot import Bot
 from intelmq.lib.cache import Cache
 from intelmq.lib.harmonization import IPAddress
+from intelmq.lib.resolver import CoalescingExecutor
 
 MINIMUM_BGP_PREFIX_IPV4 = 24
 MINIMUM_BGP_PREFIX_IPV6 = 128
+ASN_CACHE_KEY = "AS%s"
 
 
 class CymruExpertBot(Bot):
@@ -18,53 +35,102 @@ def init(self):
                            self.parameters.redis_cache_db,
                            self.parameters.redis_cache_ttl,
                            getattr(self.parameters, "redis_cache_password",
-                                   None)
+                                   None),
+                           local_cache_size=getattr(self.parameters, "redis_cache_local_size", 0),
+                           local_cache_ttl=getattr(self.parameters, "redis_cache_local_ttl", None),
+                           counters=self.stats_counters,
                            )
+        self.executor = CoalescingExecutor(int(getattr(self.parameters, "parallel_queries", 16)))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
 
     def process(self):
         event = self.receive_message()
+        self.lookup([event])
+        self.send_message(event)
+        self.acknowledge_message()
+
+    def process_batch(self, events):
+        self.lookup(events)
+        self.send_message(*events)
 
+    def lookup(self, events):
+        """ Adds the network information of source and destination to the events. """
         keys = ["source.%s", "destination.%s"]
 
-        for key in keys:
-            ip_key = key % "ip"
+        lookups = []
+        for event in events:
+            for key in keys:
+                ip_key = key % "ip"
 
-            if ip_key not in event:
-                continue
+                if ip_key not in event:
+                    continue
 
-            ip = event.get(ip_key)
-            ip_version = IPAddress.version(ip)
-            ip_integer = IPAddress.to_int(ip)
+                ip = event.get(ip_key)
+                ip_version = IPAddress.version(ip)
+                ip_integer = IPAddress.to_int(ip)
 
-            if ip_version == 4:
-                minimum = MINIMUM_BGP_PREFIX_IPV4
+                if ip_version == 4:
+                    minimum = MINIMUM_BGP_PREFIX_IPV4
 
-            elif ip_version == 6:
-                minimum = MINIMUM_BGP_PREFIX_IPV6
+                elif ip_version == 6:
+                    minimum = MINIMUM_BGP_PREFIX_IPV6
 
-            else:
-                raise ValueError('Unexpected IP version '
-                                 '{!r}.'.format(ip_version))
+                else:
+                    raise ValueError('Unexpected IP version '
+                                     '{!r}.'.format(ip_version))
 
-            cache_key = bin(ip_integer)[2: minimum + 2]
-            result_json = self.cache.get(cache_key)
+                lookups.append((event, key, ip, bin(ip_integer)[2: minimum + 2]))
 
-            if result_json:
-                result = json.loads(result_json)
-            else:
-                result = Cymru.query(ip)
-                if not result:
-                    continue
-                result_json = json.dumps(result)
-                self.cache.set(cache_key, result_json)
+        new_results = {}
+        prefixes = self.resolve({cache_key: ip for _, _, ip, cache_key in lookups},
+                                Cymru.query_ip, new_results)
+        # results cached by previous versions include the AS name
+        asns = {ASN_CACHE_KEY % result['asn']: result['asn'] for result in prefixes.values()
+                if result and 'asn' in result and 'as_name' not in result}
+        as_names = self.resolve(asns, Cymru.query_asn, new_results)
+        self.cache.set_many({cache_key: json.dumps(result) for cache_key, result in new_results.items()})
+
+        for event, key, ip, cache_key in lookups:
+            result = prefixes[cache_key]
+            if not result:
+                continue
+            if 'asn' in result:
+                result = dict(result, **(as_names.get(ASN_CACHE_KEY % result['asn']) or {}))
 
             for result_key, result_value in result.items():
                 if result_key == 'registry' and result_value == 'other':
                     continue
                 event.add(key % result_key, result_value, overwrite=True)
 
-        self.send_message(event)
-        self.acknowledge_message()
+    def resolve(self, queries, function, new_results):
+        """
+        Looks up the cached results of the queries in one round trip and
+        resolves the missing ones concurrently.
+
+        Parameters:
+            queries: Cache keys and the arguments of the queries
+            function: The query function
+            new_results: Results of the queries to be cached are added here
+
+        Returns:
+            Cache keys and the results, None if there was no result
+        """
+        cache_keys = list(queries)
+        results = {}
+        futures = {}
+        for cache_key, cached in zip(cache_keys, self.cache.get_many(cache_keys)):
+            if cached:
+                results[cache_key] = json.loads(cached)
+            else:
+                futures[cache_key] = self.executor.submit(cache_key, function, queries[cache_key])
+        self.stats_counters['dns_queries'] += len(futures)
+        for cache_key, future in futures.items():
+            results[cache_key] = future.result()
+            if results[cache_key] is not None:
+                new_results[cache_key] = results[cache_key]
+        return results
 
 
 BOT = CymruExpertBot
@@ -21,6 +21,17 @@ class Cymru():
 
     @staticmethod
     def query(ip):
+        result = Cymru.query_ip(ip)
+        if result and "asn" in result:
+            result.update(Cymru.query_asn(result['asn']))
+        return result
+
+    @staticmethod
+    def query_ip(ip):
+        """
+        Network information of the most specific prefix of the IP address,
+        without the AS name. None if there is no result.
+        """
         raw_result = Cymru.__ip_query(ip)
         results = map(Cymru.__ip_query_parse, raw_result)
         result = None
@@ -40,13 +51,14 @@ def query(ip):
         if not result:
             return
 
-        if "asn" in result:
-            raw_result = Cymru.__asn_query(result['asn'])
-            extra_info = Cymru.__asn_query_parse(raw_result)
-            result.update(extra_info)
-
         return result
 
+    @staticmethod
+    def query_asn(asn):
+        """ Information on the ASN, the AS name. """
+        raw_result = Cymru.__asn_query(asn)
+        return Cymru.__asn_query_parse(raw_result)
+
     @staticmethod
     def __query(query):
         try:
@@ -20,10 +20,30 @@
     filter_keys: string with multiple keys separated by comma. Please
                  note that time.observation key is never consider by the
                  system because system will always ignore this key.
+
+    local_cache_size: int default: 0
+                      number of recently seen hashes kept in memory in front
+                      of redis, 0 disables the local cache
+
+    backend: string ["redis", "file"] default: "redis"
+             "file" stores the hashes in files instead of redis,
+             redis_cache_ttl is used as TTL
+
+    file_path: string default: /opt/intelmq/var/lib/bots/deduplicator
+               directory of the file backend, can only be used by one bot
+
+    file_slices: int default: 8
+                 number of time slices per TTL of the file backend
 """
+import os
 
+from intelmq import VAR_STATE_PATH
+from intelmq.bots.experts.deduplicator.lib import HashStore
 from intelmq.lib.bot import Bot
-from intelmq.lib.cache import Cache
+from intelmq.lib.cache import Cache, LRUCache
+from intelmq.lib.exceptions import InvalidArgument
+
+BACKENDS = ('redis', 'file')
 
 
 class DeduplicatorExpertBot(Bot):
@@ -31,16 +51,31 @@ class DeduplicatorExpertBot(Bot):
     _message_processed_verb = 'Forwarded'
 
     def init(self):
-        self.cache = Cache(self.parameters.redis_cache_host,
-                           self.parameters.redis_cache_port,
-                           self.parameters.redis_cache_db,
-                           self.parameters.redis_cache_ttl,
-                           getattr(self.parameters, "redis_cache_password",
-                                   None)
-                           )
+        self.backend = getattr(self.parameters, "backend", "redis")
+        if self.backend not in BACKENDS:
+            raise InvalidArgument('backend', got=self.backend, expected=BACKENDS)
+        if isinstance(getattr(self, 'cache', None), HashStore):
+            # initializing again, e.g. on SIGHUP
+            self.cache.close()
+        if self.backend == 'file':
+            self.cache = HashStore(getattr(self.parameters, "file_path",
+                                           os.path.join(VAR_STATE_PATH, "deduplicator")),
+                                   int(self.parameters.redis_cache_ttl),
+                                   int(getattr(self.parameters, "file_slices", 8)))
+        else:
+            self.cache = Cache(self.parameters.redis_cache_host,
+                               self.parameters.redis_cache_port,
+                               self.parameters.redis_cache_db,
+                               self.parameters.redis_cache_ttl,
+                               getattr(self.parameters, "redis_cache_password",
+                                       None)
+                               )
         self.filter_keys = {k.strip() for k in
                             self.parameters.filter_keys.split(',')}
         self.bypass = getattr(self.parameters, "bypass", False)
+        self.ttl = int(self.parameters.redis_cache_ttl)
+        local_cache_size = int(getattr(self.parameters, "local_cache_size", 0))
+        self.local_cache = LRUCache(local_cache_size) if local_cache_size else None
 
     def process(self):
         message = self.receive_message()
@@ -51,13 +86,34 @@ def process(self):
             message_hash = message.hash(filter_keys=self.filter_keys,
                                         filter_type=self.parameters.filter_type)
 
-            if not self.cache.exists(message_hash):
-                self.cache.set(message_hash, 'hash')
+            if not self.is_duplicate(message_hash):
                 self.send_message(message)
             else:
                 self.logger.debug('Dropped message.')
 
         self.acknowledge_message()
 
+    def is_duplicate(self, message_hash: str) -> bool:
+        """
+        Looks up the hash in the local cache first, then adds it to redis
+        or the file backend if it is not there yet, in one atomic command.
+        """
+        if self.local_cache is not None and message_hash in self.local_cache:
+            self.stats_counters['local_cache_hits'] += 1
+            return True
+        added, remaining = self.cache.add(message_hash, 'hash', self.ttl)
+        # keep the hash locally as long as it exists in the backend
+        if self.local_cache is not None and (remaining is None or remaining > 0):
+            self.local_cache.set(message_hash, True, remaining)
+        if added:
+            self.stats_counters['misses'] += 1
+            return False
+        self.stats_counters[self.backend + '_hits'] += 1
+        return True
+
+    def shutdown(self):
+        if isinstance(getattr(self, 'cache', None), HashStore):
+            self.cache.flush()
+
 
 BOT = DeduplicatorExpertBot
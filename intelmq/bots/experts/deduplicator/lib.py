@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent set of hashes with expiry, the file backend of the deduplicator.
+
+The keys are stored in time slices, one file per slice in the directory of the
+store. Each file is an open addressing hash table of 64 bit fingerprints of the
+keys and their expiry times, accessed with mmap. The memory of the bot does
+not grow with the number of keys, the operating system keeps the used pages of
+the files in its cache.
+
+New keys are added to the slice of the current time. A slice is deleted as a
+whole once all of its keys have expired, there is no expiry per key.
+
+A store can only be used by one process at once.
+"""
+import fcntl
+import glob
+import hashlib
+import math
+import mmap
+import os
+import struct
+import time
+from typing import Optional, Tuple
+
+__all__ = ['HashStore', 'Slice']
+
+MAGIC = b'IMQDEDUP'
+VERSION = 1
+# magic, version, capacity, count, maximum expiry
+HEADER = struct.Struct('<8sIQQQ')
+HEADER_SIZE = 64
+# each slot holds the fingerprint and the expiry time, 0 marks empty slots
+SLOT_SIZE = 16
+NEVER = 2 ** 64 - 1
+MIN_CAPACITY = 2 ** 16
+MAX_LOAD = 0.7
+SUFFIX = '.slice'
+
+
+def fingerprint(key: str) -> int:
+    """ Non-zero 64 bit fingerprint of the key. """
+    return int.from_bytes(hashlib.sha256(key.encode()).digest()[:8], 'little') or 1
+
+
+class Slice(object):
+    """
+    Hash table of fingerprints and expiry times in a memory mapped file,
+    using linear probing.
+
+    Parameters:
+        filename: Path of the file, created if it does not exist
+        capacity: Number of slots of a new file, rounded up to a power of two
+
+    Raises:
+        ValueError: If the file is not a valid slice
+    """
+
+    def __init__(self, filename: str, capacity: int = MIN_CAPACITY):
+        self.filename = filename
+        if not os.path.exists(filename):
+            capacity = 2 ** max(math.ceil(math.log2(max(capacity, MIN_CAPACITY))), 0)
+            self.__create(filename, capacity)
+        self.__open()
+
+    @staticmethod
+    def __create(filename: str, capacity: int):
+        temporary_filename = filename + '.tmp'
+        with open(temporary_filename, 'wb') as handle:
+            handle.write(HEADER.pack(MAGIC, VERSION, capacity, 0, 0).ljust(HEADER_SIZE, b'\0'))
+            handle.truncate(HEADER_SIZE + capacity * SLOT_SIZE)
+        os.replace(temporary_filename, filename)
+
+    def __open(self):
+        with open(self.filename, 'r+b') as handle:
+            self.map = mmap.mmap(handle.fileno(), 0)
+        magic, version, self.capacity, self.count, self.max_expiry = HEADER.unpack_from(self.map)
+        if (magic != MAGIC or version != VERSION or self.capacity & (self.capacity - 1) or
+                len(self.map) != HEADER_SIZE + self.capacity * SLOT_SIZE):
+            self.map.close()
+            raise ValueError('%r is not a valid slice file.' % self.filename)
+        self.mask = self.capacity - 1
+        # native byte order, slots are (fingerprint, expiry)
+        self.slots = memoryview(self.map)[HEADER_SIZE:].cast('Q')
+
+    def close(self):
+        self.slots.release()
+        self.map.close()
+
+    def __write_header(self):
+        HEADER.pack_into(self.map, 0, MAGIC, VERSION, self.capacity, self.count, self.max_expiry)
+
+    def __find(self, key_fingerprint: int) -> int:
+        """ Index of the slot with the fingerprint or of the empty slot where it belongs. """
+        slots = self.slots
+        index = key_fingerprint & self.mask
+        while True:
+            value = slots[2 * index]
+            if value == key_fingerprint or not value:
+                return index
+            index = (index + 1) & self.mask
+
+    def get(self, key_fingerprint: int, now: float) -> Optional[int]:
+        """ Expiry time of the fingerprint if it exists and has not expired. """
+        index = self.__find(key_fingerprint)
+        expiry = self.slots[2 * index + 1]
+        if self.slots[2 * index] and expiry > now:
+            return expiry
+        return None
+
+    def set(self, key_fingerprint: int, expiry: int):
+        if self.count + 1 > self.capacity * MAX_LOAD:
+            self.__grow()
+        index = self.__find(key_fingerprint)
+        if not self.slots[2 * index]:
+            self.slots[2 * index] = key_fingerprint
+            self.count += 1
+        self.slots[2 * index + 1] = expiry
+        self.max_expiry = max(self.max_expiry, expiry)
+        self.__write_header()
+
+    def __grow(self):
+        """ Rehashes all entries into a file with twice the capacity. """
+        old_slots = self.slots
+        temporary_filename = self.filename + '.grow'
+        if os.path.exists(temporary_filename):
+            os.remove(temporary_filename)
+        new = Slice(temporary_filename, self.capacity * 2)
+        for index in range(self.capacity):
+            if old_slots[2 * index]:
+                new.set(old_slots[2 * index], old_slots[2 * index + 1])
+        new.map.flush()
+        new.close()
+        self.close()
+        os.replace(temporary_filename, self.filename)
+        self.__open()
+
+    def expired(self, now: float) -> bool:
+        """ If all entries have expired. """
+        return self.max_expiry <= now
+
+
+class HashStore(object):
+    """
+    Persistent set of keys with expiry, with the same interface as
+    `intelmq.lib.cache.Cache.add`.
+
+    Parameters:
+        path: Directory of the slice files, created if it does not exist
+        ttl: Default time to live of the keys in seconds, no expiry if 0
+        slices: Number of slices per TTL. The files of expired keys are kept for
+            up to ttl / slices seconds.
+
+    Raises:
+        ValueError: If the store is used by another process or a slice file is invalid
+    """
+
+    def __init__(self, path: str, ttl: int, slices: int = 8):
+        self.path = path
+        self.ttl = ttl
+        self.slice_duration = max(ttl / slices, 1) if ttl else None
+        os.makedirs(path, exist_ok=True)
+        self.lock = open(os.path.join(path, 'lock'), 'w')
+        try:
+            fcntl.flock(self.lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.lock.close()
+            raise ValueError('The store %r is already used by another process.' % path)
+        # slice number: Slice, newest first
+        self.slices = {}
+        for filename in glob.glob(os.path.join(path, '*' + SUFFIX)):
+            number = int(os.path.basename(filename)[:-len(SUFFIX)])
+            self.slices[number] = Slice(filename)
+        self.order = sorted(self.slices, reverse=True)
+        self.current = None
+        self.rotate(time.time())
+
+    def __len__(self) -> int:
+        """ Number of stored keys, including expired ones not yet removed. """
+        return sum(current_slice.count for current_slice in self.slices.values())
+
+    def rotate(self, now: float):
+        """ Sets the slice for new keys and deletes the slices with only expired keys. """
+        number = int(now // self.slice_duration) if self.slice_duration else 0
+        for old_number in list(self.slices):
+            if old_number != number and self.slices[old_number].expired(now):
+                old_slice = self.slices.pop(old_number)
+                old_slice.close()
+                os.remove(old_slice.filename)
+        if number not in self.slices:
+            # most slices hold a similar number of keys, avoid growing the new one
+            previous = self.slices[self.order[0]].count if self.order and self.order[0] in self.slices else 0
+            self.slices[number] = Slice(os.path.join(self.path, '%d%s' % (number, SUFFIX)),
+                                        int(previous / MAX_LOAD) + 1)
+        self.order = sorted(self.slices, reverse=True)
+        self.current = number
+
+    def add(self, key: str, value=None, ttl: Optional[int] = None) -> Tuple[bool, Optional[float]]:
+        """
+        Adds the key if it does not exist yet. The value is ignored.
+
+        Returns:
+            added: If the key did not exist and has been added
+            remaining: Remaining time to live of the key in seconds, None if it does not expire
+        """
+        if ttl is None:
+            ttl = self.ttl
+        now = time.time()
+        if self.slice_duration and now // self.slice_duration != self.current:
+            self.rotate(now)
+        key_fingerprint = fingerprint(key)
+        for number in self.order:
+            expiry = self.slices[number].get(key_fingerprint, now)
+            if expiry is not None:
+                return False, None if expiry == NEVER else expiry - now
+        self.slices[self.current].set(key_fingerprint, math.ceil(now + ttl) if ttl else NEVER)
+        return True, ttl or None
+
+    def flush(self):
+        """ Writes all changes to the disk. """
+        for current_slice in self.slices.values():
+            current_slice.map.flush()
+
+    def close(self):
+        self.flush()
+        for current_slice in self.slices.values():
+            current_slice.close()
+        self.slices = {}
+        self.order = []
+        self.lock.close()
@@ -1,52 +1,78 @@
 # -*- coding: utf-8 -*-
 """
-These are all possible gaierrors according to the source:
-http://www.castaglia.org/proftpd/doc/devel-guide/src/lib/glibc-gai_strerror.c.html ::
-
-  # define EAI_BADFLAGS     -1    /* Invalid value for `ai_flags' field.  */
-  # define EAI_NONAME       -2    /* NAME or SERVICE is unknown.  */
-  # define EAI_AGAIN        -3    /* Temporary failure in name resolution.  */
-  # define EAI_FAIL         -4    /* Non-recoverable failure in name res.  */
-  # define EAI_NODATA       -5    /* No address associated with NAME.  */
-  # define EAI_FAMILY       -6    /* `ai_family' not supported.  */
-  # define EAI_SOCKTYPE     -7    /* `ai_socktype' not supported.  */
-  # define EAI_SERVICE      -8    /* SERVICE not supported for `ai_socktype'.  */
-  # define EAI_ADDRFAMILY   -9    /* Address family for NAME not supported.  */
-  # define EAI_MEMORY       -10   /* Memory allocation failure.  */
-  # define EAI_SYSTEM       -11   /* System error returned in `errno'.  */
-
-We treat some of them as valid (ie record does not exist) and other as temporary or
-permanent failure (default).
+Resolves the FQDN to the first IPv4 address (A record) with dnspython, so the
+answers can be cached for their TTL.
+
+Like the gaierrors EAI_NONAME, EAI_NODATA and EAI_FAIL of the previously used
+socket.gethostbyname, non-existing names (NXDOMAIN), names without A record and
+failing name servers (SERVFAIL) are treated as valid, i.e. the name has no
+address. Other errors like timeouts are treated as temporary failure.
+
+Parameters:
+
+    parallel_queries: int default: 16
+                      maximum number of DNS queries in flight at once
+
+    dns_cache_size: int default: 10000
+                    number of answers cached in memory, 0 disables the cache
+
+    dns_negative_ttl: int default: 60
+                      time in seconds non-existing names are cached
+
+With the parameter batch_size, the names of all events of a batch are resolved
+concurrently, each distinct name only once.
 """
-import socket
+import dns.resolver
 
 from intelmq.lib.bot import Bot
+from intelmq.lib.resolver import NEGATIVE_ANSWERS, Resolver
+
+# answers treated as valid, the name has no address
+NO_ADDRESS = NEGATIVE_ANSWERS + (dns.resolver.NoNameservers, )
 
 
 class GethostbynameExpertBot(Bot):
 
-    def process(self):
-        event = self.receive_message()
+    def init(self):
+        self.resolver = Resolver(workers=int(getattr(self.parameters, "parallel_queries", 16)),
+                                 cache_size=int(getattr(self.parameters, "dns_cache_size", 10000)),
+                                 negative_ttl=int(getattr(self.parameters, "dns_negative_ttl", 60)),
+                                 counters=self.stats_counters)
 
-        for key in ["source.", "destination."]:
-            key_fqdn = key + "fqdn"
-            key_ip = key + "ip"
-            if key_fqdn not in event:
-                continue
-            if key_ip in event:
-                continue
-            try:
-                ip = socket.gethostbyname(event.get(key_fqdn))
-            except socket.gaierror as exc:
-                if exc.args[0] in [-2, -4, -5, -8, -11]:
-                    pass
-                else:
-                    raise
-            else:
-                event.add(key_ip, ip, raise_failure=False)
+    def shutdown(self):
+        self.resolver.shutdown()
 
+    def process(self):
+        event = self.receive_message()
+        self.lookup([event])
         self.send_message(event)
         self.acknowledge_message()
 
+    def process_batch(self, events):
+        self.lookup(events)
+        self.send_message(*events)
+
+    def lookup(self, events):
+        """ Adds the IP addresses of source and destination FQDN to the events. """
+        lookups = []
+        for event in events:
+            for key in ["source.", "destination."]:
+                key_fqdn = key + "fqdn"
+                key_ip = key + "ip"
+                if key_fqdn not in event:
+                    continue
+                if key_ip in event:
+                    continue
+                lookups.append((event, key_ip, event.get(key_fqdn)))
+
+        answers = self.resolver.resolve_many(fqdn for _, _, fqdn in lookups)
+        for event, key_ip, fqdn in lookups:
+            answer, exc = answers[fqdn]
+            if exc is not None:
+                if isinstance(exc, NO_ADDRESS):
+                    continue
+                raise exc
+            event.add(key_ip, answer.records[0], raise_failure=False)
+
 
 BOT = GethostbynameExpertBot
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Malware name mapping expert, sets the malware family of events by the mapping
+of the malware name mapping project (https://github.com/certtools/malware_name_mapping).
+
+Parameters:
+
+    mapping_file: string
+                  path of the mapping, a CSV file with a regular expression
+                  in the first column and the family name in the second
+    overwrite: bool default: true
+               overwrite an existing classification.identifier
+    cache_size: int default: 10000
+                number of malware names whose family is cached, 0 disables
+                the cache
+
+The expressions are matched case-insensitively against the beginning of
+`malware.name`, the first matching line of the mapping wins, as in
+contrib/malware_name_mapping/apply_mapping_eventdb.py.
+"""
+import csv
+import re
+from typing import Iterable, List, Optional, Tuple
+
+from intelmq.lib.bot import Bot
+from intelmq.lib.cache import LRUCache
+from intelmq.lib.exceptions import InvalidArgument
+
+META_CHARACTERS = frozenset('.^$*+?{}[]|()')
+QUANTIFIERS = frozenset('*+?{')
+LITERAL = r'(?:[^\\.^$*+?{}\[\]|()]|\\[^A-Za-z0-9])'
+# a group of literal alternatives at the beginning, not repeated or optional
+GROUP_PREFIX = re.compile(r'\^?\((?:\?:)?(%s+(?:\|%s+)*)\)(?![*+?{])' % (LITERAL, LITERAL))
+UNESCAPE = re.compile(r'\\(.)')
+
+
+def is_ascii(value: str) -> bool:
+    try:
+        value.encode('ascii')
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def literal_prefixes(expression: str) -> Tuple[str, ...]:
+    """
+    Literal strings, one of which all matches of the expression start with,
+    for `re.match`.
+
+    Handles expressions starting with literal characters like `^zeus(bot)?$`
+    and with a group of literal alternatives like `^(zeus|zbot)`. Returns an
+    empty tuple for other expressions, e.g. starting with a character class
+    or with alternatives on the top level.
+    """
+    if has_alternatives(expression):
+        return ()
+    group = GROUP_PREFIX.match(expression)
+    if group:
+        return tuple(UNESCAPE.sub(r'\1', alternative) for alternative in group.group(1).split('|'))
+    characters = []
+    escaped = False
+    for position, character in enumerate(expression):
+        if escaped:
+            if character.isalnum():
+                # special sequences like \d, \b or backreferences
+                break
+            characters.append(character)
+            escaped = False
+        elif character == '\\':
+            escaped = True
+        elif character == '^' and position == 0:
+            continue
+        elif character in META_CHARACTERS:
+            if character in QUANTIFIERS and characters:
+                # the last character is optional or repeated
+                characters.pop()
+            break
+        else:
+            characters.append(character)
+    return (''.join(characters), ) if characters else ()
+
+
+def has_alternatives(expression: str) -> bool:
+    """ If the expression has a `|` outside of groups and character classes. """
+    depth = 0
+    escaped = in_class = False
+    for character in expression:
+        if escaped:
+            escaped = False
+        elif character == '\\':
+            escaped = True
+        elif in_class:
+            in_class = character != ']'
+        elif character == '[':
+            in_class = True
+        elif character == '(':
+            depth += 1
+        elif character == ')':
+            depth -= 1
+        elif character == '|' and not depth:
+            return True
+    return False
+
+
+class MalwareNameMapping(object):
+    """
+    Regular expressions and their family names, indexed by the literal
+    prefixes of the expressions.
+
+    As the expressions are matched at the beginning of the name, an
+    expression like `^zeus(bot)?$` can only match names starting with `zeus`.
+    The prefixes are kept in a hash table per length. For a name, only the
+    expressions with a prefix the name starts with and the expressions
+    without prefixes are matched, in their order.
+
+    Parameters:
+        mapping: The expressions and the family names
+    """
+
+    def __init__(self, mapping: Iterable[Tuple[str, str]] = ()):
+        # (compiled expression, family name)
+        self.__mapping = []
+        # length: {lowercase prefix: expression numbers}
+        self.__prefixes = {}
+        self.__unindexed = []
+        for expression, family in mapping:
+            self.add(expression, family)
+
+    @classmethod
+    def from_file(cls, filename: str) -> 'MalwareNameMapping':
+        """
+        Reads the mapping from a CSV file, the regular expression in the first
+        column and the family name in the second one. Rows with less than two
+        columns are ignored.
+
+        Raises:
+            ValueError: If an expression is not valid
+        """
+        mapping = cls()
+        with open(filename, newline='') as handle:
+            for number, row in enumerate(csv.reader(handle), start=1):
+                if len(row) < 2:
+                    continue
+                try:
+                    mapping.add(row[0], row[1])
+                except ValueError as exc:
+                    raise ValueError('Invalid expression in line %d of %r: %s' % (number, filename, exc))
+        return mapping
+
+    def add(self, expression: str, family: str):
+        """
+        Raises:
+            ValueError: If the expression is not valid
+        """
+        try:
+            regex = re.compile(expression, re.IGNORECASE)
+        except re.error as exc:
+            raise ValueError(str(exc))
+        number = len(self.__mapping)
+        self.__mapping.append((regex, family))
+        prefixes = literal_prefixes(expression)
+        # inline flags like (?x) change the meaning of the prefixes, non-ASCII characters have special case folding
+        if prefixes and not regex.flags & ~(re.IGNORECASE | re.UNICODE) and all(is_ascii(prefix) for prefix in prefixes):
+            for prefix in prefixes:
+                self.__prefixes.setdefault(len(prefix), {}).setdefault(prefix.lower(), set()).add(number)
+        else:
+            self.__unindexed.append(number)
+
+    def __len__(self) -> int:
+        return len(self.__mapping)
+
+    def candidates(self, name: str) -> List[int]:
+        """ The numbers of the expressions which can match the name, in ascending order. """
+        if not is_ascii(name):
+            return list(range(len(self.__mapping)))
+        lowercase = name.lower()
+        candidates = set(self.__unindexed)
+        for length, prefixes in self.__prefixes.items():
+            candidates.update(prefixes.get(lowercase[:length], ()))
+        return sorted(candidates)
+
+    def lookup(self, name: str) -> Optional[str]:
+        """ The family of the first expression matching the beginning of the name. """
+        for number in self.candidates(name):
+            regex, family = self.__mapping[number]
+            if regex.match(name):
+                return family
+        return None
+
+
+class MalwareNameMappingExpertBot(Bot):
+
+    def init(self):
+        self.logger.info("Loading the mapping %r.", self.parameters.mapping_file)
+        try:
+            self.mapping = MalwareNameMapping.from_file(self.parameters.mapping_file)
+        except IOError:
+            raise InvalidArgument('mapping_file', got=self.parameters.mapping_file, expected='readable file')
+        self.logger.info("Loaded %d expressions.", len(self.mapping))
+
+        self.overwrite = getattr(self.parameters, 'overwrite', True)
+        cache_size = getattr(self.parameters, 'cache_size', 10000)
+        self.cache = LRUCache(cache_size) if cache_size else None
+
+    def process(self):
+        event = self.receive_message()
+
+        if 'malware.name' in event:
+            family = self.lookup(event['malware.name'])
+            if family is None:
+                self.logger.debug('No mapping for malware name %r.', event['malware.name'])
+            else:
+                event.add('classification.identifier', family, overwrite=self.overwrite)
+
+        self.send_message(event)
+        self.acknowledge_message()
+
+    def lookup(self, name: str) -> Optional[str]:
+        """ The family of the malware name, cached. """
+        if self.cache is None:
+            return self.mapping.lookup(name)
+        family = self.cache.get(name, self)
+        if family is not self:
+            self.stats_counters['cache_hits'] += 1
+            return family
+        family = self.mapping.lookup(name)
+        self.cache.set(name, family)
+        return family
+
+
+BOT = MalwareNameMappingExpertBot
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+Compiled rules of the modify expert.
+
+The configuration is compiled once into a `Program`. Patterns are compiled
+regular expressions, patterns matching only literal strings (e.g.
+`^BlockList\\.de$` or `^(zeus|zbot)$`) are tested with string operations
+instead. The rules are indexed by the fields of their conditions, so for an
+event only the rules are tried whose fields exist and whose literal values
+are equal to the event's, in the order of the configuration.
+"""
+import re
+from collections import defaultdict
+from typing import Callable, List, Optional, Tuple
+
+__all__ = ['MatchGroupMapping', 'Program', 'parse_literal']
+
+META_CHARACTERS = frozenset('.^$*+?{}[]|()')
+
+
+class MatchGroupMapping:
+
+    """Wrapper for a regexp match object with a dict-like interface.
+    With this, we can access the match groups from within a format
+    replacement field.
+    """
+
+    def __init__(self, match):
+        self.match = match
+
+    def __getitem__(self, key):
+        return self.match.group(key)
+
+
+class LazyMatch:
+    """ Match of a literal pattern, the regular expression is only searched if a group is accessed. """
+
+    def __init__(self, regex, value: str):
+        self.regex = regex
+        self.value = value
+
+    def group(self, *groups):
+        return self.regex.search(self.value).group(*groups)
+
+
+def is_ascii(value: str) -> bool:
+    try:
+        value.encode('ascii')
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def tokenize(pattern: str) -> Optional[List[Tuple[bool, str]]]:
+    """
+    Splits the pattern into literal characters and meta characters.
+
+    Returns:
+        A list of (is_meta, character), None if the pattern contains special escapes like `\\d`
+    """
+    tokens = []
+    escaped = False
+    for character in pattern:
+        if escaped:
+            if character.isalnum() and is_ascii(character):
+                return None
+            tokens.append((False, character))
+            escaped = False
+        elif character == '\\':
+            escaped = True
+        else:
+            tokens.append((character in META_CHARACTERS, character))
+    if escaped:
+        return None
+    return tokens
+
+
+def parse_literal(pattern: str) -> Optional[Tuple[str, Tuple[str, ...]]]:
+    """
+    Recognizes patterns which can only match literal strings.
+
+    Returns:
+        The kind of the test, 'equal', 'prefix', 'suffix' or 'contains', and
+        the literal strings, None for other patterns. Only anchored patterns
+        like `^(a|b)$` have multiple literals.
+    """
+    tokens = tokenize(pattern)
+    if tokens is None:
+        return None
+    start = bool(tokens) and tokens[0] == (True, '^')
+    end = len(tokens) > start and tokens[-1] == (True, '$')
+    inner = tokens[start:len(tokens) - end]
+    if not any(is_meta for is_meta, _ in inner):
+        literal = ''.join(character for _, character in inner)
+        kind = {(True, True): 'equal', (True, False): 'prefix',
+                (False, True): 'suffix', (False, False): 'contains'}[start, end]
+        return kind, (literal, )
+    if not (start and end and len(inner) >= 2 and inner[0] == (True, '(') and inner[-1] == (True, ')')):
+        return None
+    inner = inner[1:-1]
+    if inner[:2] == [(True, '?'), (False, ':')]:
+        inner = inner[2:]
+    literals = ['']
+    for is_meta, character in inner:
+        if not is_meta:
+            literals[-1] += character
+        elif character == '|':
+            literals.append('')
+        else:
+            return None
+    return 'equal', tuple(literals)
+
+
+class Condition:
+    """
+    A condition of a rule on one field.
+
+    `check` returns None if the value does not match, otherwise the match
+    object for string patterns or True.
+    """
+
+    def __init__(self, identifier: str, name: str, rule, ignore_case: bool, logger):
+        self.identifier = identifier
+        self.name = name
+        self.rule = rule
+        self.logger = logger
+        # empty string means non-existent field
+        self.absent = rule == ''
+        self.literal = None
+        if isinstance(rule, str) and not self.absent:
+            self.regex = re.compile(rule, re.IGNORECASE if ignore_case else 0)
+            literal = parse_literal(rule)
+            if literal and (not ignore_case or all(is_ascii(value) for value in literal[1])):
+                self.literal = literal[0], tuple(value.lower() for value in literal[1]) if ignore_case else literal[1]
+            self.ignore_case = ignore_case
+            self.search = self.__compile_search()
+            self.check = self.check_string
+        else:
+            self.check = self.check_value
+
+    def __compile_search(self) -> Callable[[str], bool]:
+        if self.literal is None:
+            return None
+        kind, literals = self.literal
+        if kind == 'equal':
+            literals = frozenset(literals)
+            # $ also matches before a newline at the end
+            return lambda value: value in literals or (value[-1:] == '\n' and value[:-1] in literals)
+        literal = literals[0]
+        if kind == 'prefix':
+            return lambda value: value.startswith(literal)
+        elif kind == 'suffix':
+            return lambda value: value.endswith(literal) or value.endswith(literal + '\n')
+        return lambda value: literal in value
+
+    def check_string(self, value):
+        if isinstance(value, str):
+            pass
+        elif isinstance(value, (int, float)):
+            value = str(value)
+        else:
+            return self.warn(value)
+        if self.search is None:
+            return self.regex.search(value)
+        if self.ignore_case:
+            if not is_ascii(value):
+                return self.regex.search(value)
+            if self.search(value.lower()):
+                return LazyMatch(self.regex, value)
+            return None
+        if self.search(value):
+            return LazyMatch(self.regex, value)
+        return None
+
+    def check_value(self, value):
+        if not isinstance(self.rule, type(value)):
+            return self.warn(value)
+        elif value != self.rule:
+            return None
+        return True
+
+    def warn(self, value):
+        self.logger.warning("Type of rule (%r) and data (%r) do not "
+                            "match in %s, %s!",
+                            type(self.rule), type(value), self.identifier, self.name)
+        return True
+
+
+class Rule:
+
+    def __init__(self, identifier: str, selection: dict, action: dict, ignore_case: bool, logger):
+        self.identifier = identifier
+        self.conditions = [Condition(identifier, name, rule, ignore_case, logger)
+                           for name, rule in selection.items()]
+        self.action = action
+
+    def matches(self, event) -> Optional[dict]:
+        """ Returns the match objects of the string conditions if all conditions apply, otherwise None. """
+        matches = {}
+        for condition in self.conditions:
+            if condition.absent:
+                if condition.name in event:
+                    return None
+                continue
+            if condition.name not in event:
+                return None
+            match = condition.check(event[condition.name])
+            if match is None:
+                return None
+            if match is not True:
+                matches[condition.name] = match
+        return matches
+
+    def apply(self, event, matches: dict):
+        for name, value in self.action.items():
+            event.add(name, value.format(msg=event,
+                                         matches={k: MatchGroupMapping(v)
+                                                  for (k, v) in matches.items()}),
+                      overwrite=True)
+
+
+class Program:
+    """
+    The compiled rules of a modify configuration and their index.
+
+    A rule is indexed by one condition: a literal equality condition by the
+    field and the literal values, otherwise any condition requiring a field
+    by the field. Rules with only conditions on absent fields are tried for
+    all events.
+    """
+
+    def __init__(self, config: list, case_sensitive: bool, logger):
+        self.ignore_case = not case_sensitive
+        self.logger = logger
+        self.rules = [Rule(rule['rulename'], rule['if'], rule['then'], self.ignore_case, logger)
+                      for rule in config]
+        self.unindexed = []
+        # field: rule numbers
+        self.fields = defaultdict(list)
+        # field: {literal value: rule numbers}, field: rule numbers
+        self.equal = defaultdict(lambda: defaultdict(list))
+        self.equal_rules = defaultdict(list)
+        for number, rule in enumerate(self.rules):
+            self.__index(number, rule)
+        self.indexed_fields = set(self.fields) | set(self.equal)
+
+    def __index(self, number: int, rule: Rule):
+        for condition in rule.conditions:
+            if condition.literal and condition.literal[0] == 'equal':
+                for value in condition.literal[1]:
+                    self.equal[condition.name][value].append(number)
+                self.equal_rules[condition.name].append(number)
+                return
+        for condition in rule.conditions:
+            if not condition.absent:
+                self.fields[condition.name].append(number)
+                return
+        self.unindexed.append(number)
+
+    def candidates(self, event) -> List[int]:
+        """ The numbers of the rules which can match the event, in ascending order. """
+        candidates = set(self.unindexed)
+        for name, rules in self.fields.items():
+            if name in event:
+                candidates.update(rules)
+        for name, values in self.equal.items():
+            if name not in event:
+                continue
+            value = event[name]
+            if isinstance(value, (int, float)) and not isinstance(value, str):
+                value = str(value)
+            elif not isinstance(value, str) or (self.ignore_case and not is_ascii(value)):
+                # the regular expression or the type warning decide
+                candidates.update(self.equal_rules[name])
+                continue
+            if self.ignore_case:
+                value = value.lower()
+            candidates.update(values.get(value, ()))
+            if value[-1:] == '\n':
+                candidates.update(values.get(value[:-1], ()))
+        return sorted(candidates)
+
+    def process(self, event):
+        """ Applies all matching rules to the event, in their order. """
+        candidates = self.candidates(event)
+        current = 0
+        while current < len(candidates):
+            number = candidates[current]
+            current += 1
+            rule = self.rules[number]
+            matches = rule.matches(event)
+            if matches is None:
+                continue
+            self.logger.debug('Apply rule %s.', rule.identifier)
+            rule.apply(event, matches)
+            if self.indexed_fields.intersection(rule.action):
+                # the rule changed indexed fields
+                candidates = [candidate for candidate in self.candidates(event) if candidate > number]
+                current = 0
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Network list expert, tags, filters or routes events by lists of networks.
+
+Parameters:
+
+    file: string
+          path of the network list, one network per line, optionally followed
+          by whitespace and a value, e.g. the name of the constituency
+    fields: string default: "source.ip"
+            comma separated list of the IP address fields to look up
+    tag_field: string default: null
+               field to set to the value of the most specific matching network,
+               true for networks without value
+    overwrite: bool default: false
+               overwrite an existing value of the tag_field
+    action: string default: "tag"
+            "tag" forwards all events, "keep" forwards only the matching
+            ones and "drop" only the ones not matching
+
+Matching events are also sent to the path "match", the other events to the
+path "no_match", if these paths are configured.
+"""
+from intelmq.lib.bot import Bot
+from intelmq.lib.exceptions import InvalidArgument
+from intelmq.lib.networks import NetworkMap
+
+ACTIONS = ('tag', 'keep', 'drop')
+
+
+class NetworkListExpertBot(Bot):
+
+    _message_processed_verb = 'Forwarded'
+
+    def init(self):
+        self.logger.info("Loading the network list %r.", self.parameters.file)
+        try:
+            self.networks = NetworkMap.from_file(self.parameters.file)
+        except IOError:
+            raise InvalidArgument('file', got=self.parameters.file, expected='readable file')
+        self.logger.info("Loaded %d networks.", len(self.networks))
+
+        self.fields = [field.strip() for field in getattr(self.parameters, 'fields', 'source.ip').split(',')]
+        self.tag_field = getattr(self.parameters, 'tag_field', None)
+        self.overwrite = getattr(self.parameters, 'overwrite', False)
+        self.action = getattr(self.parameters, 'action', 'tag')
+        if self.action not in ACTIONS:
+            raise InvalidArgument('action', got=self.action, expected=ACTIONS)
+
+    def process(self):
+        event = self.receive_message()
+
+        value = None
+        for field in self.fields:
+            if field in event:
+                value = self.networks.lookup(event[field])
+                if value is not None:
+                    break
+
+        if value is None:
+            self.send_message(event, path='no_match', path_permissive=True)
+            if self.action != 'keep':
+                self.send_message(event)
+        else:
+            if self.tag_field:
+                event.add(self.tag_field, value, overwrite=self.overwrite)
+            self.send_message(event, path='match', path_permissive=True)
+            if self.action != 'drop':
+                self.send_message(event)
+        self.acknowledge_message()
+
+
+BOT = NetworkListExpertBot
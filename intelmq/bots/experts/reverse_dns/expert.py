@@ -7,16 +7,13 @@
 from intelmq.lib.bot import Bot
 from intelmq.lib.cache import Cache
 from intelmq.lib.harmonization import IPAddress
+from intelmq.lib.resolver import Resolver
 
 MINIMUM_BGP_PREFIX_IPV4 = 24
 MINIMUM_BGP_PREFIX_IPV6 = 128
 DNS_EXCEPTION_VALUE = "__dns-exception"
 
 
-class InvalidPTRResult(ValueError):
-    pass
-
-
 class ReverseDnsExpertBot(Bot):
 
     def init(self):
@@ -25,32 +22,65 @@ def init(self):
                            self.parameters.redis_cache_db,
                            self.parameters.redis_cache_ttl,
                            getattr(self.parameters, "redis_cache_password",
-                                   None)
+                                   None),
+                           local_cache_size=getattr(self.parameters, "redis_cache_local_size", 0),
+                           local_cache_ttl=getattr(self.parameters, "redis_cache_local_ttl", None),
+                           counters=self.stats_counters,
                            )
+        self.resolver = Resolver(workers=int(getattr(self.parameters, "parallel_queries", 16)),
+                                 cache_size=int(getattr(self.parameters, "dns_cache_size", 10000)),
+                                 negative_ttl=int(getattr(self.parameters, "dns_negative_ttl", 60)),
+                                 counters=self.stats_counters)
+
+    def shutdown(self):
+        self.resolver.shutdown()
 
     def process(self):
         event = self.receive_message()
+        self.lookup([event])
+        self.send_message(event)
+        self.acknowledge_message()
+
+    def process_batch(self, events):
+        self.lookup(events)
+        self.send_message(*events)
 
+    def lookup(self, events):
+        """ Adds the reverse DNS names of source and destination IP addresses to the events. """
         keys = ["source.%s", "destination.%s"]
 
-        for key in keys:
-            ip_key = key % "ip"
+        # look up the cache keys of all addresses in one round trip
+        lookups = []
+        for event in events:
+            for key in keys:
+                ip_key = key % "ip"
 
-            if ip_key not in event:
-                continue
+                if ip_key not in event:
+                    continue
+
+                ip = event.get(ip_key)
+                ip_version = IPAddress.version(ip)
+                ip_integer = IPAddress.to_int(ip)
+
+                if ip_version == 4:
+                    minimum = MINIMUM_BGP_PREFIX_IPV4
 
-            ip = event.get(ip_key)
-            ip_version = IPAddress.version(ip)
-            ip_integer = IPAddress.to_int(ip)
+                elif ip_version == 6:
+                    minimum = MINIMUM_BGP_PREFIX_IPV6
 
-            if ip_version == 4:
-                minimum = MINIMUM_BGP_PREFIX_IPV4
+                lookups.append((event, key, ip, bin(ip_integer)[2: minimum + 2]))
 
-            elif ip_version == 6:
-                minimum = MINIMUM_BGP_PREFIX_IPV6
+        cache_keys = list({cache_key for _, _, _, cache_key in lookups})
+        cached = dict(zip(cache_keys, self.cache.get_many(cache_keys)))
+        # resolve all addresses missing in the cache concurrently
+        answers = self.resolver.resolve_many(str(dns.reversename.from_address(ip))
+                                             for _, _, ip, cache_key in lookups
+                                             if not cached[cache_key])
+        new_results = {}
+        new_ttls = {}
 
-            cache_key = bin(ip_integer)[2: minimum + 2]
-            cachevalue = self.cache.get(cache_key)
+        for event, key, ip, cache_key in lookups:
+            cachevalue = cached[cache_key] or new_results.get(cache_key)
 
             result = None
             if cachevalue == DNS_EXCEPTION_VALUE:
@@ -58,34 +88,30 @@ def process(self):
             elif cachevalue:
                 result = cachevalue
             else:
-                rev_name = dns.reversename.from_address(ip)
-                try:
-                    results = dns.resolver.query(rev_name, "PTR")
-                    expiration = results.expiration
-                    for result in results:
-                        # use first valid result
-                        if event.is_valid('source.reverse_dns', str(result)):
-                            break
-                    else:
-                        raise InvalidPTRResult
-                except (dns.exception.DNSException, InvalidPTRResult) as e:
+                answer, exc = answers[str(dns.reversename.from_address(ip))]
+                if exc is not None and not isinstance(exc, dns.exception.DNSException):
+                    raise exc
+                if exc is None:
+                    # use first valid result
+                    result = next((record for record in answer.records
+                                   if event.is_valid('source.reverse_dns', record)), None)
+                if result is None:
                     # Set default TTL for 'DNS query name does not exist' error
-                    ttl = None if isinstance(e, dns.resolver.NXDOMAIN) else \
+                    ttl = None if isinstance(exc, dns.resolver.NXDOMAIN) else \
                         getattr(self.parameters, "cache_ttl_invalid_response",
                                 60)
-                    self.cache.set(cache_key, DNS_EXCEPTION_VALUE, ttl)
-                    result = None
-
+                    new_results[cache_key] = DNS_EXCEPTION_VALUE
+                    if ttl is not None:
+                        new_ttls[cache_key] = ttl
                 else:
-                    ttl = datetime.fromtimestamp(expiration) - datetime.now()
-                    self.cache.set(cache_key, str(result),
-                                   ttl=int(ttl.total_seconds()))
+                    ttl = datetime.fromtimestamp(answer.expiration) - datetime.now()
+                    new_results[cache_key] = result
+                    new_ttls[cache_key] = int(ttl.total_seconds())
 
             if result is not None:
-                event.add(key % 'reverse_dns', str(result), overwrite=True)
+                event.add(key % 'reverse_dns', result, overwrite=True)
 
-        self.send_message(event)
-        self.acknowledge_message()
+        self.cache.set_many(new_results, ttls=new_ttls)
 
 
 BOT = ReverseDnsExpertBot
@@ -19,10 +19,10 @@
 https://en.wikipedia.org/wiki/IPv4
 """
 
-import ipaddress
 from urllib.parse import urlparse
 
 from intelmq.lib.bot import Bot
+from intelmq.lib.networks import NetworkMap
 
 NETWORKS = ("10.0.0.0/8", "100.64.0.0/10", "127.0.0.0/8",
             "169.254.0.0/16", "172.16.0.0/12", "192.0.0.0/24", "192.0.2.0/24",
@@ -38,9 +38,7 @@ class RFC1918ExpertBot(Bot):
     def init(self):
         self.fields = self.parameters.fields.lower().strip().split(",")
         self.policy = self.parameters.policy.lower().strip().split(",")
-
-    def is_in_net(self, ip, iprange):
-        return ipaddress.ip_address(ip) in ipaddress.ip_network(iprange)
+        self.networks = NetworkMap(NETWORKS)
 
     def process(self):
         event = self.receive_message()
@@ -50,7 +48,7 @@ def process(self):
                 continue
             value = event.get(field)
             if field.endswith('.ip'):
-                check = any(self.is_in_net(value, iprange) for iprange in NETWORKS)
+                check = value in self.networks
             elif field.endswith('.fqdn'):
                 check = any(value.endswith(domain) for domain in DOMAINS)
             elif field.endswith('.url'):
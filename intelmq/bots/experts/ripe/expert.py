@@ -88,10 +88,15 @@ def __initialize_cache(self):
         cache_ttl = getattr(self.parameters, 'redis_cache_ttl')
         if cache_host and cache_port and cache_db and cache_ttl:
             self.__cache = Cache(cache_host, cache_port, cache_db, cache_ttl,
-                                 getattr(self.parameters, "redis_cache_password", None))
+                                 getattr(self.parameters, "redis_cache_password", None),
+                                 local_cache_size=getattr(self.parameters, "redis_cache_local_size", 0),
+                                 local_cache_ttl=getattr(self.parameters, "redis_cache_local_ttl", None),
+                                 counters=self.stats_counters)
+        self.__cached = {}
 
     def process(self):
         with self.event_context() as event:
+            self.__prefetch(event)
             for target in {'source.', 'destination.'}:
                 abuse_key = target + "abuse_contact"
                 abuse = set(event.get(abuse_key).split(',')) if self.__mode == 'append' and abuse_key in event else set()
@@ -129,8 +134,32 @@ def event_context(self):
             self.send_message(event)
             self.acknowledge_message()
 
+    def __prefetch(self, event):
+        """ Fetches the cached results of all queries for the event in one round trip. """
+        keys = []
+        for target in ('source.', 'destination.'):
+            asn = event.get(target + "asn", None)
+            if asn:
+                if self.__query['stat_asn']:
+                    keys.append('stat:{}'.format(asn))
+                if self.__query['db_asn']:
+                    keys.append('db_asn:{}'.format(asn))
+            ip = event.get(target + "ip", None)
+            if ip:
+                if self.__query['stat_ip']:
+                    keys.append('stat:{}'.format(ip))
+                if self.__query['db_ip']:
+                    keys.append('db_ip:{}'.format(ip))
+                if self.__query['stat_geo']:
+                    keys.append('stat_geolocation:{}'.format(ip))
+        self.__cached = dict(zip(keys, self.__cache.get_many(keys))) if keys else {}
+
     def __perform_cached_query(self, type, resource):
-        cached_value = self.__cache.get('{}:{}'.format(type, resource))
+        cache_key = '{}:{}'.format(type, resource)
+        if cache_key in self.__cached:
+            cached_value = self.__cached[cache_key]
+        else:
+            cached_value = self.__cache.get(cache_key)
         if cached_value:
             if cached_value == CACHE_NO_VALUE:
                 return {}
@@ -143,20 +172,25 @@ def __perform_cached_query(self, type, resource):
                     """ If no abuse contact could be found, a 404 is given. """
                     try:
                         if response.json()['message'].startswith('No abuse contact found for '):
-                            self.__cache.set('{}:{}'.format(type, resource), CACHE_NO_VALUE)
+                            self.__set_cache(cache_key, CACHE_NO_VALUE)
                             return {}
                     except ValueError:
                         pass
                 raise ValueError(STATUS_CODE_ERROR.format(response.status_code))
             try:
                 data = self.REPLY_TO_DATA[type](response.json())
-                self.__cache.set('{}:{}'.format(type, resource),
+                self.__set_cache(cache_key,
                                  (json.dumps(list(data) if isinstance(data, set) else data) if data else CACHE_NO_VALUE))
                 return data
             except (KeyError, IndexError):
-                self.__cache.set('{}:{}'.format(type, resource), CACHE_NO_VALUE)
+                self.__set_cache(cache_key, CACHE_NO_VALUE)
 
             return {}
 
+    def __set_cache(self, cache_key, value):
+        self.__cache.set(cache_key, value)
+        # the same resource may be queried again for the other target
+        self.__cached[cache_key] = value
+
 
 BOT = RIPEExpertBot
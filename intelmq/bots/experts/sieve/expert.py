@@ -6,14 +6,17 @@
     file: string
 """
 import ipaddress
+import operator
 import os
 import re
 import traceback
 
 import intelmq.lib.exceptions as exceptions
 from intelmq import HARMONIZATION_CONF_FILE
+from intelmq.bots.experts.sieve.lib import RuleIndex, is_numeric
 from intelmq.lib import utils
 from intelmq.lib.bot import Bot
+from intelmq.lib.networks import NetworkMap
 
 try:
     import textx.model
@@ -29,6 +32,15 @@ class Procedure:
     DROP = 3      # stop processing and drop event
 
 
+NUMERIC_OPERATORS = {'==': operator.eq,
+                     '!=': operator.ne,
+                     '<=': operator.le,
+                     '>=': operator.ge,
+                     '<': operator.lt,
+                     '>': operator.gt,
+                     }
+
+
 class SieveExpertBot(Bot):
     _message_processed_verb = 'Forwarded'
 
@@ -41,6 +53,8 @@ def init(self):
 
         self.metamodel = SieveExpertBot.init_metamodel()
         self.sieve = SieveExpertBot.read_sieve_file(self.parameters.file, self.metamodel)
+        self.rules = SieveExpertBot.compile_sieve(self.sieve, self.logger)
+        self.index = SieveExpertBot.index_sieve(self.sieve)
 
     @staticmethod
     def init_metamodel():
@@ -86,16 +100,7 @@ def check(parameters):
 
     def process(self):
         event = self.receive_message()
-        procedure = Procedure.CONTINUE
-        if self.sieve:  # empty rules file results in empty string
-            for rule in self.sieve.rules:
-                procedure = self.process_rule(rule, event)
-                if procedure == Procedure.KEEP:
-                    self.logger.debug('Stop processing based on rule at %s: %s.', self.get_linecol(rule), event)
-                    break
-                elif procedure == Procedure.DROP:
-                    self.logger.debug('Dropped event based on rule at %s: %s.', self.get_linecol(rule), event)
-                    break
+        procedure = SieveExpertBot.apply_rules(self.rules, event, self.logger, self.index)
 
         # forwarding decision
         if procedure != Procedure.DROP:
@@ -104,152 +109,330 @@ def process(self):
 
         self.acknowledge_message()
 
-    def process_rule(self, rule, event):
-        # process mandatory 'if' clause
-        if self.match_expression(rule.if_.expr, event):
-            self.logger.debug('Matched event based on rule at %s: %s.', self.get_linecol(rule.if_), event)
-            for action in rule.if_.actions:
-                procedure = self.process_action(action.action, event)
-                if procedure != Procedure.CONTINUE:
-                    return procedure
-            return Procedure.CONTINUE
+    @staticmethod
+    def apply_rules(rules, event, logger, index=None):
+        """
+        Applies the compiled rules to the event and returns the procedure.
+        With an index, only the rules which can match the event are evaluated.
+        """
+        procedure = Procedure.CONTINUE
+        candidates = range(len(rules)) if index is None else index.candidates(event)
+        current = 0
+        while current < len(candidates):
+            number = candidates[current]
+            current += 1
+            rule, position = rules[number]
+            keys = index.modifying.get(number) if index is not None else None
+            if keys:
+                before = [event.get(key) for key in keys]
+            procedure = rule(event)
+            if keys and [event.get(key) for key in keys] != before:
+                # the rule changed indexed keys
+                candidates = [candidate for candidate in index.candidates(event) if candidate > number]
+                current = 0
+            if procedure == Procedure.KEEP:
+                logger.debug('Stop processing based on rule at %s: %s.', position, event)
+                break
+            elif procedure == Procedure.DROP:
+                logger.debug('Dropped event based on rule at %s: %s.', position, event)
+                break
+        return procedure
 
-        # process optional 'elif' clauses
-        for clause in rule.elif_:
-            if self.match_expression(clause.expr, event):
-                self.logger.debug('Matched event based on rule at %s: %s.', self.get_linecol(clause), event)
-                for action in clause.actions:
-                    procedure = self.process_action(action.action, event)
-                    if procedure != Procedure.CONTINUE:
-                        return procedure
-                return Procedure.CONTINUE
-
-        # process optional 'else' clause
-        if rule.else_:
-            self.logger.debug('Matched event based on rule at %s: %s.', self.get_linecol(rule.else_), event)
-            for action in rule.else_.actions:
-                procedure = self.process_action(action.action, event)
-                if procedure != Procedure.CONTINUE:
-                    return procedure
+    @staticmethod
+    def compile_sieve(sieve, logger):
+        """
+        Compiles the rules of the sieve model into closures.
 
-        return Procedure.CONTINUE
+        Regular expressions, networks and value lists are prepared once here,
+        so the evaluation of an event does not need to walk the model.
+
+        Returns:
+            A list of the compiled rules, functions of the event returning the
+            procedure, and their positions in the sieve file
+        """
+        if not sieve:  # empty rules file results in empty string
+            return []
+        return [(SieveExpertBot.compile_rule(rule, logger), SieveExpertBot.get_linecol(rule))
+                for rule in sieve.rules]
+
+    @staticmethod
+    def index_sieve(sieve):
+        """
+        Indexes the rules of the sieve model by their equality, IP range and
+        substring conditions.
 
-    def match_expression(self, expr, event):
+        A rule is indexed if each of its clauses has such a condition which
+        must be true for the clause to match. Rules with an else clause and
+        rules with other conditions are evaluated for all events.
+        """
+        index = RuleIndex()
+        if not sieve:
+            return index
+        for number, rule in enumerate(sieve.rules):
+            guards = None if rule.else_ else []
+            for clause in [rule.if_] + list(rule.elif_):
+                if guards is None:
+                    break
+                clause_guards = SieveExpertBot.expression_guards(clause.expr)
+                guards = None if clause_guards is None else guards + clause_guards
+            if guards is None:
+                index.add_unindexed(number)
+                continue
+            for kind, key, values in guards:
+                index.add(kind, key, values, number)
+        for number, rule in enumerate(sieve.rules):
+            clauses = [rule.if_] + list(rule.elif_) + ([rule.else_] if rule.else_ else [])
+            index.add_modifying([action.action.key for clause in clauses for action in clause.actions
+                                 if hasattr(action.action, 'key')], number)
+        return index
+
+    @staticmethod
+    def expression_guards(expr):
+        """
+        Conditions of which at least one must be true for the expression to match,
+        as a list of (kind, key, values), or None if there are no such indexable conditions.
+        """
+        guards = []
         for conj in expr.conj:
-            if self.process_conjunction(conj, event):
-                return True
-        return False
+            # one indexable condition of the conjunction is sufficient
+            for cond in conj.cond:
+                conj_guards = SieveExpertBot.condition_guards(cond.match)
+                if conj_guards is not None:
+                    break
+            else:
+                return None
+            guards.extend(conj_guards)
+        return guards
 
-    def process_conjunction(self, conj, event):
-        for cond in conj.cond:
-            if not self.process_condition(cond, event):
-                return False
-        return True
+    @staticmethod
+    def condition_guards(match):
+        match_type = match.__class__.__name__
+        if match_type == 'StringMatch':
+            values = SieveExpertBot.get_values(match.value)
+            if match.op == '==':
+                return [('equal', match.key, values)]
+            elif match.op == ':contains' and all(values):
+                return [('contains', match.key, values)]
+        elif match_type == 'NumericMatch' and match.op == '==':
+            return [('numeric_equal', match.key,
+                     [val for val in SieveExpertBot.get_values(match.value) if is_numeric(val)])]
+        elif match_type == 'IpRangeMatch':
+            return [('networks', match.key, SieveExpertBot.get_values(match.range))]
+        elif match_type == 'Expression':
+            return SieveExpertBot.expression_guards(match)
+        return None
 
-    def process_condition(self, cond, event):
-        match = cond.match
-        if match.__class__.__name__ == 'ExistMatch':
-            return self.process_exist_match(match.key, match.op, event)
-        elif match.__class__.__name__ == 'StringMatch':
-            return self.process_string_match(match.key, match.op, match.value, event)
-        elif match.__class__.__name__ == 'NumericMatch':
-            return self.process_numeric_match(match.key, match.op, match.value, event)
-        elif match.__class__.__name__ == 'IpRangeMatch':
-            return self.process_ip_range_match(match.key, match.range, event)
-        elif match.__class__.__name__ == 'Expression':
-            return self.match_expression(match, event)
+    @staticmethod
+    def get_values(value):
+        """ The values of a single value or of a list of values. """
+        if value.__class__.__name__.startswith('Single'):
+            return [value.value]
+        return [val.value for val in value.values]
 
     @staticmethod
-    def process_exist_match(key, op, event):
-        if op == ':exists':
-            return key in event
-        elif op == ':notexists':
-            return key not in event
-
-    def process_string_match(self, key, op, value, event):
-        if key not in event:
-            return op == '!=' or op == '!~' or op == ':notcontains'
-
-        if value.__class__.__name__ == 'SingleStringValue':
-            return self.process_string_operator(event[key], op, value.value)
-        elif value.__class__.__name__ == 'StringValueList':
-            for val in value.values:
-                if self.process_string_operator(event[key], op, val.value):
+    def compile_rule(rule, logger):
+        # mandatory 'if' clause, optional 'elif' clauses and optional 'else' clause
+        clauses = [(SieveExpertBot.compile_expression(clause.expr, logger),
+                    SieveExpertBot.compile_actions(clause.actions),
+                    SieveExpertBot.get_linecol(clause))
+                   for clause in [rule.if_] + list(rule.elif_)]
+        if rule.else_:
+            clauses.append((lambda event: True,
+                            SieveExpertBot.compile_actions(rule.else_.actions),
+                            SieveExpertBot.get_linecol(rule.else_)))
+
+        def process_rule(event):
+            for match, actions, position in clauses:
+                if match(event):
+                    logger.debug('Matched event based on rule at %s: %s.', position, event)
+                    for action in actions:
+                        procedure = action(event)
+                        if procedure != Procedure.CONTINUE:
+                            return procedure
+                    return Procedure.CONTINUE
+            return Procedure.CONTINUE
+        return process_rule
+
+    @staticmethod
+    def compile_expression(expr, logger):
+        conjunctions = [SieveExpertBot.compile_conjunction(conj, logger) for conj in expr.conj]
+        if len(conjunctions) == 1:
+            return conjunctions[0]
+
+        def match_expression(event):
+            for conjunction in conjunctions:
+                if conjunction(event):
                     return True
             return False
+        return match_expression
+
+    @staticmethod
+    def compile_conjunction(conj, logger):
+        conditions = [SieveExpertBot.compile_condition(cond, logger) for cond in conj.cond]
+        if len(conditions) == 1:
+            return conditions[0]
+
+        def match_conjunction(event):
+            for condition in conditions:
+                if not condition(event):
+                    return False
+            return True
+        return match_conjunction
 
     @staticmethod
-    def process_string_operator(lhs, op, rhs):
+    def compile_condition(cond, logger):
+        match = cond.match
+        match_type = match.__class__.__name__
+        if match_type == 'ExistMatch':
+            return SieveExpertBot.compile_exist_match(match.key, match.op)
+        elif match_type == 'StringMatch':
+            return SieveExpertBot.compile_string_match(match.key, match.op, match.value)
+        elif match_type == 'NumericMatch':
+            return SieveExpertBot.compile_numeric_match(match.key, match.op, match.value)
+        elif match_type == 'IpRangeMatch':
+            return SieveExpertBot.compile_ip_range_match(match.key, match.range, logger)
+        elif match_type == 'Expression':
+            return SieveExpertBot.compile_expression(match, logger)
+        raise ValueError('Unknown condition %r.' % match_type)
+
+    @staticmethod
+    def compile_exist_match(key, op):
+        if op == ':exists':
+            return lambda event: key in event
+        return lambda event: key not in event
+
+    @staticmethod
+    def compile_string_match(key, op, value):
+        missing = op in ('!=', '!~', ':notcontains')
+        values = SieveExpertBot.get_values(value)
+
         if op == '==':
-            return lhs == rhs
+            values = frozenset(values)
+
+            def match_values(lhs):
+                return lhs in values
         elif op == '!=':
-            return lhs != rhs
+            values = frozenset(values)
+
+            def match_values(lhs):
+                # true if any of the values differs
+                return len(values) > 1 or lhs not in values
+        elif op in ('=~', '!~'):
+            regexes = [re.compile(val) for val in values]
+            if op == '=~':
+                def match_values(lhs):
+                    for regex in regexes:
+                        if regex.search(lhs) is not None:
+                            return True
+                    return False
+            else:
+                def match_values(lhs):
+                    for regex in regexes:
+                        if regex.search(lhs) is None:
+                            return True
+                    return False
         elif op == ':contains':
-            return lhs.find(rhs) >= 0
+            def match_values(lhs):
+                for val in values:
+                    if lhs.find(val) >= 0:
+                        return True
+                return False
         elif op == ':notcontains':
-            return lhs.find(rhs) == -1
-        elif op == '=~':
-            return re.search(rhs, lhs) is not None
-        elif op == '!~':
-            return re.search(rhs, lhs) is None
-
-    def process_numeric_match(self, key, op, value, event):
-        if key not in event:
-            return False
+            def match_values(lhs):
+                for val in values:
+                    if lhs.find(val) == -1:
+                        return True
+                return False
+        else:
+            raise ValueError('Unknown string operator %r.' % op)
 
-        if value.__class__.__name__ == 'SingleNumericValue':
-            return self.process_numeric_operator(event[key], op, value.value)
-        elif value.__class__.__name__ == 'NumericValueList':
-            for val in value.values:
-                if self.process_numeric_operator(event[key], op, val.value):
-                    return True
-            return False
+        def match_string(event):
+            if key not in event:
+                return missing
+            return match_values(event[key])
+        return match_string
 
-    def process_numeric_operator(self, lhs, op, rhs):
-        if not self.is_numeric(lhs) or not self.is_numeric(rhs):
-            return False
-        return eval(str(lhs) + op + str(rhs))
+    @staticmethod
+    def compile_numeric_match(key, op, value):
+        # non-numeric values never match
+        values = [val for val in SieveExpertBot.get_values(value) if is_numeric(val)]
+        compare = NUMERIC_OPERATORS[op]
+        if op == '==':
+            value_set = frozenset(values)
 
-    def process_ip_range_match(self, key, ip_range, event):
-        if key not in event:
-            return False
+            def match_values(lhs):
+                return lhs in value_set
+        else:
+            def match_values(lhs):
+                for val in values:
+                    if compare(lhs, val):
+                        return True
+                return False
 
-        try:
-            addr = ipaddress.ip_address(event[key])
-        except ValueError:
-            self.logger.warning("Could not parse IP address %s=%s in %s.", key, event[key], event)
-            return False
+        def match_numeric(event):
+            if key not in event:
+                return False
+            lhs = event[key]
+            if not is_numeric(lhs):
+                return False
+            if isinstance(lhs, str):
+                lhs = float(lhs)
+            return match_values(lhs)
+        return match_numeric
 
-        if ip_range.__class__.__name__ == 'SingleIpRange':
-            network = ipaddress.ip_network(ip_range.value, strict=False)
-            return addr in network
-        elif ip_range.__class__.__name__ == 'IpRangeList':
-            for val in ip_range.values:
-                network = ipaddress.ip_network(val.value, strict=False)
-                if addr in network:
-                    return True
-        return False
+    @staticmethod
+    def compile_ip_range_match(key, ip_range, logger):
+        networks = NetworkMap(SieveExpertBot.get_values(ip_range))
+
+        def match_ip_range(event):
+            if key not in event:
+                return False
+
+            try:
+                return bool(networks.lookup_all(event[key]))
+            except ValueError:
+                logger.warning("Could not parse IP address %s=%s in %s.", key, event[key], event)
+                return False
+        return match_ip_range
 
     @staticmethod
-    def process_action(action, event):
+    def compile_actions(actions):
+        return [SieveExpertBot.compile_action(action.action) for action in actions]
+
+    @staticmethod
+    def compile_action(action):
+        """ Returns a function of the event applying the action and returning the procedure. """
         if action == 'drop':
-            return Procedure.DROP
+            return lambda event: Procedure.DROP
         elif action == 'keep':
-            return Procedure.KEEP
-        elif action.__class__.__name__ == 'PathAction':
-            event.path = action.path
-        elif action.__class__.__name__ == 'AddAction':
-            if action.key not in event:
-                event.add(action.key, action.value)
-        elif action.__class__.__name__ == 'AddForceAction':
-            event.add(action.key, action.value, overwrite=True)
-        elif action.__class__.__name__ == 'UpdateAction':
-            if action.key in event:
-                event.change(action.key, action.value)
-        elif action.__class__.__name__ == 'RemoveAction':
-            if action.key in event:
-                del event[action.key]
-        return Procedure.CONTINUE
+            return lambda event: Procedure.KEEP
+
+        action_type = action.__class__.__name__
+        if action_type == 'PathAction':
+            def apply(event):
+                event.path = action.path
+        elif action_type == 'AddAction':
+            def apply(event):
+                if action.key not in event:
+                    event.add(action.key, action.value)
+        elif action_type == 'AddForceAction':
+            def apply(event):
+                event.add(action.key, action.value, overwrite=True)
+        elif action_type == 'UpdateAction':
+            def apply(event):
+                if action.key in event:
+                    event.change(action.key, action.value)
+        elif action_type == 'RemoveAction':
+            def apply(event):
+                if action.key in event:
+                    del event[action.key]
+        else:
+            raise ValueError('Unknown action %r.' % action_type)
+
+        def apply_action(event):
+            apply(event)
+            return Procedure.CONTINUE
+        return apply_action
 
     @staticmethod
     def validate_ip_range(ip_range):
@@ -311,7 +494,7 @@ def validate_ip_address(ipaddr):
     @staticmethod
     def is_numeric(num):
         """ Returns True if argument is a number (integer or float). """
-        return str(num).lstrip('-').replace('.', '', 1).isnumeric()
+        return is_numeric(num)
 
     @staticmethod
     def get_linecol(model_obj, as_dict=False):
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Indexes of the sieve rules, selecting the rules which can match an event.
+
+A rule is indexed by conditions which are necessary for any of its clauses to
+match, e.g. `feed.name == 'A'` or `source.ip << '10.0.0.0/8'`. For an event,
+the index returns the numbers of the rules whose conditions can be true, and
+of the rules which could not be indexed, in the original order. The rules are
+evaluated as before, the index only skips rules which can not match.
+
+Rules with actions changing indexed keys are marked with `add_modifying`, the
+candidates for the following rules have to be looked up again if they changed
+the event.
+"""
+from collections import defaultdict, deque
+from typing import Hashable, Iterable, List, Set
+
+from intelmq.lib.networks import NetworkMap
+
+__all__ = ['AhoCorasick', 'is_numeric', 'RuleIndex']
+
+
+def is_numeric(num) -> bool:
+    """ Returns True if argument is a number (integer or float). """
+    return str(num).lstrip('-').replace('.', '', 1).isnumeric()
+
+
+class AhoCorasick(object):
+    """
+    Aho-Corasick automaton, finding all occurrences of multiple strings in a
+    text with a single pass over the text.
+
+    Strings are added with a value, `search` returns the values of all strings
+    occurring in the text.
+    """
+
+    def __init__(self):
+        # state: {character: next state}
+        self.transitions = [{}]
+        self.failures = [0]
+        self.outputs = [set()]
+        self.built = False
+
+    def add(self, needle: str, value: Hashable):
+        if not needle:
+            raise ValueError('Can not index the empty string.')
+        state = 0
+        for character in needle:
+            next_state = self.transitions[state].get(character)
+            if next_state is None:
+                next_state = len(self.transitions)
+                self.transitions.append({})
+                self.failures.append(0)
+                self.outputs.append(set())
+                self.transitions[state][character] = next_state
+            state = next_state
+        self.outputs[state].add(value)
+        self.built = False
+
+    def build(self):
+        """ Computes the failure links, in breadth-first order of the states. """
+        queue = deque(self.transitions[0].values())
+        for state in queue:
+            self.failures[state] = 0
+        while queue:
+            state = queue.popleft()
+            for character, next_state in self.transitions[state].items():
+                queue.append(next_state)
+                failure = self.failures[state]
+                while failure and character not in self.transitions[failure]:
+                    failure = self.failures[failure]
+                self.failures[next_state] = self.transitions[failure].get(character, 0)
+                self.outputs[next_state] |= self.outputs[self.failures[next_state]]
+        self.built = True
+
+    def search(self, text: str) -> Set[Hashable]:
+        if not self.built:
+            self.build()
+        transitions = self.transitions
+        failures = self.failures
+        outputs = self.outputs
+        found = set()
+        state = 0
+        for character in text:
+            while state and character not in transitions[state]:
+                state = failures[state]
+            state = transitions[state].get(character, 0)
+            if outputs[state]:
+                found |= outputs[state]
+        return found
+
+
+class RuleIndex(object):
+    """
+    Index of the rules by the keys and values of their conditions.
+
+    The rules are identified by their numbers, rules without indexed
+    conditions are added with `add_unindexed`.
+    """
+
+    def __init__(self):
+        self.unindexed = set()
+        # rule number: keys changed by its actions
+        self.modifying = {}
+        # key: {value: rule numbers}
+        self.equal = defaultdict(lambda: defaultdict(set))
+        self.numeric_equal = defaultdict(lambda: defaultdict(set))
+        # key: NetworkMap, key: rule numbers
+        self.networks = defaultdict(NetworkMap)
+        self.network_rules = defaultdict(set)
+        # key: AhoCorasick, key: rule numbers
+        self.contains = defaultdict(AhoCorasick)
+        self.contains_rules = defaultdict(set)
+
+    def add(self, kind: str, key: str, values: Iterable, rule: int):
+        """ Adds a condition of the kind `equal`, `numeric_equal`, `networks` or `contains`. """
+        getattr(self, 'add_' + kind)(key, values, rule)
+
+    def add_unindexed(self, rule: int):
+        self.unindexed.add(rule)
+
+    def add_modifying(self, keys: Iterable[str], rule: int):
+        """ Marks the rule if its actions change any of the indexed keys. """
+        indexed = self.keys()
+        for key in keys:
+            for indexed_key in indexed:
+                if key == indexed_key or key.startswith(indexed_key + '.') or indexed_key.startswith(key + '.'):
+                    self.modifying[rule] = sorted(set(keys))
+                    return
+
+    def keys(self) -> Set[str]:
+        """ All indexed keys. """
+        return set(self.equal) | set(self.numeric_equal) | set(self.networks) | set(self.contains)
+
+    def add_equal(self, key: str, values: Iterable, rule: int):
+        for value in values:
+            self.equal[key][value].add(rule)
+
+    def add_numeric_equal(self, key: str, values: Iterable, rule: int):
+        for value in values:
+            self.numeric_equal[key][value].add(rule)
+
+    def add_networks(self, key: str, networks: Iterable[str], rule: int):
+        for network in networks:
+            self.networks[key].add(network, rule)
+        self.network_rules[key].add(rule)
+
+    def add_contains(self, key: str, needles: Iterable[str], rule: int):
+        for needle in needles:
+            self.contains[key].add(needle, rule)
+        self.contains_rules[key].add(rule)
+
+    def candidates(self, event) -> List[int]:
+        """ The numbers of the rules which can match the event, in ascending order. """
+        rules = set(self.unindexed)
+        for key, values in self.equal.items():
+            if key in event:
+                try:
+                    matching = values.get(event[key])
+                except TypeError:  # unhashable
+                    continue
+                if matching:
+                    rules |= matching
+        for key, values in self.numeric_equal.items():
+            if key in event:
+                value = event[key]
+                if not is_numeric(value):
+                    continue
+                matching = values.get(float(value) if isinstance(value, str) else value)
+                if matching:
+                    rules |= matching
+        for key, networks in self.networks.items():
+            if key in event:
+                try:
+                    rules.update(networks.lookup_all(event[key]))
+                except ValueError:
+                    # the rules log the invalid address
+                    rules |= self.network_rules[key]
+        for key, automaton in self.contains.items():
+            if key in event:
+                value = event[key]
+                if isinstance(value, str):
+                    rules |= automaton.search(value)
+                else:
+                    rules |= self.contains_rules[key]
+        return sorted(rules)
@@ -11,6 +11,7 @@
 class FileOutputBot(Bot):
     file = None
     is_multithreadable = False
+    is_multiprocessable = False
 
     def init(self):
         # needs to be done here, because in process() FileNotFoundError handling we call init(),
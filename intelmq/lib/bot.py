@@ -4,7 +4,7 @@
 """
 import atexit
 import csv
-import fcntl
+import importlib
 import io
 import json
 import logging
@@ -17,9 +17,10 @@
 import traceback
 import types
 import warnings
-from collections import defaultdict
+from collections import Counter, defaultdict
+from itertools import chain
 from datetime import datetime, timedelta
-from typing import Any, List, Optional
+from typing import Any, List, Optional, Union
 
 import psutil
 
@@ -27,8 +28,8 @@
 from intelmq import (DEFAULT_LOGGING_PATH, DEFAULTS_CONF_FILE,
                      HARMONIZATION_CONF_FILE, PIPELINE_CONF_FILE,
                      RUNTIME_CONF_FILE, __version__)
-from intelmq.lib import cache, exceptions, utils
-from intelmq.lib.pipeline import PipelineFactory
+from intelmq.lib import cache, dump, exceptions, profiling, stats, utils
+from intelmq.lib.pipeline import Chain, Pipeline, PipelineFactory, decompress, internal_queue_names
 from intelmq.lib.utils import RewindableFileHandle
 
 __all__ = ['Bot', 'CollectorBot', 'ParserBot']
@@ -37,8 +38,16 @@
 class Bot(object):
     """ Not to be reset when initialized again on reload. """
     __current_message = None
+    # Raw messages of the current batch and number of already processed ones, see `batch_size`
+    __current_batch = ()
+    __current_batch_position = 0
+    # process_batch failed for the current batch, its messages are processed one by one
+    __batch_failed = False
     __message_counter_delay = timedelta(seconds=2)
     __stats_cache = None
+    # Stop the bot when the profiling is done, for `intelmqctl run <bot> profile`
+    __profiling_exit = False
+    __profiled_messages = 0
 
     # Bot is capable of SIGHUP delaying
     sighup_delay = True
@@ -54,11 +63,17 @@ class Bot(object):
     is_multithreaded = False
     # True if the bot is thread-safe and it makes sense
     is_multithreadable = True
+    # True if it makes sense to run multiple processes of the bot
+    is_multiprocessable = True
+    # True in the worker processes of a bot instance, set after forking
+    __is_process_worker = False
+    # The following bots of a fused chain, run by this bot
+    __chain_bots = ()
     # Collectors with an empty process() should set this to true, prevents endless loops (#1364)
     collector_empty_process = False
 
     def __init__(self, bot_id: str, start=False, sighup_event=None,
-                 disable_multithreading=None):
+                 disable_multithreading=None, chained=False):
         self.__log_buffer = []
         self.parameters = Parameters()
 
@@ -75,6 +90,17 @@ def __init__(self, bot_id: str, start=False, sighup_event=None,
                                   "path": defaultdict(int),  # number of messages sent to queues since last report to redis
                                   "path_total": defaultdict(int)  # number of messages sent to queues since beginning
                                   }
+        # durations of the operations of the bot, see intelmq.lib.stats
+        self.__histograms = {operation: stats.Histogram() for operation in stats.OPERATIONS}
+        self.__receive_duration = 0.0  # time blocked in receive during the current process() call
+        self.__throughput_counter = (0, time.time())  # success counter and time of the last report to redis
+        # with tracing: time the current message was received and latencies of the traces ending here
+        self.__dequeue_time = None
+        self.__trace_histograms = defaultdict(lambda: stats.Histogram(stats.TRACE_BUCKETS))
+        # active profiler, see intelmq.lib.profiling
+        self.__profiler = None
+        # bot specific counters, e.g. cache hits, written to the statistics database
+        self.stats_counters = Counter()  # type: Counter
 
         try:
             version_info = sys.version.splitlines()[0].strip()
@@ -110,11 +136,21 @@ def __init__(self, bot_id: str, start=False, sighup_event=None,
             if broker != 'Amqp':
                 self.is_multithreadable = False
 
+            """ Multiprocessing """
+            if (getattr(self.parameters, 'instances_processes', 1) > 1 and
+                    not self.__instance_id and
+                    not disable_multithreading and not chained):
+                if self.is_multiprocessable:
+                    self.__run_processes(int(self.parameters.instances_processes))
+                else:
+                    self.logger.error('Multiple processes are configured, but are not '
+                                      'available for this bot.')
+
             """ Multithreading """
             if (getattr(self.parameters, 'instances_threads', 0) > 1 and
                 not self.is_multithreaded and
                     self.is_multithreadable and
-                    not disable_multithreading):
+                    not disable_multithreading and not chained):
                 self.logger.handlers = []
                 num_instances = int(self.parameters.instances_threads)
                 instances = []
@@ -154,7 +190,10 @@ def handle_sighup_signal_threading(signum: int,
 
             self.init()
 
-            if not self.__instance_id:
+            if chained:
+                # signals are handled by the first bot of the chain
+                self.__sighup = threading.Event()
+            elif not self.__instance_id or self.__is_process_worker:
                 self.__sighup = threading.Event()
                 signal.signal(signal.SIGHUP, self.__handle_sighup_signal)
                 # system calls should not be interrupted, but restarted
@@ -192,6 +231,68 @@ def catch_shutdown():
         if start:
             self.start()
 
+    def __run_processes(self, num_instances: int):
+        """
+        Forks the worker processes and waits until all of them stopped.
+
+        Every worker is a separate instance of the bot with the id `[bot-id].[instance-id]`
+        and its own internal queue. Signals received by this main process are
+        forwarded to the workers, so the bot can be managed as a whole.
+        Messages left in internal queues of no worker, e.g. after reducing the number
+        of processes, are moved back to the source queue before.
+        """
+        self.__load_pipeline_configuration()
+        if self.__source_queues:
+            try:
+                source_pipeline = PipelineFactory.create(self.parameters, logger=self.logger,
+                                                         direction="source", queues=self.__source_queues)
+                source_pipeline.connect()
+                self.__requeue_internal_queues(source_pipeline, num_instances)
+                source_pipeline.disconnect()
+            except Exception:
+                # the workers can still process new messages
+                self.logger.exception('Could not move the messages of former internal queues back to the source queue.')
+        self.logger.handlers = []
+        workers = {}
+        forwarded_signals = (signal.SIGHUP, signal.SIGTERM, signal.SIGINT)
+        # signals received before forward_signal is installed would not reach the workers
+        signal.pthread_sigmask(signal.SIG_BLOCK, forwarded_signals)
+        for i in range(num_instances):
+            worker_id = '%s.%d' % (self.__bot_id_full, i)
+            pid = os.fork()
+            if pid == 0:
+                signal.pthread_sigmask(signal.SIG_UNBLOCK, forwarded_signals)
+                Bot.__is_process_worker = True
+                try:
+                    self.__class__(bot_id=worker_id, start=True)
+                except SystemExit as exc:
+                    os._exit(exc.code if isinstance(exc.code, int) else 1)
+                except BaseException:
+                    traceback.print_exc()
+                    os._exit(1)
+                os._exit(0)
+            workers[pid] = worker_id
+
+        def forward_signal(signum: int, stack: Optional[object]):
+            for pid in workers:
+                try:
+                    os.kill(pid, signum)
+                except ProcessLookupError:
+                    pass
+        for signum in forwarded_signals:
+            signal.signal(signum, forward_signal)
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, forwarded_signals)
+
+        exitcode = 0
+        while workers:
+            pid, status = os.wait()
+            worker_id = workers.pop(pid, None)
+            if worker_id and os.WIFEXITED(status) and os.WEXITSTATUS(status):
+                exitcode = 1
+            elif worker_id and os.WIFSIGNALED(status):
+                exitcode = 1
+        sys.exit(exitcode)
+
     def __handle_sigterm_signal(self, signum: int, stack: Optional[object]):
         """
         Calles when a SIGTERM is received. Stops the bot.
@@ -215,6 +316,12 @@ def __handle_sighup(self):
         if not self.__sighup.is_set():
             return False
         self.logger.info('Handling SIGHUP, initializing again now.')
+        if self.__profiler:
+            self.__stop_profiling()
+        if self.__profiling_exit:
+            # keep the profiling parameters of `intelmqctl run <bot> profile`
+            profiling_parameters = {key: getattr(self.parameters, key, None) for key in
+                                    ('profiling', 'profiling_messages', 'profiling_seconds')}
         self.__disconnect_pipelines()
         try:
             self.shutdown()  # disconnects, stops threads etc
@@ -223,7 +330,13 @@ def __handle_sighup(self):
         self.logger.handlers = []  # remove all existing handlers
         self.__sighup.clear()
         self.__init__(self.__bot_id_full, sighup_event=self.__sighup)
+        if self.__profiling_exit:
+            for key, value in profiling_parameters.items():
+                setattr(self.parameters, key, value)
         self.__connect_pipelines()
+        if getattr(self.parameters, 'profiling', None):
+            # profile the reloaded bot again, the previous results are overwritten
+            self.__start_profiling()
 
     def init(self):
         pass
@@ -238,7 +351,12 @@ def start(self, starting: bool = True, error_on_pipeline: bool = True,
         self.__source_pipeline = source_pipeline
         self.__destination_pipeline = destination_pipeline
 
+        if getattr(self.parameters, 'profiling', None):
+            self.__start_profiling()
+
         while True:
+            # number of successfully processed messages
+            processed = 0
             try:
                 if not starting and (error_on_pipeline or error_on_message):
                     self.logger.info('Bot will continue in %s seconds.',
@@ -251,6 +369,10 @@ def start(self, starting: bool = True, error_on_pipeline: bool = True,
                 if error_on_pipeline:
                     try:
                         self.__connect_pipelines()
+                    except exceptions.ConfigurationError as exc:
+                        # e.g. an invalid chain, connecting again does not help
+                        self.logger.error(utils.error_message_from_exc(exc))
+                        self.stop()
                     except Exception as exc:
                         raise exceptions.PipelineError(exc)
                     else:
@@ -260,7 +382,17 @@ def start(self, starting: bool = True, error_on_pipeline: bool = True,
                     starting = False
 
                 self.__handle_sighup()
-                self.process()
+                self.__receive_duration = 0.0
+                process_start = time.perf_counter()
+                if self.__batch_size() > 1 and self.__process_batch_overridden() and not self.__batch_failed:
+                    processed = self.__process_batch()
+                else:
+                    self.process()
+                    processed = 1
+                self.__histograms['process'].add(time.perf_counter() - process_start - self.__receive_duration)
+                if not self.__source_pipeline and self.__destination_pipeline:
+                    # without source pipeline there is no acknowledgement which flushes
+                    self.__destination_pipeline.flush()
                 self.__error_retries_counter = 0  # reset counter
 
                 if self.parameters.rate_limit and self.run_mode != 'scheduled':
@@ -309,6 +441,15 @@ def start(self, starting: bool = True, error_on_pipeline: bool = True,
                 self.stop(exitcode=0)
 
             finally:
+                batch_failed = error_on_message and isinstance(self.__current_message, list)
+                if batch_failed:
+                    # find the failing messages, so that only they are dumped
+                    self.logger.info('Processing the messages of the failed batch one by one.')
+                    self.__batch_failed = True
+                    error_on_message = False
+                elif not (error_on_message or error_on_pipeline):
+                    self.__message_counter["success"] += processed
+
                 if getattr(self.parameters, 'testing', False):
                     self.stop(exitcode=0)
                     break
@@ -331,7 +472,8 @@ def start(self, starting: bool = True, error_on_pipeline: bool = True,
                                 warnings.warn("Message will be removed from the pipeline and not dumped to the disk. "
                                               "Set `error_dump_message` to true to save the message on disk. "
                                               "This warning is only shown once in the runtime of a bot.")
-                            if self.__destination_queues and '_on_error' in self.__destination_queues:
+                            if (self.__destination_queues and '_on_error' in self.__destination_queues and
+                                    isinstance(self.__current_message, libmessage.Message)):
                                 self.send_message(self.__current_message, path='_on_error')
 
                             # remove message from pipeline
@@ -358,16 +500,72 @@ def start(self, starting: bool = True, error_on_pipeline: bool = True,
                             # retry forever, see https://github.com/certtools/intelmq/issues/1333
                             # https://lists.cert.at/pipermail/intelmq-users/2018-October/000085.html
                             pass
-                else:
-                    self.__message_counter["success"] += 1
+                elif not batch_failed:
                     # no errors, check for run mode: scheduled
                     if self.run_mode == 'scheduled':
                         self.logger.info('Shutting down scheduled bot.')
                         self.stop(exitcode=0)
 
+            if self.__profiler and self.__profiler.done(self.__processed_messages()):
+                self.__stop_profiling()
+                if self.__profiling_exit:
+                    self.stop(exitcode=0)
             self.__stats()
             self.__handle_sighup()
 
+    def __processed_messages(self) -> int:
+        return self.__message_counter["success"] + self.__message_counter["failure"]
+
+    def __start_profiling(self):
+        """
+        Starts the profiler configured with the parameters `profiling`,
+        `profiling_messages` and `profiling_seconds`, see intelmq.lib.profiling.
+        """
+        filename = os.path.join(self.parameters.logging_path or DEFAULT_LOGGING_PATH, self.__bot_id_full)
+        try:
+            self.__profiler = profiling.Profiler(self.parameters.profiling, filename,
+                                                 messages=getattr(self.parameters, 'profiling_messages', None),
+                                                 seconds=getattr(self.parameters, 'profiling_seconds', None))
+            self.__profiler.start(self.__operation_durations())
+        except ValueError as exc:
+            # e.g. the sampling profiler in a thread
+            self.__profiler = None
+            self.logger.error('Could not start profiling: %s', exc)
+            return
+        self.__profiled_messages = self.__processed_messages()
+        self.logger.info('Profiling with %s.', self.parameters.profiling)
+        if self.__profiler.seconds and threading.current_thread() is threading.main_thread():
+            # the bot may wait for messages, the loop can not check the duration then
+            signal.signal(signal.SIGALRM, self.__handle_profiling_alarm)
+            signal.setitimer(signal.ITIMER_REAL, self.__profiler.seconds)
+
+    def __handle_profiling_alarm(self, signum: int, stack: Optional[object]):
+        """
+        Called when `profiling_seconds` elapsed. Stops the profiling.
+        """
+        if self.__profiler:
+            self.__stop_profiling()
+            if self.__profiling_exit:
+                self.stop(exitcode=0)
+
+    def __stop_profiling(self):
+        profiler, self.__profiler = self.__profiler, None
+        if not profiler:
+            # already stopped by the alarm
+            return
+        if profiler.seconds and threading.current_thread() is threading.main_thread():
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        try:
+            summary = profiler.stop(self.__operation_durations(),
+                                    self.__processed_messages() - self.__profiled_messages)
+        except OSError:
+            self.logger.exception('Could not write the profiling results.')
+        else:
+            self.logger.info(profiling.format_summary(summary))
+
+    def __operation_durations(self) -> dict:
+        return {operation: histogram.sum for operation, histogram in self.__histograms.items()}
+
     def __stats(self, force=False):
         """
         Flush stats to redis
@@ -377,23 +575,49 @@ def __stats(self, force=False):
 
         if not (force or datetime.now() - self.__message_counter["stats_timestamp"] > self.__message_counter_delay):
             return
+        for bot in self.__chain_bots:
+            bot.__stats(force=True)
         if not self.__stats_cache:
             # Cache not yet initialized, e.g. error in init
             return
 
         try:
+            # all values are written in one round trip
+            pipe = self.__stats_cache.redis.pipeline(transaction=False)
             for path, n in self.__message_counter["path"].items():
                 # current queue traffic
-                self.__stats_cache.set(".".join((self.__bot_id_full, "temporary", path)), n, ttl=2)
+                key = ".".join((self.__bot_id_full, "temporary", path))
+                pipe.set(key, n)
+                pipe.expire(key, 2)
                 self.__message_counter["path_total"][path] += n
                 self.__message_counter["path"][path] = 0
             for path, total in self.__message_counter["path_total"].items():
                 # total queue traffic
-                self.__stats_cache.set(".".join((self.__bot_id_full, "total", path)), total)
-            self.__stats_cache.set(".".join((self.__bot_id_full, "stats", "success")),
-                                   self.__message_counter["success"])
-            self.__stats_cache.set(".".join((self.__bot_id_full, "stats", "failure")),
-                                   self.__message_counter["failure"])
+                pipe.set(".".join((self.__bot_id_full, "total", path)), total)
+            pipe.set(".".join((self.__bot_id_full, "stats", "success")),
+                     self.__message_counter["success"])
+            pipe.set(".".join((self.__bot_id_full, "stats", "failure")),
+                     self.__message_counter["failure"])
+            # processed messages per second since the last report
+            last_success, last_time = self.__throughput_counter
+            now = time.time()
+            if now > last_time:
+                key = ".".join((self.__bot_id_full, "stats", "throughput"))
+                pipe.set(key, (self.__message_counter["success"] - last_success) / (now - last_time))
+                pipe.expire(key, 10)
+            self.__throughput_counter = (self.__message_counter["success"], now)
+            for operation, histogram in self.__histograms.items():
+                pipe.set(".".join((self.__bot_id_full, "latency", operation)), histogram.serialize())
+            for name, histogram in self.__trace_histograms.items():
+                pipe.set(".".join((self.__bot_id_full, "trace", name)), histogram.serialize())
+            for name, value in self.stats_counters.items():
+                pipe.set(".".join((self.__bot_id_full, "counter", name)), value)
+            if self.__destination_pipeline:
+                for queue, (original, sent) in self.__destination_pipeline.compression_stats.items():
+                    # total sizes of the messages sent to the queue, before and after compression
+                    pipe.set(".".join((self.__bot_id_full, "compression", queue, "original")), original)
+                    pipe.set(".".join((self.__bot_id_full, "compression", queue, "sent")), sent)
+            pipe.execute()
             self.__message_counter["stats_timestamp"] = datetime.now()
         except Exception:
             self.logger.debug('Failed to write statistics to cache, check your `statistics_*` settings.', exc_info=True)
@@ -442,6 +666,8 @@ def stop(self, exitcode: int = 1):
                 print("%s %d messages since last logging." % (self._message_processed_verb,
                                                               self.__message_counter["since"]))
 
+        if self.__profiler:
+            self.__stop_profiling()
         self.__stats(force=True)
         self.__disconnect_pipelines()
 
@@ -472,7 +698,8 @@ def __print_log_buffer(self):
     def __check_bot_id(self, name: str):
         res = re.fullmatch(r'([0-9a-zA-Z\-]+)(\.[0-9]+)?', name)
         if res:
-            if not(res.group(2) and threading.current_thread() == threading.main_thread()):
+            if not(res.group(2) and threading.current_thread() == threading.main_thread() and
+                   not self.__is_process_worker):
                 return name, res.group(1), res.group(2)[1:] if res.group(2) else None
         self.__log_buffer.append(('error',
                                   "Invalid bot id, must match '"
@@ -486,25 +713,112 @@ def __connect_pipelines(self):
                                                             logger=self.logger,
                                                             direction="source",
                                                             queues=self.__source_queues)
+            if self.__is_process_worker:
+                # Every worker process needs its own internal queue
+                self.__source_pipeline.internal_queue = '%s-internal.%s' % (self.__source_queues,
+                                                                            self.__instance_id)
             self.__source_pipeline.connect()
             self.logger.debug("Connected to source queue.")
+            if not self.__instance_id:
+                # the main process of worker processes handles their internal queues
+                self.__requeue_internal_queues(self.__source_pipeline, 1)
 
-        if self.__destination_queues:
-            self.logger.debug("Loading destination pipeline and queues %r.",
-                              self.__destination_queues)
-            self.__destination_pipeline = PipelineFactory.create(self.parameters,
-                                                                 logger=self.logger,
-                                                                 direction="destination",
-                                                                 queues=self.__destination_queues)
-            self.__destination_pipeline.connect()
-            self.logger.debug("Connected to destination queues.")
+        if self.__destination_queues and self.__chain:
+            self.__connect_chain()
+        elif self.__destination_queues:
+            self.__destination_pipeline = self.__create_destination_pipeline(self.__destination_queues)
         else:
             self.logger.debug("No destination queues to load.")
 
         self.logger.info("Pipeline ready.")
 
+    def __requeue_internal_queues(self, pipeline: Pipeline, processes: int):
+        """
+        Moves the messages of the internal queues the bot does not use with the given
+        number of processes back to the source queue, e.g. the internal queues of
+        worker processes after changing `instances_processes`.
+        """
+        moved = pipeline.requeue_internal_queues(keep=internal_queue_names(self.__source_queues, processes))
+        for queue, count in moved.items():
+            self.logger.warning('Moved %d unacknowledged messages of the unused internal queue %r '
+                                'back to the source queue.', count, queue)
+
+    def __create_destination_pipeline(self, queues) -> Pipeline:
+        self.logger.debug("Loading destination pipeline and queues %r.", queues)
+        pipeline = PipelineFactory.create(self.parameters,
+                                          logger=self.logger,
+                                          direction="destination",
+                                          queues=queues)
+        pipeline.connect()
+        self.logger.debug("Connected to destination queues.")
+        return pipeline
+
+    def __connect_chain(self):
+        """
+        Initializes the following bots of the fused chain and connects all of them.
+
+        The bots of the chain pass the messages directly to each other with
+        in-memory pipelines, only messages for queues outside of the chain and
+        the output of the last bot go to the external pipeline.
+        """
+        runtime_configuration = utils.load_configuration(RUNTIME_CONF_FILE)
+        previous = self
+        chain_bots = []
+        for bot_id in self.__chain:
+            if bot_id not in runtime_configuration:
+                raise exceptions.ConfigurationError('runtime', 'Bot {!r} of the chain is not '
+                                                               'configured.'.format(bot_id))
+            self.logger.debug("Initializing bot %r of the chain.", bot_id)
+            module = importlib.import_module(runtime_configuration[bot_id]['module'])
+            bot = module.BOT(bot_id, chained=True)
+            chain_bots.append(bot)
+            previous.__link_chain(bot)
+            previous = bot
+        if previous.__destination_queues:
+            previous.__destination_pipeline = previous.__create_destination_pipeline(previous.__destination_queues)
+        self.__chain_bots = chain_bots
+        self.logger.info("Connected chain of bots %s.", ', '.join(map(repr, self.__chain)))
+
+    def __link_chain(self, bot: 'Bot'):
+        """
+        Connects this bot's destination pipeline to the source of the given next bot of the chain.
+        """
+        pipeline = Chain(self.parameters, logger=self.logger,
+                         queue=bot.__source_queues, process=bot.__process_chained)
+        pipeline.set_queues(self.__destination_queues, "destination")
+        if bot.__source_queues not in chain.from_iterable(pipeline.destination_queues.values()):
+            raise exceptions.ConfigurationError('pipeline', 'Bot {!r} does not send to the next bot {!r} '
+                                                            'of the chain.'.format(self.__bot_id, bot.__bot_id))
+        external_queues = {path: [queue for queue in queues if queue != bot.__source_queues]
+                           for path, queues in pipeline.destination_queues.items()}
+        external_queues = {path: queues for path, queues in external_queues.items() if queues}
+        if external_queues:
+            pipeline.pipeline = self.__create_destination_pipeline(external_queues)
+        self.__destination_pipeline = pipeline
+        bot.__source_pipeline = pipeline
+
+    def __process_chained(self):
+        """
+        Processes a message passed by the previous bot of the chain.
+
+        The bots of a chain do not run start(), so the messages are counted here.
+        """
+        try:
+            self.process()
+        except Exception:
+            self.__message_counter["failure"] += 1
+            raise
+        self.__message_counter["success"] += 1
+
     def __disconnect_pipelines(self):
         """ Disconnecting pipelines. """
+        for bot in self.__chain_bots:
+            bot.__disconnect_pipelines()
+            try:
+                bot.shutdown()
+            except Exception:
+                self.logger.exception('Error during shutdown of bot %r of the chain.', bot.__bot_id)
+        self.__chain_bots = ()
         if self.__source_pipeline:
             self.__source_pipeline.disconnect()
             self.__source_pipeline = None
@@ -514,6 +828,106 @@ def __disconnect_pipelines(self):
             self.__destination_pipeline = None
             self.logger.debug("Disconnected from destination pipeline.")
 
+    def __batch_size(self) -> int:
+        """
+        Returns the number of messages to receive at once from the source pipeline.
+
+        This is the `batch_size` parameter, if the source pipeline supports batches, otherwise 1.
+        """
+        batch_size = int(getattr(self.parameters, 'batch_size', 1))
+        if batch_size > 1 and self.__source_pipeline and self.__source_pipeline.has_batch_support:
+            return batch_size
+        return 1
+
+    def __process_batch_overridden(self) -> bool:
+        """ If the bot opts in to process batches by implementing process_batch. """
+        return type(self).process_batch is not Bot.process_batch
+
+    def __receive_raw_message(self) -> str:
+        """
+        Returns the next raw message from the source pipeline.
+
+        In batch mode the messages are taken from the current batch, a new batch is
+        only requested if all messages of the current one have been acknowledged.
+        """
+        if self.__current_batch:
+            return self.__current_batch[self.__current_batch_position]
+        batch_size = self.__batch_size()
+        if batch_size == 1:
+            return self.__source_pipeline.receive()
+        self.__current_batch = self.__source_pipeline.receive_batch(batch_size)
+        self.__current_batch_position = 0
+        return self.__current_batch[0]
+
+    def __acknowledge_batch(self):
+        """ Acknowledges all messages of the current batch. """
+        if self.__destination_pipeline:
+            self.__destination_pipeline.flush()
+        self.__source_pipeline.acknowledge_batch()
+        self.__current_batch = ()
+        self.__current_batch_position = 0
+        self.__current_message = None
+        self.__batch_failed = False
+
+    def __process_batch(self) -> int:
+        """
+        Receives a whole batch, hands it to process_batch and acknowledges it afterwards.
+
+        Returns:
+            The number of processed messages
+        """
+        self.logger.debug('Waiting for incoming batch.')
+        if not self.__current_batch:
+            receive_start = time.perf_counter()
+            self.__current_batch = self.__source_pipeline.receive_batch(self.__batch_size())
+            self.__add_receive_duration(time.perf_counter() - receive_start)
+            if self.__tracing():
+                self.__dequeue_time = time.time()
+            self.__current_batch_position = 0
+        self.__handle_sighup()
+
+        messages = []
+        for raw_message in self.__current_batch:
+            if not raw_message:
+                self.logger.warning('Empty message received. Some previous bot sent invalid data.')
+                continue
+            try:
+                messages.append(self.__unserialize_message(raw_message))
+            except exceptions.ConfigurationError:
+                raise
+            except Exception:
+                # the invalid message is retried and dumped like any other failing message
+                self.logger.info('Message of the batch could not be unserialized, '
+                                 'processing the messages of the batch one by one.')
+                self.__batch_failed = True
+                return 0
+        self.__current_message = messages
+        self.logger.debug('Received batch of %d messages.', len(messages))
+
+        if messages:
+            self.process_batch(messages)
+        for message in messages:
+            self.__end_trace(message)
+        self.__acknowledge_batch()
+        return len(messages)
+
+    def process_batch(self, messages: List[libmessage.Message]):
+        """
+        Processes a batch of messages received at once from the source pipeline.
+
+        Bots can opt in to batch processing by implementing this method.
+        It is used instead of process if the parameter `batch_size` is larger than 1
+        and the source pipeline supports batches. The messages are acknowledged all
+        together after this method returned. If it raises an exception, the messages
+        of the batch are processed again one by one with process, so that only the
+        failing messages are retried and dumped. Bots implementing this method need
+        to implement process as well.
+
+        Parameters:
+            messages: List of the received messages, instances of intelmq.lib.message.Message
+        """
+        raise NotImplementedError
+
     def send_message(self, *messages, path="_default", auto_add=None,
                      path_permissive=False):
         """
@@ -530,6 +944,8 @@ def send_message(self, *messages, path="_default", auto_add=None,
                                                                 'but needed')
 
             self.logger.debug("Sending message.")
+            if self.__tracing():
+                self.__add_trace_hop(message)
             self.__message_counter["since"] += 1
             self.__message_counter["path"][path] += 1
             if not self.__message_counter["start"]:
@@ -542,29 +958,47 @@ def send_message(self, *messages, path="_default", auto_add=None,
                 self.__message_counter["since"] = 0
                 self.__message_counter["start"] = datetime.now()
 
-            raw_message = libmessage.MessageFactory.serialize(message)
+            if self.__destination_pipeline.has_message_support:
+                send_start = time.perf_counter()
+                self.__destination_pipeline.send(message, path=path,
+                                                 path_permissive=path_permissive)
+                self.__histograms['send'].add(time.perf_counter() - send_start)
+                continue
+            serialize_start = time.perf_counter()
+            raw_message = libmessage.MessageFactory.serialize(message,
+                                                              validated=self.__trust_validated_messages(),
+                                                              encoding=self.__pipeline_encoding)
+            send_start = time.perf_counter()
+            self.__histograms['serialize'].add(send_start - serialize_start)
             self.__destination_pipeline.send(raw_message, path=path,
                                              path_permissive=path_permissive)
+            self.__histograms['send'].add(time.perf_counter() - send_start)
 
     def receive_message(self):
         self.logger.debug('Waiting for incoming message.')
         message = None
         while not message:
-            message = self.__source_pipeline.receive()
+            receive_start = time.perf_counter()
+            message = self.__receive_raw_message()
+            self.__add_receive_duration(time.perf_counter() - receive_start)
             if not message:
                 self.logger.warning('Empty message received. Some previous bot sent invalid data.')
+                if self.__current_batch:
+                    self.acknowledge_message()
                 continue
 
         # handle a sighup which happened during blocking read
         self.__handle_sighup()
 
-        try:
-            self.__current_message = libmessage.MessageFactory.unserialize(message,
-                                                                           harmonization=self.harmonization)
-        except exceptions.InvalidKey as exc:
-            # In case a incoming message is malformed an does not conform with the currently
-            # loaded harmonization, stop now as this will happen repeatedly without any change
-            raise exceptions.ConfigurationError('harmonization', exc.args[0])
+        if self.__tracing():
+            self.__dequeue_time = time.time()
+        if isinstance(message, libmessage.Message):
+            # passed directly by the previous bot of a chain
+            self.__current_message = message
+        else:
+            # the raw message is dumped if it can not be unserialized
+            self.__current_message = message
+            self.__current_message = self.__unserialize_message(message)
 
         if self.logger.isEnabledFor(logging.DEBUG):
             if 'raw' in self.__current_message and len(self.__current_message['raw']) > 400:
@@ -576,19 +1010,105 @@ def receive_message(self):
 
         return self.__current_message
 
+    def __add_receive_duration(self, duration: float):
+        """ Counts the time blocked in receive, which is not part of the process duration. """
+        self.__receive_duration += duration
+        self.__histograms['receive'].add(duration)
+
+    def __unserialize_message(self, raw_message: str) -> libmessage.Message:
+        unserialize_start = time.perf_counter()
+        try:
+            return libmessage.MessageFactory.unserialize(decompress(raw_message),
+                                                         harmonization=self.harmonization,
+                                                         trusted=self.__trust_validated_messages())
+        except exceptions.InvalidKey as exc:
+            # In case a incoming message is malformed an does not conform with the currently
+            # loaded harmonization, stop now as this will happen repeatedly without any change
+            raise exceptions.ConfigurationError('harmonization', exc.args[0])
+        finally:
+            self.__histograms['unserialize'].add(time.perf_counter() - unserialize_start)
+
+    def __trust_validated_messages(self) -> bool:
+        """
+        Returns the parameter `trust_validated_messages`.
+
+        If true, received messages marked as validated are not validated again
+        and sent messages are marked as validated.
+        """
+        return getattr(self.parameters, 'trust_validated_messages', False)
+
+    def __tracing(self) -> bool:
+        """
+        Returns the parameter `tracing`.
+
+        If true, the bot adds its hop to the trace of sent messages and output
+        bots count the latencies of the traces of the acknowledged messages.
+        """
+        return getattr(self.parameters, 'tracing', False)
+
+    def __add_trace_hop(self, message: libmessage.Message):
+        """
+        Adds the hop of this bot to the trace of the message.
+
+        Messages without trace, e.g. new events of parsers, inherit the trace
+        of the currently processed message, otherwise a new trace begins.
+        If the message was already sent by this bot, the previous hop is replaced.
+        """
+        now = time.time()
+        dequeued = self.__dequeue_time if self.__source_queues else None
+        trace = message.trace
+        if trace is None and isinstance(self.__current_message, libmessage.Message):
+            trace = self.__current_message.trace
+        if trace is None:
+            trace = {'ingest': dequeued or now, 'hops': []}
+        hops = trace['hops']
+        if hops and hops[-1][0] == self.__bot_id:
+            hops = hops[:-1]
+        # the trace may be shared with other messages, never change it in place
+        message.trace = {'ingest': trace['ingest'],
+                         'hops': hops + [[self.__bot_id, self.__source_queues, dequeued, now]]}
+
+    def __end_trace(self, message: libmessage.Message):
+        """
+        Counts the end-to-end latency and the waiting times in the queues
+        of the message's trace, if this bot is an output bot.
+        """
+        if not (self.group == 'Output' and self.__tracing() and
+                isinstance(message, libmessage.Message) and message.trace):
+            return
+        self.__trace_histograms['end_to_end'].add(time.time() - message.trace['ingest'])
+        enqueued = None
+        for _, queue, dequeued, next_enqueued in chain(message.trace['hops'],
+                                                       [(None, self.__source_queues, self.__dequeue_time, None)]):
+            if queue and enqueued is not None and dequeued is not None:
+                self.__trace_histograms['wait.' + queue].add(dequeued - enqueued)
+            enqueued = next_enqueued
+
     def acknowledge_message(self):
         """
         Acknowledges that the last message has been processed, if any.
 
         For bots without source pipeline (collectors), this is a no-op.
+        In batch mode, the batch is acknowledged in the pipeline as soon as
+        all of its messages have been acknowledged.
+        Buffered messages of the destination pipeline are sent before the
+        acknowledgement, so no message can get lost.
         """
-        if self.__source_pipeline:
-            self.__source_pipeline.acknowledge()
+        self.__end_trace(self.__current_message)
+        if self.__current_batch:
+            self.__current_batch_position += 1
+            if self.__current_batch_position >= len(self.__current_batch):
+                self.__acknowledge_batch()
+        else:
+            if self.__destination_pipeline:
+                self.__destination_pipeline.flush()
+            if self.__source_pipeline:
+                self.__source_pipeline.acknowledge()
 
         # free memory of last message
         self.__current_message = None
 
-    def _dump_message(self, error_traceback, message: dict):
+    def _dump_message(self, error_traceback, message: Union[libmessage.Message, str, bytes]):
         if message is None or getattr(self.parameters, 'testing', False):
             return
 
@@ -599,40 +1119,26 @@ def _dump_message(self, error_traceback, message: dict):
         dump_file = os.path.join(self.parameters.logging_path, self.__bot_id + ".dump")
 
         new_dump_data = {}
-        new_dump_data[timestamp] = {}
-        new_dump_data[timestamp]["bot_id"] = self.__bot_id
-        new_dump_data[timestamp]["source_queue"] = self.__source_queues
-        new_dump_data[timestamp]["traceback"] = error_traceback
-
-        new_dump_data[timestamp]["message"] = message.serialize()
-
-        if os.path.exists(dump_file):
-            # existing dump
-            mode = 'r+'
+        new_dump_data["timestamp"] = timestamp
+        new_dump_data["bot_id"] = self.__bot_id
+        new_dump_data["source_queue"] = self.__source_queues
+        new_dump_data["traceback"] = error_traceback
+
+        if isinstance(message, libmessage.Message):
+            new_dump_data["message"] = message.serialize()
+        elif isinstance(message, bytes):
+            # raw message which could not be unserialized, e.g. binary encoded
+            new_dump_data["message"] = utils.base64_encode(message)
+            new_dump_data["message_encoding"] = "base64"
         else:
-            # new dump file
-            mode = 'w'
-        with open(dump_file, mode) as fp:
-            for i in range(50):
-                try:
-                    fcntl.flock(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
-                except BlockingIOError:
-                    if i == 0:
-                        self.logger.warning('Dump file is locked, waiting up to 60s.')
-                    time.sleep(1)
-                else:
-                    break
-            else:
-                raise ValueError('Dump file was locked for more than 60s, giving up now.')
-            if mode == 'r+':
-                dump_data = json.load(fp)
-                dump_data.update(new_dump_data)
-            else:
-                dump_data = new_dump_data
+            # raw message which could not be unserialized
+            new_dump_data["message"] = message
 
-            fp.seek(0)
-
-            json.dump(dump_data, fp, indent=4, sort_keys=True)
+        try:
+            with dump.DumpFile(dump_file, timeout=60, logger=self.logger) as dump_handle:
+                dump_handle.append(new_dump_data)
+        except BlockingIOError:
+            raise ValueError('Dump file was locked for more than 60s, giving up now.')
 
         self.logger.debug('Message dumped.')
 
@@ -689,6 +1195,10 @@ def __load_pipeline_configuration(self):
 
         self.__source_queues = None
         self.__destination_queues = None
+        self.__chain = []
+        # the encoding of sent messages, received ones are detected automatically
+        self.__pipeline_encoding = getattr(self.parameters, 'pipeline_encoding', 'json')
+        libmessage.check_encoding(self.__pipeline_encoding)
 
         if self.__bot_id in list(config.keys()):
 
@@ -700,6 +1210,9 @@ def __load_pipeline_configuration(self):
                     self.__bot_id]['destination-queues']
                 # Convert old to new format here
 
+            if 'chain' in config[self.__bot_id].keys():
+                self.__chain = config[self.__bot_id]['chain']
+
         else:
             raise exceptions.ConfigurationError('pipeline', "no key "
                                                             "{!r}.".format(self.__bot_id))
@@ -788,13 +1301,17 @@ class ParserBot(Bot):
     current_line = None
 
     def __init__(self, bot_id: str, start=False, sighup_event=None,
-                 disable_multithreading=None):
-        super().__init__(bot_id=bot_id)
+                 disable_multithreading=None, chained=False):
+        super().__init__(bot_id=bot_id, sighup_event=sighup_event,
+                         disable_multithreading=disable_multithreading,
+                         chained=chained)
         if self.__class__.__name__ == 'ParserBot':
             self.logger.error('ParserBot can\'t be started itself. '
                               'Possible Misconfiguration.')
             self.stop()
         self.group = 'Parser'
+        if start:
+            self.start()
 
     def parse_csv(self, report: dict):
         """
@@ -963,15 +1480,20 @@ class CollectorBot(Bot):
     """
 
     is_multithreadable = False
+    is_multiprocessable = False
 
     def __init__(self, bot_id: str, start=False, sighup_event=None,
-                 disable_multithreading=None):
-        super().__init__(bot_id=bot_id)
+                 disable_multithreading=None, chained=False):
+        super().__init__(bot_id=bot_id, sighup_event=sighup_event,
+                         disable_multithreading=disable_multithreading,
+                         chained=chained)
         if self.__class__.__name__ == 'CollectorBot':
             self.logger.error('CollectorBot can\'t be started itself. '
                               'Possible Misconfiguration.')
             self.stop()
         self.group = 'Collector'
+        if start:
+            self.start()
 
     def __filter_empty_report(self, message: dict):
         if 'raw' not in message:
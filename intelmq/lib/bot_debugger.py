@@ -11,6 +11,7 @@
  * starts the bot as is (default)
  * processes single message, either injected or from default pipeline (process subcommand)
  * reads the message from input pipeline or send a message to output pipeline (message subcommand)
+ * runs the bot under a profiler for a number of messages or seconds (profile subcommand)
 """
 import json
 import sys
@@ -32,7 +33,8 @@ class BotDebugger:
     logging_level = None
 
     def __init__(self, runtime_configuration, bot_id, run_subcommand=None, console_type=None,
-                 message_kind=None, dryrun=None, msg=None, show=None, loglevel=None):
+                 message_kind=None, dryrun=None, msg=None, show=None, loglevel=None,
+                 profiler=None, profile_messages=None, profile_seconds=None):
         self.runtime_configuration = runtime_configuration
         module = import_module(self.runtime_configuration['module'])
 
@@ -48,7 +50,12 @@ def __init__(self, runtime_configuration, bot_id, run_subcommand=None, console_t
 
         if not run_subcommand:
             self.instance.start()
+        elif run_subcommand == "profile":
+            self._profile(profiler, profile_messages, profile_seconds)
         else:
+            # interactive runs always handle single messages and send them immediately
+            self.instance.parameters.batch_size = 1
+            self.instance.parameters.destination_pipeline_buffer_size = 0
             self.instance._Bot__connect_pipelines()
             if run_subcommand == "console":
                 self._console(console_type)
@@ -138,6 +145,14 @@ def _process(self, dryrun, msg, show):
         self.instance.logger.info("Processing...")
         self.instance.process()
 
+    def _profile(self, profiler, messages, seconds):
+        self.instance.parameters.profiling = profiler
+        self.instance.parameters.profiling_messages = messages
+        self.instance.parameters.profiling_seconds = seconds
+        # stop the bot when the profiling is done
+        self.instance._Bot__profiling_exit = True
+        self.instance.start()
+
     def arg2msg(self, msg):
         try:
             default_type = "Report" if self.runtime_configuration["group"] == "Parser" else "Event"
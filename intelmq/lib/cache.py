@@ -7,19 +7,35 @@
 inserted in cache. This TTL means how much time the system will keep an
 information in the cache.
 """
-from typing import Any, Optional
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
 
 import redis
 
 import intelmq.lib.utils as utils
 
-__all__ = ['Cache']
+__all__ = ['Cache', 'LRUCache']
 
 
 class Cache():
+    """
+    Parameters:
+        host, port, db, password: Connection parameters of the redis database
+        ttl: Default time to live of the keys in seconds, no expiry if 0
+        local_cache_size: Number of values kept in an in-process read-through
+            cache in front of redis, 0 disables it
+        local_cache_ttl: Maximum time to live of the values in the local cache,
+            defaults to ttl. Values changed by other processes are only seen
+            after this time.
+        counters: A `collections.Counter`, e.g. `Bot.stats_counters`, counting
+            `cache_hits`, `cache_misses`, `cache_local_hits`, `cache_round_trips`
+            and the total time of the round trips in microseconds (`cache_latency_us`)
+    """
 
     def __init__(self, host: str, port: int, db: str, ttl: int,
-                 password: Optional[str] = None):
+                 password: Optional[str] = None, local_cache_size: int = 0,
+                 local_cache_ttl: Optional[int] = None, counters: Optional[Counter] = None):
         if host.startswith("/"):
             kwargs = {"unix_socket_path": host}
 
@@ -36,28 +52,188 @@ def __init__(self, host: str, port: int, db: str, ttl: int,
         self.redis = redis.Redis(db=db, password=password, **kwargs)
 
         self.ttl = ttl
+        self.local_cache_ttl = ttl if local_cache_ttl is None else local_cache_ttl
+        self.local_cache = LRUCache(local_cache_size) if local_cache_size else None
+        self.counters = Counter() if counters is None else counters
+
+    def __round_trip(self, function: Callable, *args, **kwargs):
+        """ Executes one command or pipeline, counting the round trip and its latency. """
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self.counters['cache_round_trips'] += 1
+            self.counters['cache_latency_us'] += int((time.perf_counter() - start) * 1e6)
+
+    def __set_local(self, key: str, value: Any, ttl: Optional[int]):
+        if self.local_cache is None:
+            return
+        if isinstance(value, bytes):
+            value = utils.decode(value)
+        # the local copy must not outlive the key in redis
+        local_ttl = min(filter(None, (ttl, self.local_cache_ttl)), default=0)
+        self.local_cache.set(key, value, local_ttl)
 
     def exists(self, key: str):
-        return self.redis.exists(key)
+        return self.exists_many([key])[0]
+
+    def exists_many(self, keys: Sequence[str]) -> List[bool]:
+        """ If the keys exist, with one round trip for all keys not in the local cache. """
+        result = [self.local_cache is not None and key in self.local_cache for key in keys]
+        self.counters['cache_local_hits'] += sum(result)
+        remote = [index for index, found in enumerate(result) if not found]
+        if remote:
+            pipe = self.redis.pipeline(transaction=False)
+            for index in remote:
+                pipe.exists(keys[index])
+            for index, exists in zip(remote, self.__round_trip(pipe.execute)):
+                result[index] = bool(exists)
+        return result
 
     def get(self, key: str):
-        retval = self.redis.get(key)
-        if isinstance(retval, bytes):
-            return utils.decode(retval)
-        return retval
+        return self.get_many([key])[0]
+
+    def get_many(self, keys: Sequence[str]) -> List[Optional[str]]:
+        """
+        Gets the values of the keys, None for missing keys.
+
+        Keys not in the local cache are fetched with one MGET command.
+        """
+        result = [None] * len(keys)  # type: List[Optional[str]]
+        remote = []
+        for index, key in enumerate(keys):
+            value = self.local_cache.get(key) if self.local_cache is not None else None
+            if value is None:
+                remote.append(index)
+            else:
+                result[index] = value
+                self.counters['cache_local_hits'] += 1
+        if not remote:
+            return result
+        remote_keys = [keys[index] for index in remote]
+        if self.local_cache is None:
+            values = self.__round_trip(self.redis.mget, remote_keys)
+            remaining = [None] * len(remote)
+        else:
+            # the TTLs limit the time the values are kept locally, in the same round trip
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.mget(remote_keys)
+            for key in remote_keys:
+                pipe.ttl(key)
+            values, *remaining = self.__round_trip(pipe.execute)
+        for index, value, key_ttl in zip(remote, values, remaining):
+            if value is None:
+                self.counters['cache_misses'] += 1
+                continue
+            self.counters['cache_hits'] += 1
+            result[index] = utils.decode(value) if isinstance(value, bytes) else value
+            # -1: no expiry, -2: expired in the meantime
+            if self.local_cache is not None and key_ttl != -2:
+                self.__set_local(keys[index], result[index], key_ttl if key_ttl > 0 else None)
+        return result
 
     def set(self, key: str, value: Any, ttl: Optional[int] = None):
+        """ Sets the value with one SET EX command. """
+        self.set_many({key: value}, ttl)
+
+    def set_many(self, mapping: Dict[str, Any], ttl: Optional[int] = None,
+                 ttls: Optional[Dict[str, int]] = None):
+        """
+        Sets the values of the keys with pipelined SET EX commands in one round trip.
+
+        Parameters:
+            mapping: The keys and values
+            ttl: Time to live of the keys, defaults to the cache's TTL
+            ttls: Optional time to live for single keys, overriding ttl
+        """
+        if not mapping:
+            return
+        if ttl is None:
+            ttl = self.ttl
+        ttls = ttls or {}
+        pipe = self.redis.pipeline(transaction=False)
+        for key, value in mapping.items():
+            key_ttl = ttls.get(key, ttl)
+            # SET EX requires a positive TTL, 0 or None mean no expiry
+            key_ttl = max(int(key_ttl), 1) if key_ttl else None
+            if isinstance(value, str):
+                value = utils.encode(value)
+            pipe.set(key, value, ex=key_ttl)
+            self.__set_local(key, value, key_ttl)
+        self.__round_trip(pipe.execute)
+
+    def add(self, key: str, value: Any, ttl: Optional[int] = None) -> Tuple[bool, Optional[float]]:
+        """
+        Sets the key only if it does not exist yet, atomically with SET NX EX.
+
+        The remaining time to live of the key is queried in the same round trip.
+
+        Returns:
+            added: If the key did not exist and has been set
+            remaining: Remaining time to live of the key in seconds, None if it does not expire
+        """
         if ttl is None:
             ttl = self.ttl
         if isinstance(value, str):
             value = utils.encode(value)
-        # backward compatibility (Redis v2.2)
-        self.redis.set(key, value)
-        if ttl:
-            self.redis.expire(key, ttl)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.set(key, value, ex=int(ttl) if ttl else None, nx=True)
+        pipe.pttl(key)
+        added, remaining = self.__round_trip(pipe.execute)
+        if remaining == -1:  # no expiry
+            return bool(added), None
+        return bool(added), max(remaining, 0) / 1000
 
     def flush(self):
         """
         Flushes the currently opened database by calling FLUSHDB.
         """
         self.redis.flushdb()
+        if self.local_cache is not None:
+            self.local_cache.clear()
+
+
+class LRUCache(object):
+    """
+    Bounded in-process cache, evicting the least recently used entries.
+
+    Parameters:
+        maxsize: Maximum number of entries
+        ttl: Default time to live of the entries in seconds, no expiry if None or 0
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.__data = OrderedDict()  # key: (value, expiry)
+
+    def __len__(self):
+        return len(self.__data)
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def get(self, key, default=None):
+        try:
+            value, expiry = self.__data[key]
+        except KeyError:
+            return default
+        if expiry is not None and expiry <= time.monotonic():
+            del self.__data[key]
+            return default
+        self.__data.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        if ttl is None:
+            ttl = self.ttl
+        self.__data[key] = (value, time.monotonic() + ttl if ttl else None)
+        self.__data.move_to_end(key)
+        if len(self.__data) > self.maxsize:
+            self.__data.popitem(last=False)
+
+    def delete(self, key):
+        self.__data.pop(key, None)
+
+    def clear(self):
+        self.__data.clear()
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+Dump files of messages bots could not process.
+
+A dump file `<bot-id>.dump` holds one entry per line (JSON Lines), an object
+with the keys `timestamp`, `bot_id`, `source_queue`, `traceback` and `message`.
+New entries are appended, so dumping a message takes the same time regardless
+of the size of the dump.
+
+The index file `<bot-id>.dump.index` next to it holds the offsets of the entries
+as unsigned 64 bit integers in native byte order. It allows counting and
+reading single entries without reading the dump and is rebuilt from the dump if
+it is missing or outdated.
+
+Dump files of IntelMQ < 2.1, a single JSON object with the timestamps as keys,
+are migrated to the new format on the first access.
+
+All access is protected by an exclusive lock on the dump file.
+"""
+import fcntl
+import json
+import os
+import time
+from array import array
+from typing import Iterable, Iterator
+
+__all__ = ['DumpFile', 'INDEX_SUFFIX']
+
+INDEX_SUFFIX = '.index'
+TEMPORARY_SUFFIX = '.tmp'
+OFFSET_TYPE = 'Q'
+OFFSET_SIZE = array(OFFSET_TYPE).itemsize
+
+
+def is_legacy(first_line: bytes) -> bool:
+    """ If the first line of a dump file is from the format of IntelMQ < 2.1. """
+    try:
+        entry = json.loads(first_line.decode())
+    except ValueError:
+        # the indented JSON object of the legacy format
+        return True
+    return not isinstance(entry, dict) or 'traceback' not in entry
+
+
+class DumpFile(object):
+    """
+    Locked access to a dump file, to be used as context manager:
+
+        with DumpFile(filename) as dump:
+            dump.append(entry)
+            for entry in dump:
+                ...
+
+    Entries are dictionaries with the keys `timestamp`, `bot_id`, `source_queue`,
+    `traceback` and `message`, addressed by their position in the file.
+
+    Parameters:
+        filename: Path of the dump file, created if it does not exist
+        timeout: Seconds to wait for the lock if another process holds it,
+            BlockingIOError is raised afterwards. With 0, it does not wait.
+        logger: Logger for the warning if the file is locked
+
+    Raises:
+        ValueError: If a dump file in the legacy format is not valid JSON
+    """
+
+    def __init__(self, filename: str, timeout: float = 60, logger=None):
+        self.filename = filename
+        self.index_filename = filename + INDEX_SUFFIX
+        self.timeout = timeout
+        self.logger = logger
+        self.__handle = None
+        self.__offsets = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        deadline = time.monotonic() + self.timeout
+        warned = False
+        while True:
+            handle = open(self.filename, 'a+b')
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                handle.close()
+                if time.monotonic() >= deadline:
+                    raise
+                if self.logger and not warned:
+                    self.logger.warning('Dump file is locked, waiting up to %ds.', self.timeout)
+                    warned = True
+                time.sleep(min(1, self.timeout))
+                continue
+            # the file may have been replaced or deleted by the holder of the lock in the meantime
+            try:
+                current = os.path.samestat(os.fstat(handle.fileno()), os.stat(self.filename))
+            except FileNotFoundError:
+                current = False
+            if current:
+                break
+            handle.close()
+        self.__handle = handle
+        try:
+            self.__migrate()
+            if not self.__index_valid():
+                self.__write_index(self.__scan())
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self.__handle is not None:
+            self.__handle.close()
+            self.__handle = None
+        self.__offsets = None
+
+    @property
+    def offsets(self) -> array:
+        """ The offsets of all entries, loaded from the index on first use. """
+        if self.__offsets is None:
+            self.__offsets = array(OFFSET_TYPE)
+            try:
+                with open(self.index_filename, 'rb') as index:
+                    self.__offsets.frombytes(index.read())
+            except FileNotFoundError:
+                pass
+        return self.__offsets
+
+    def __len__(self) -> int:
+        if self.__offsets is not None:
+            return len(self.__offsets)
+        try:
+            return os.path.getsize(self.index_filename) // OFFSET_SIZE
+        except FileNotFoundError:
+            return 0
+
+    def __getitem__(self, position: int) -> dict:
+        """ Raises ValueError if the entry is not valid JSON. """
+        return json.loads(self.read_line(position).decode())
+
+    def __iter__(self) -> Iterator[dict]:
+        for position in range(len(self)):
+            yield self[position]
+
+    def read_line(self, position: int) -> bytes:
+        """ The raw line of the entry at the position. """
+        self.__handle.seek(self.offsets[position])
+        return self.__handle.readline()
+
+    def append(self, entry: dict):
+        handle = self.__handle
+        size = handle.seek(0, os.SEEK_END)
+        if size:
+            handle.seek(size - 1)
+            if handle.read(1) != b'\n':
+                # the last write was interrupted
+                handle.write(b'\n')
+                size += 1
+        handle.write(json.dumps(entry, sort_keys=True).encode() + b'\n')
+        handle.flush()
+        with open(self.index_filename, 'ab') as index:
+            index.write(array(OFFSET_TYPE, [size]).tobytes())
+        if self.__offsets is not None:
+            self.__offsets.append(size)
+
+    def delete(self, positions: Iterable[int]):
+        """
+        Deletes the entries at the positions.
+
+        The remaining entries are streamed into a new file, replacing the current one.
+        """
+        positions = set(positions)
+        if positions:
+            self.__rewrite(self.read_line(position) for position in range(len(self))
+                           if position not in positions)
+
+    def remove(self):
+        """ Removes the dump file and the index. The lock is released. """
+        os.remove(self.filename)
+        try:
+            os.remove(self.index_filename)
+        except FileNotFoundError:
+            pass
+        self.close()
+
+    def __migrate(self):
+        """ Converts a dump file from the format of IntelMQ < 2.1. """
+        handle = self.__handle
+        handle.seek(0)
+        first_line = handle.readline()
+        if not first_line.strip() or not is_legacy(first_line):
+            return
+        handle.seek(0)
+        content = json.loads(handle.read().decode())
+        if not isinstance(content, dict) or not all(isinstance(value, dict) for value in content.values()):
+            raise ValueError('Dump file is neither in the JSON Lines nor in the legacy format.')
+        self.__rewrite(json.dumps(dict(value, timestamp=key), sort_keys=True).encode() + b'\n'
+                       for key, value in sorted(content.items()))
+
+    def __rewrite(self, lines: Iterable[bytes]):
+        """
+        Writes the lines into a new file and replaces the dump file with it.
+
+        The new file is locked before it replaces the dump file, so the lock is kept.
+        """
+        temporary_filename = self.filename + TEMPORARY_SUFFIX
+        target = open(temporary_filename, 'w+b')
+        try:
+            fcntl.flock(target, fcntl.LOCK_EX)
+            offsets = array(OFFSET_TYPE)
+            for line in lines:
+                if not line.endswith(b'\n'):
+                    line += b'\n'
+                offsets.append(target.tell())
+                target.write(line)
+            target.flush()
+            os.replace(temporary_filename, self.filename)
+        except BaseException:
+            target.close()
+            raise
+        self.__handle.close()
+        self.__handle = target
+        self.__write_index(offsets)
+
+    def __scan(self) -> array:
+        """ The offsets of all lines in the dump file. """
+        offsets = array(OFFSET_TYPE)
+        offset = 0
+        self.__handle.seek(0)
+        for line in self.__handle:
+            if line.strip():
+                offsets.append(offset)
+            offset += len(line)
+        return offsets
+
+    def __index_valid(self) -> bool:
+        """ If the last offset in the index points to the last line of the dump file. """
+        size = os.fstat(self.__handle.fileno()).st_size
+        try:
+            index_size = os.path.getsize(self.index_filename)
+        except FileNotFoundError:
+            return not size
+        if index_size % OFFSET_SIZE or not index_size:
+            return not size and not index_size
+        last = array(OFFSET_TYPE)
+        with open(self.index_filename, 'rb') as index:
+            index.seek(-OFFSET_SIZE, os.SEEK_END)
+            last.frombytes(index.read())
+        if last[0] >= size:
+            return False
+        self.__handle.seek(last[0])
+        self.__handle.readline()
+        return self.__handle.tell() == size
+
+    def __write_index(self, offsets: array):
+        temporary_filename = self.index_filename + TEMPORARY_SUFFIX
+        with open(temporary_filename, 'wb') as index:
+            index.write(offsets.tobytes())
+        os.replace(temporary_filename, self.index_filename)
+        self.__offsets = offsets
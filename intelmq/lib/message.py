@@ -4,6 +4,7 @@
 
 Use MessageFactory to get a Message object (types Report and Event).
 """
+import base64
 import hashlib
 import json
 import re
@@ -16,19 +17,63 @@
 from intelmq import HARMONIZATION_CONF_FILE
 from intelmq.lib import utils
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 __all__ = ['Event', 'Message', 'MessageFactory', 'Report']
 VALID_MESSSAGE_TYPES = ('Event', 'Message', 'Report')
+# Key marking serialized messages as validated, see MessageFactory.unserialize
+VALIDATED_MARKER = '__validated'
+# Key of the trace in serialized messages, see Message.trace
+TRACE_KEY = '__trace'
+
+
+def _pack_msgpack(message: dict) -> bytes:
+    return msgpack.packb(message, use_bin_type=True)
+
+
+def _unpack_msgpack(raw_message: bytes) -> dict:
+    return msgpack.unpackb(raw_message, raw=False)
+
+
+# Binary encodings: name -> (marker, encode function, decode function, required module or None)
+# The one-byte marker is the first byte of the encoded messages. JSON encoded
+# messages always begin with '{', so both can be read at the same time.
+BINARY_ENCODINGS = {'msgpack': (b'\x01', _pack_msgpack, _unpack_msgpack, msgpack)}
+BINARY_MARKERS = {marker: name for name, (marker, *_) in BINARY_ENCODINGS.items()}
+ENCODINGS = ('json', ) + tuple(BINARY_ENCODINGS)
+
+
+def check_encoding(encoding: str):
+    """
+    Checks if the given message encoding is known and usable.
+
+    Raises:
+        intelmq.lib.exceptions.InvalidArgument: if the encoding is unknown
+        ValueError: if the library needed for the encoding is not installed
+    """
+    if encoding not in ENCODINGS:
+        raise exceptions.InvalidArgument('encoding', got=encoding, expected=ENCODINGS)
+    if encoding in BINARY_ENCODINGS and BINARY_ENCODINGS[encoding][3] is None:
+        raise ValueError("To use the encoding %r you must install the %r library." % (encoding, encoding))
+
+
+def is_binary(raw_message: Union[bytes, str]) -> bool:
+    """ Returns True if the serialized message has a binary encoding. """
+    return isinstance(raw_message, bytes) and raw_message[:1] in BINARY_MARKERS
 
 
 class MessageFactory(object):
     """
-    unserialize: JSON encoded message to object
-    serialize: object to JSON encoded object
+    unserialize: JSON or binary encoded message to object
+    serialize: object to JSON or binary encoded object
     """
 
     @staticmethod
     def from_dict(message: dict, harmonization=None,
-                  default_type: Optional[str] = None) -> dict:
+                  default_type: Optional[str] = None, trusted: bool = False) -> dict:
         """
         Takes dictionary Message object, returns instance of correct class.
 
@@ -36,6 +81,8 @@ def from_dict(message: dict, harmonization=None,
             message: the message which should be converted to a Message object
             harmonization: a dictionary holding the used harmonization
             default_type: If '__type' is not present in message, the given type will be used
+            trusted: If True and the message has been marked as validated by
+                serialize, the fields are not validated again
 
         See also:
             MessageFactory.unserialize
@@ -51,11 +98,19 @@ def from_dict(message: dict, harmonization=None,
                                              expected=VALID_MESSSAGE_TYPES,
                                              docs=HARMONIZATION_CONF_FILE)
         del message["__type"]
-        return class_reference(message, auto=True, harmonization=harmonization)
+        validated = message.pop(VALIDATED_MARKER, False)
+        trace = message.pop(TRACE_KEY, None)
+        if trusted and validated:
+            instance = class_reference.from_validated(message, harmonization=harmonization)
+        else:
+            instance = class_reference(message, auto=True, harmonization=harmonization)
+        if trace:
+            instance.trace = trace
+        return instance
 
     @staticmethod
     def unserialize(raw_message: str, harmonization: dict = None,
-                    default_type: Optional[str] = None) -> dict:
+                    default_type: Optional[str] = None, trusted: bool = False) -> dict:
         """
         Takes JSON-encoded Message object, returns instance of correct class.
 
@@ -63,6 +118,8 @@ def unserialize(raw_message: str, harmonization: dict = None,
             message: the message which should be converted to a Message object
             harmonization: a dictionary holding the used harmonization
             default_type: If '__type' is not present in message, the given type will be used
+            trusted: If True and the message has been marked as validated by
+                serialize, the fields are not validated again
 
         See also:
             MessageFactory.from_dict
@@ -70,23 +127,107 @@ def unserialize(raw_message: str, harmonization: dict = None,
         """
         message = Message.unserialize(raw_message)
         return MessageFactory.from_dict(message, harmonization=harmonization,
-                                        default_type=default_type)
+                                        default_type=default_type, trusted=trusted)
 
     @staticmethod
-    def serialize(message):
+    def serialize(message, validated: bool = False,
+                  encoding: str = 'json') -> Union[str, bytes]:
         """
         Takes instance of message-derived class and makes JSON-encoded Message.
 
         The class is saved in __type attribute.
+        If validated is True, the message is marked as validated, see unserialize.
+        With a binary encoding (see BINARY_ENCODINGS), bytes are returned.
         """
-        raw_message = Message.serialize(message)
+        raw_message = Message.serialize(message, validated=validated, encoding=encoding)
         return raw_message
 
 
+class CompiledField(object):
+    """
+    A field of the harmonization, compiled for fast validation and sanitation.
+
+    Holds the functions of the field's harmonization type and the precompiled
+    checks of the field's configuration (length, regex, iregex).
+    """
+
+    __slots__ = ('type', 'is_valid', 'sanitize', 'length', 'regex', 'iregex')
+
+    def __init__(self, config: dict):
+        self.type = getattr(intelmq.lib.harmonization, config['type'])
+        self.is_valid = self.type.is_valid
+        self.sanitize = self.type.sanitize
+        self.length = config.get('length')
+        self.regex = re.compile(config['regex']) if 'regex' in config else None
+        self.iregex = re.compile(config['iregex'], re.IGNORECASE) if 'iregex' in config else None
+
+    def validate(self, value: Any, subitem: bool = False) -> tuple:
+        """
+        Returns a tuple, the first item is True if the value is valid,
+        otherwise False and the second item gives the reason.
+        """
+        if subitem:
+            if not self.type.is_valid_subitem(value):
+                return (False, 'is_valid returned False.')
+        elif not self.is_valid(value):
+            return (False, 'is_valid returned False.')
+        if self.length is None and self.regex is None and self.iregex is None:
+            return (True, )
+        str_value = str(value)
+        if self.length is not None and len(str_value) > self.length:
+            return (False, 'too long: {} > {}.'.format(len(str_value), self.length))
+        if self.regex is not None and not self.regex.search(str_value):
+            return (False, 'regex did not match.')
+        if self.iregex is not None and not self.iregex.search(str_value):
+            return (False, 'regex (case insensitive) did not match.')
+        return (True, )
+
+
+HARMONIZATION_KEY_REGEX = re.compile('^[a-z_](.[a-z_0-9]+)*$')
+# compiled harmonization configurations by id, with a reference to the configuration itself
+_compiled_harmonizations = {}  # type: Dict[int, tuple]
+
+
+def compile_harmonization(harmonization_config: dict) -> Dict[str, CompiledField]:
+    """
+    Compiles the harmonization configuration of a message type to a table of fields.
+
+    The table is only compiled once for every configuration object and then
+    shared by all messages using this configuration.
+
+    Raises:
+        intelmq.lib.exceptions.InvalidKey: if a key of the harmonization is invalid.
+    """
+    try:
+        config, compiled = _compiled_harmonizations[id(harmonization_config)]
+    except KeyError:
+        pass
+    else:
+        if config is harmonization_config:
+            return compiled
+
+    compiled = {}
+    for harm_key, field_config in harmonization_config.items():
+        if harm_key == '__type':
+            continue
+        if not HARMONIZATION_KEY_REGEX.match(harm_key):
+            raise exceptions.InvalidKey("Harmonization key %r is invalid." % harm_key)
+        compiled[harm_key] = CompiledField(field_config)
+
+    if len(_compiled_harmonizations) >= 16:
+        # configurations are loaded again and again, e.g. for messages created without harmonization
+        _compiled_harmonizations.clear()
+    _compiled_harmonizations[id(harmonization_config)] = (harmonization_config, compiled)
+    return compiled
+
+
 class Message(dict):
 
     _IGNORED_VALUES = ["", "-", "N/A"]
     _default_value_set = False
+    # Optional processing trace, not a harmonized field, see Bot parameter `tracing`:
+    # {'ingest': timestamp, 'hops': [[bot id, source queue, dequeue time, enqueue time], ...]}
+    trace = None
 
     def __init__(self, message: Union[dict, tuple] = (), auto: bool = False,
                  harmonization: dict = None) -> None:
@@ -111,9 +252,7 @@ def __init__(self, message: Union[dict, tuple] = (), auto: bool = False,
             warnings.warn("Assuming harmonization type 'JSONDict' for harmonization field 'extra'. "
                           "This assumption will be removed in version 2.0.", DeprecationWarning)
             self.harmonization_config['extra']['type'] = 'JSONDict'
-        for harm_key in self.harmonization_config.keys():
-            if not re.match('^[a-z_](.[a-z_0-9]+)*$', harm_key) and harm_key != '__type':
-                raise exceptions.InvalidKey("Harmonization key %r is invalid." % harm_key)
+        self._fields = compile_harmonization(self.harmonization_config)
 
         super().__init__()
         if isinstance(message, dict):
@@ -126,6 +265,19 @@ def __init__(self, message: Union[dict, tuple] = (), auto: bool = False,
             if not self.add(key, value, sanitize=False, raise_failure=False):
                 self.add(key, value, sanitize=True)
 
+    @classmethod
+    def from_validated(cls, message: dict, harmonization: dict = None) -> 'Message':
+        """
+        Creates the message from fields without validating them again.
+
+        Only use it for messages which have been validated with the same
+        harmonization before, see MessageFactory.unserialize.
+        """
+        instance = cls.__new__(cls)
+        Message.__init__(instance, harmonization=harmonization)
+        dict.update(instance, message)
+        return instance
+
     def __setitem__(self, key: str, value: Any) -> None:
         self.add(key, value)
 
@@ -306,14 +458,56 @@ def deep_copy(self):
     def __str__(self):
         return self.serialize()
 
-    def serialize(self):
+    def serialize(self, validated: bool = False, encoding: str = 'json') -> Union[str, bytes]:
+        if encoding != 'json':
+            return self.__serialize_binary(validated, encoding)
         self['__type'] = self.__class__.__name__
+        # not harmonization fields, bypass the validation
+        if validated:
+            dict.__setitem__(self, VALIDATED_MARKER, True)
+        if self.trace:
+            dict.__setitem__(self, TRACE_KEY, self.trace)
         json_dump = utils.decode(json.dumps(self))
         del self['__type']
+        if validated:
+            dict.__delitem__(self, VALIDATED_MARKER)
+        if self.trace:
+            dict.__delitem__(self, TRACE_KEY)
         return json_dump
 
+    def __serialize_binary(self, validated: bool, encoding: str) -> bytes:
+        """
+        Serializes the message with the binary encoding, prefixed by the encoding's marker.
+
+        Values of Base64 fields are stored as bytes, if they can be restored exactly.
+        """
+        check_encoding(encoding)
+        marker, encode, _, _ = BINARY_ENCODINGS[encoding]
+        message = dict(self)
+        for key, value in message.items():
+            field = self._fields.get(key)
+            if field is not None and field.type is intelmq.lib.harmonization.Base64:
+                binary = base64.b64decode(value)
+                if base64.b64encode(binary).decode() == value:
+                    message[key] = binary
+        message['__type'] = self.__class__.__name__
+        if validated:
+            message[VALIDATED_MARKER] = True
+        if self.trace:
+            message[TRACE_KEY] = self.trace
+        return marker + encode(message)
+
     @staticmethod
-    def unserialize(message_string: str):
+    def unserialize(message_string: Union[str, bytes]):
+        if is_binary(message_string):
+            encoding = BINARY_MARKERS[message_string[:1]]
+            check_encoding(encoding)
+            message = BINARY_ENCODINGS[encoding][2](message_string[1:])
+            for key, value in message.items():
+                if isinstance(value, bytes):
+                    # binary values are Base64 fields
+                    message[key] = base64.b64encode(value).decode()
+            return message
         message = json.loads(message_string)
         return message
 
@@ -329,34 +523,21 @@ def __is_valid_key(self, key: str):
     def __is_valid_value(self, key: str, value: str):
         if key == '__type':
             return (True, )
-        config, subitem = self.__get_type_config(key)
-        class_reference = getattr(intelmq.lib.harmonization, config['type'])
-        if not subitem:
-            validation = class_reference().is_valid(value)
-        else:
-            validation = class_reference().is_valid_subitem(value)
-        if not validation:
-            return (False, 'is_valid returned False.')
-        if 'length' in config:
-            length = len(str(value))
-            if not length <= config['length']:
-                return (False, 'too long: {} > {}.'.format(length,
-                                                           config['length']))
-        if 'regex' in config:
-            if not re.search(config['regex'], str(value)):
-                return (False, 'regex did not match.')
-        if 'iregex' in config:
-            if not re.search(config['iregex'], str(value), re.IGNORECASE):
-                return (False, 'regex (case insensitive) did not match.')
-        return (True, )
+        field, subitem = self.__get_field(key)
+        return field.validate(value, subitem)
 
     def __sanitize_value(self, key: str, value: str):
-        class_name, subitem = self.__get_type_config(key)
-        class_reference = getattr(intelmq.lib.harmonization, class_name['type'])
+        field, subitem = self.__get_field(key)
         if not subitem:
-            return class_reference().sanitize(value)
+            return field.sanitize(value)
         else:
-            return class_reference().sanitize_subitem(value)
+            return field.type.sanitize_subitem(value)
+
+    def __get_field(self, key: str):
+        try:
+            return self._fields[key], False
+        except KeyError:
+            return self._fields[key.split('.')[0]], True
 
     def __get_type_config(self, key: str):
         if key == '__type':
@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+"""
+Microbenchmarks of the harmonization types, of the methods of messages, of
+the network lookups and of the sieve expert.
+
+The values and events are generated from a seed, with a distribution similar
+to the output of parsers: mostly valid values, some needing sanitation and
+a few invalid ones. Run the benchmarks with `intelmq-bench micro`.
+"""
+import base64
+import functools
+import importlib.util
+import ipaddress
+import json
+import logging
+import random
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import pkg_resources
+
+import intelmq.lib.harmonization as harmonization
+from intelmq.lib.message import Event, MessageFactory, msgpack
+from intelmq.lib.networks import NetworkMap
+from intelmq.lib.utils import load_configuration
+
+__all__ = ['generate_events', 'generate_modify', 'generate_sieve', 'generate_values', 'BENCHMARKS', 'select', 'run']
+
+CLASSIFICATIONS = ('malware', 'botnet drone', 'c2server', 'phishing', 'scanner',
+                   'spam', 'brute-force', 'vulnerable service', 'ddos', 'blacklist')
+FEEDS = ('Example Feed', 'Shadowserver Drone', 'Spamhaus Drop', 'Abuse.ch Feodo')
+TLDS = ('com', 'net', 'org', 'at', 'de', 'ru', 'cn', 'info')
+PROTOCOLS = (('tcp', 'http', 80), ('tcp', 'https', 443), ('tcp', 'ssh', 22),
+             ('udp', 'dns', 53), ('tcp', 'smtp', 25))
+NOW = datetime(2019, 1, 1, tzinfo=timezone.utc)
+# number of distinct values per benchmark, the operations cycle through them
+SAMPLES = 1000
+# number of rules of the sieve benchmark
+SIEVE_RULES = 800
+# number of rules of the modify benchmark
+MODIFY_RULES = 400
+# number of networks of the network lookup benchmark
+NETWORKS = 100000
+
+
+def random_ip(rand: random.Random) -> str:
+    if rand.random() < 0.9:
+        return str(ipaddress.IPv4Address(rand.randint(0x01000000, 0xdfffffff)))
+    return str(ipaddress.IPv6Address((0x2001 << 112) + rand.getrandbits(96)))
+
+
+def random_fqdn(rand: random.Random) -> str:
+    return '%s.example.%s' % (''.join(rand.choice('abcdefghijklmnopqrstuvwxyz')
+                                      for _ in range(rand.randint(3, 12))),
+                              rand.choice(TLDS))
+
+
+def random_time(rand: random.Random) -> datetime:
+    return NOW - timedelta(seconds=rand.randint(0, 86400))
+
+
+def generate_events(count: int, seed: int = 0) -> List[str]:
+    """
+    Generates a reproducible corpus of serialized events.
+
+    The events resemble the output of parsers: classification, feed and time
+    fields and a mix of IP addresses, domains, URLs and ports.
+    """
+    rand = random.Random(seed)
+    events = []
+    for _ in range(count):
+        transport, application, port = rand.choice(PROTOCOLS)
+        event = {'__type': 'Event',
+                 'feed.name': rand.choice(FEEDS),
+                 'feed.accuracy': 100.0,
+                 'classification.type': rand.choice(CLASSIFICATIONS),
+                 'source.ip': random_ip(rand),
+                 'source.port': rand.randint(1024, 65535),
+                 'destination.port': port,
+                 'protocol.transport': transport,
+                 'protocol.application': application,
+                 'time.source': random_time(rand).isoformat(),
+                 'time.observation': NOW.isoformat(),
+                 }
+        if rand.random() < 0.5:
+            fqdn = random_fqdn(rand)
+            event['source.fqdn'] = fqdn
+            if rand.random() < 0.5:
+                event['source.url'] = '%s://%s/%s' % (application if application in ('http', 'https') else 'http',
+                                                      fqdn, rand.randint(0, 10 ** 6))
+        if rand.random() < 0.3:
+            event['source.asn'] = rand.randint(1, 400000)
+        if rand.random() < 0.2:
+            event['extra.count'] = rand.randint(1, 1000)
+        event['raw'] = base64.b64encode(','.join(str(value) for value in event.values()
+                                                 ).encode()).decode()
+        events.append(json.dumps(event))
+    return events
+
+
+def generate_sieve(count: int, seed: int = 0) -> str:
+    """
+    Generates a reproducible sieve file with `count` rules.
+
+    The rules use all kinds of conditions, mostly in the form of filter lists
+    of constituencies: equality tests of the feed and the classification,
+    network ranges, regular expressions, substrings and numeric comparisons.
+    Only a few of the rules match the events of `generate_events`.
+    """
+    rand = random.Random(seed)
+    rules = []
+    for number in range(count):
+        kind = number % 5
+        if kind == 0:
+            condition = "feed.name == '%s' && classification.type == ['%s', '%s']" % (
+                rand.choice(FEEDS) if rand.random() < 0.1 else 'Feed %d' % number,
+                rand.choice(CLASSIFICATIONS), rand.choice(CLASSIFICATIONS))
+        elif kind == 1:
+            condition = 'source.ip << [%s]' % ', '.join(
+                "'%s'" % ipaddress.ip_network('%s/%d' % (random_ip(rand), rand.randint(16, 28)), strict=False)
+                for _ in range(rand.randint(1, 5)))
+        elif kind == 2:
+            condition = "source.fqdn =~ '^%s[a-z]*[.]example[.]%s$'" % (
+                ''.join(rand.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rand.randint(1, 3))),
+                rand.choice(TLDS))
+        elif kind == 3:
+            condition = "source.url :contains ['/%d/', 'id=%d']" % (rand.randint(0, 10 ** 6), rand.randint(100, 200))
+        else:
+            condition = 'source.port > %d && destination.port == [%d, %d]' % (
+                rand.randint(60000, 65535), rand.choice(PROTOCOLS)[2], rand.choice(PROTOCOLS)[2])
+        if rand.random() < 0.5:
+            action = "add! comment = 'rule %d'" % number
+        else:
+            action = "path 'queue-%d'" % (number % 10)
+        rules.append('if %s {\n    %s\n}\n' % (condition, action))
+    return ''.join(rules)
+
+
+def generate_modify(count: int, seed: int = 0) -> list:
+    """
+    Generates a reproducible modify configuration with `count` rules.
+
+    Most rules test the feed or the classification with literal patterns,
+    the others the ports, domains and URLs with regular expressions.
+    Only a few of the rules match the events of `generate_events`.
+    """
+    rand = random.Random(seed)
+    rules = []
+    for number in range(count):
+        kind = number % 4
+        if kind == 0:
+            condition = {'feed.name': '^%s$' % re.escape(rand.choice(FEEDS) if rand.random() < 0.1 else 'Feed %d' % number),
+                         'classification.type': '^(%s|%s)$' % (rand.choice(CLASSIFICATIONS), rand.choice(CLASSIFICATIONS))}
+        elif kind == 1:
+            condition = {'classification.type': '^%s$' % rand.choice(CLASSIFICATIONS),
+                         'source.port': '^%d$' % rand.randint(1024, 65535)}
+        elif kind == 2:
+            condition = {'source.fqdn': '^%s[a-z]*[.]example[.]%s$' % (
+                ''.join(rand.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rand.randint(1, 3))),
+                rand.choice(TLDS))}
+        else:
+            condition = {'source.url': '/%d$' % rand.randint(0, 10 ** 6)}
+        rules.append({'rulename': 'rule %d' % number, 'if': condition,
+                      'then': {'comment': 'rule %d' % number}})
+    return rules
+
+
+def _datetime(rand: random.Random):
+    value = random_time(rand)
+    return rand.choice((value.isoformat(),  # already valid
+                        value.isoformat(),
+                        value.strftime('%Y-%m-%d %H:%M:%S'),
+                        value.astimezone(timezone(timedelta(hours=2))).isoformat(),
+                        value.strftime('%a, %d %b %Y %H:%M:%S +0000'),
+                        value.strftime('%d.%m.%Y %H:%M UTC'),
+                        'not a date',
+                        ))
+
+
+def _fqdn(rand: random.Random):
+    value = random_fqdn(rand)
+    return rand.choice((value, value, value, value.upper(), value + '.',
+                        'xn--bcher-kva.example.' + rand.choice(TLDS), random_ip(rand),
+                        'http://' + value + '/'))
+
+
+def _ip(rand: random.Random):
+    value = random_ip(rand)
+    return rand.choice((value, value, value, ' %s ' % value, value + '/32',
+                        ipaddress.ip_address(value), '256.1.2.3', 'fe80::1%eth0'))
+
+
+def _network(rand: random.Random):
+    value = random_ip(rand)
+    prefix = 24 if ':' not in value else 64
+    network = str(ipaddress.ip_network('%s/%d' % (value, prefix), strict=False))
+    return rand.choice((network, network, '%s/%d' % (value, prefix), value, 'invalid/24'))
+
+
+def _url(rand: random.Random):
+    fqdn = random_fqdn(rand)
+    path = '/%d/index.php?id=%d' % (rand.randint(0, 10 ** 6), rand.randint(0, 100))
+    return rand.choice(('http://' + fqdn + path, 'https://' + fqdn + path,
+                        'http://%s:8080%s' % (random_ip(rand), path),
+                        'hxxp://' + fqdn + path, fqdn + path))
+
+
+GENERATORS = {
+    'Accuracy': lambda rand: rand.choice((100, 100.0, '100', '75.5', 50, 150, 'high')),
+    'ASN': lambda rand: rand.choice((rand.randint(1, 400000), str(rand.randint(1, 400000)),
+                                     'AS%d' % rand.randint(1, 400000), 0, 'unknown')),
+    'Base64': lambda rand: '%s,%d' % (random_ip(rand), rand.randint(1, 65535)),
+    'Boolean': lambda rand: rand.choice((True, False, 'true', 'False', 1, 0, 'yes')),
+    'ClassificationType': lambda rand: rand.choice(CLASSIFICATIONS + ('Malware', 'c&c', 'unknown')),
+    'DateTime': _datetime,
+    'FQDN': _fqdn,
+    'Float': lambda rand: rand.choice((rand.random() * 100, str(rand.random() * 100),
+                                       rand.randint(0, 100), 'NaN', 'none')),
+    'Integer': lambda rand: rand.choice((rand.randint(1, 65535), str(rand.randint(1, 65535)),
+                                         ' %d' % rand.randint(1, 65535), '1.5')),
+    'IPAddress': _ip,
+    'IPNetwork': _network,
+    'JSON': lambda rand: rand.choice(('{"count": %d}' % rand.randint(1, 100), [1, 2],
+                                      {'count': rand.randint(1, 100)}, '{invalid')),
+    'JSONDict': lambda rand: rand.choice(('{"count": %d}' % rand.randint(1, 100),
+                                          '{"count": %d, "tags": ["a"]}' % rand.randint(1, 100),
+                                          {'count': rand.randint(1, 100), 'tags': ['a', 'b']},
+                                          '[1, 2]', '{invalid')),
+    'LowercaseString': lambda rand: rand.choice(('tcp', 'udp', 'HTTP', ' smtp ', '')),
+    'Registry': lambda rand: rand.choice(('RIPE', 'ripe', 'RIPE-NCC', 'ARIN', 'apnic', 'unknown')),
+    'String': lambda rand: rand.choice((rand.choice(FEEDS), ' %s ' % rand.choice(FEEDS),
+                                        b'Example Feed', '')),
+    'TLP': lambda rand: rand.choice(('AMBER', 'green', 'TLP:RED', 'tlp:white', 'BLUE')),
+    'UppercaseString': lambda rand: rand.choice(('AT', 'de', ' US ', '')),
+    'URL': _url,
+}
+
+
+def generate_values(type_name: str, count: int = SAMPLES, seed: int = 0) -> list:
+    """ Generates unsanitized values for the harmonization type. """
+    rand = random.Random('%s-%s' % (seed, type_name))
+    return [GENERATORS[type_name](rand) for _ in range(count)]
+
+
+def _sanitize(type_name: str, seed: int) -> Tuple[Callable, list]:
+    return getattr(harmonization, type_name).sanitize, generate_values(type_name, seed=seed)
+
+
+def _is_valid(type_name: str, seed: int) -> Tuple[Callable, list]:
+    """ Validates the sanitized values, the invalid values are kept as they are. """
+    type_class = getattr(harmonization, type_name)
+    values = []
+    for value in generate_values(type_name, seed=seed):
+        sanitized = type_class.sanitize(value)
+        values.append(value if sanitized is None else sanitized)
+    return type_class.is_valid, values
+
+
+def _load_harmonization() -> dict:
+    return load_configuration(pkg_resources.resource_filename('intelmq', 'etc/harmonization.conf'))
+
+
+def _events(seed: int) -> List[Event]:
+    config = _load_harmonization()
+    return [MessageFactory.unserialize(raw, harmonization=config)
+            for raw in generate_events(SAMPLES, seed=seed)]
+
+
+def _construct(seed: int) -> Tuple[Callable, list]:
+    config = _load_harmonization()
+    return (lambda raw: MessageFactory.unserialize(raw, harmonization=config),
+            generate_events(SAMPLES, seed=seed))
+
+
+def _construct_trusted(seed: int) -> Tuple[Callable, list]:
+    config = _load_harmonization()
+    return (lambda raw: MessageFactory.unserialize(raw, harmonization=config, trusted=True),
+            [event.serialize(validated=True) for event in _events(seed)])
+
+
+def _add(seed: int) -> Tuple[Callable, list]:
+    config = _load_harmonization()
+
+    def add(fields):
+        event = Event(harmonization=config)
+        for key, value in fields:
+            event.add(key, value)
+    rand = random.Random(seed)
+    fields = [[('source.ip', random_ip(rand)),
+               ('source.port', str(rand.randint(1024, 65535))),
+               ('source.fqdn', random_fqdn(rand)),
+               ('source.url', 'http://%s/%d' % (random_fqdn(rand), rand.randint(0, 10 ** 6))),
+               ('classification.type', rand.choice(CLASSIFICATIONS)),
+               ('time.source', random_time(rand).isoformat()),
+               ('source.asn', rand.randint(1, 400000)),
+               ('feed.accuracy', '100'),
+               ] for _ in range(SAMPLES)]
+    return add, fields
+
+
+def _method(call: Callable, seed: int) -> Tuple[Callable, list]:
+    return call, _events(seed)
+
+
+def _networks(seed: int) -> Tuple[Callable, list]:
+    rand = random.Random(seed)
+    networks = NetworkMap((str(ipaddress.ip_network((rand.randint(0x01000000, 0xdfffffff), rand.randint(12, 32)),
+                                                    strict=False)), number)
+                          for number in range(NETWORKS))
+    return networks.lookup, [random_ip(rand) for _ in range(SAMPLES)]
+
+
+def _sieve(seed: int) -> Tuple[Callable, list]:
+    from intelmq.bots.experts.sieve.expert import SieveExpertBot
+
+    SieveExpertBot.harmonization = _load_harmonization()['event']
+    metamodel = SieveExpertBot.init_metamodel()
+    logger = logging.getLogger(__name__)
+    sieve = metamodel.model_from_str(generate_sieve(SIEVE_RULES, seed=seed))
+    rules = SieveExpertBot.compile_sieve(sieve, logger)
+    index = SieveExpertBot.index_sieve(sieve)
+    return (lambda event: SieveExpertBot.apply_rules(rules, event, logger, index)), _events(seed)
+
+
+def _modify(seed: int) -> Tuple[Callable, list]:
+    from intelmq.bots.experts.modify.lib import Program
+
+    program = Program(generate_modify(MODIFY_RULES, seed=seed), True, logging.getLogger(__name__))
+    return program.process, _events(seed)
+
+
+# name: function of the seed returning the benchmarked function and the list of its arguments
+BENCHMARKS = {}  # type: Dict[str, Callable[[int], Tuple[Callable, list]]]
+for _type in sorted(GENERATORS):
+    BENCHMARKS['harmonization.%s.is_valid' % _type] = functools.partial(_is_valid, _type)
+    BENCHMARKS['harmonization.%s.sanitize' % _type] = functools.partial(_sanitize, _type)
+BENCHMARKS.update({
+    'message.construct': _construct,
+    'message.construct_trusted': _construct_trusted,
+    'message.add': _add,
+    'message.hash': functools.partial(_method, lambda event: event.hash()),
+    'message.to_dict': functools.partial(_method, lambda event: event.to_dict()),
+    'message.to_dict_hierarchical': functools.partial(_method, lambda event: event.to_dict(hierarchical=True)),
+    'message.to_json': functools.partial(_method, lambda event: event.to_json()),
+    'message.serialize': functools.partial(_method, lambda event: event.serialize()),
+    'message.copy': functools.partial(_method, lambda event: event.copy()),
+    'message.deep_copy': functools.partial(_method, lambda event: event.deep_copy()),
+    'networks.lookup': _networks,
+    'modify.process': _modify,
+})
+if msgpack is not None:
+    BENCHMARKS['message.serialize_msgpack'] = functools.partial(_method,
+                                                                lambda event: event.serialize(encoding='msgpack'))
+if importlib.util.find_spec('textx') is not None:
+    BENCHMARKS['sieve.process'] = _sieve
+
+
+def select(patterns: Optional[Iterable[str]] = None) -> List[str]:
+    """ Names of the benchmarks matching any of the regular expressions, all by default. """
+    if not patterns:
+        return list(BENCHMARKS)
+    regexes = [re.compile(pattern) for pattern in patterns]
+    return [name for name in BENCHMARKS if any(regex.search(name) for regex in regexes)]
+
+
+def run(names: Iterable[str], count: int = 10000, repeat: int = 5, seed: int = 0) -> Dict[str, dict]:
+    """
+    Runs each benchmark `repeat` times with `count` operations and reports
+    the best run in operations per second and nanoseconds per operation.
+    """
+    results = {}
+    for name in names:
+        function, values = BENCHMARKS[name](seed)
+        arguments = (values * (count // len(values) + 1))[:count]
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for argument in arguments:
+                function(argument)
+            best = min(best, time.perf_counter() - start)
+        results[name] = {'operations_per_second': count / best,
+                         'nanoseconds': best / count * 1e9,
+                         }
+    return results
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Longest prefix match of IP addresses in large lists of networks.
+
+A `NetworkMap` maps networks to values. The networks are flattened into
+sorted arrays of disjoint address intervals, each holding the values of all
+networks covering it, so a lookup is a binary search over integers instead of
+a comparison with every network.
+"""
+import bisect
+import ipaddress
+import socket
+from typing import Any, Iterable, Optional, Tuple, Union
+
+__all__ = ['flatten', 'NetworkMap', 'parse_address']
+
+Address = Union[str, int, ipaddress.IPv4Address, ipaddress.IPv6Address]
+
+
+def parse_address(address: Address) -> Tuple[int, int]:
+    """
+    The IP version and the integer of the address.
+
+    Strings are parsed with inet_pton, which is much faster than the ipaddress module.
+
+    Raises:
+        ValueError: If the address is not valid
+    """
+    if isinstance(address, str):
+        for version, family in ((4, socket.AF_INET), (6, socket.AF_INET6)):
+            try:
+                return version, int.from_bytes(socket.inet_pton(family, address), 'big')
+            except OSError:
+                pass
+    if not isinstance(address, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+        # e.g. IPv6 addresses with scope
+        address = ipaddress.ip_address(address)
+    return address.version, int(address)
+
+
+def flatten(networks: Iterable[Tuple[int, int, list]]) -> Tuple[list, list, list]:
+    """
+    Flattens nested intervals into disjoint intervals.
+
+    Parameters:
+        networks: Distinct networks as first and last address and their values
+
+    Returns:
+        The sorted first and last addresses of the disjoint intervals and the
+        values of all networks covering each interval, from the least to the
+        most specific network
+    """
+    starts, ends, chains = [], [], []
+    # enclosing networks as (last address, values), the start of the next interval
+    stack = []
+    position = 0
+
+    def close(end):
+        if stack and position <= end:
+            starts.append(position)
+            ends.append(end)
+            chains.append(stack[-1][1])
+
+    # enclosing networks first, CIDR networks are either nested or disjoint
+    for first, last, values in sorted(networks, key=lambda network: (network[0], -network[1])):
+        while stack and stack[-1][0] < first:
+            close(stack[-1][0])
+            position = stack.pop()[0] + 1
+        close(first - 1)
+        stack.append((last, (stack[-1][1] if stack else ()) + tuple(values)))
+        position = first
+    while stack:
+        close(stack[-1][0])
+        position = stack.pop()[0] + 1
+    return starts, ends, chains
+
+
+class NetworkMap(object):
+    """
+    IPv4 and IPv6 networks and their values, looked up by address.
+
+    Networks may be nested, a lookup returns the value of the most specific
+    network containing the address. Host bits of the networks are ignored.
+
+    Parameters:
+        networks: Networks, as strings or tuples of the network and its value
+        default: The value of networks given without value
+    """
+
+    def __init__(self, networks: Iterable = (), default: Any = True):
+        # (version, first address, last address): values
+        self.__networks = {}
+        self.__arrays = None
+        for network in networks:
+            if isinstance(network, str):
+                self.add(network, default)
+            else:
+                self.add(*network)
+
+    @classmethod
+    def from_file(cls, filename: str, default: Any = True) -> 'NetworkMap':
+        """
+        Reads the networks from a file with one network per line, optionally
+        followed by whitespace and the value. Empty lines and lines starting
+        with `#` are ignored.
+
+        Raises:
+            ValueError: If a line is not a valid network
+        """
+        networks = cls()
+        with open(filename) as handle:
+            for number, line in enumerate(handle, start=1):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                fields = line.split(None, 1)
+                try:
+                    networks.add(fields[0], fields[1] if len(fields) > 1 else default)
+                except ValueError as exc:
+                    raise ValueError('Invalid network in line %d of %r: %s' % (number, filename, exc))
+        return networks
+
+    def add(self, network: str, value: Any = True):
+        network = ipaddress.ip_network(network, strict=False)
+        key = (network.version, int(network.network_address), int(network.broadcast_address))
+        self.__networks.setdefault(key, []).append(value)
+        self.__arrays = None
+
+    def __len__(self) -> int:
+        """ Number of distinct networks. """
+        return len(self.__networks)
+
+    def __build(self):
+        self.__arrays = {}
+        for version in (4, 6):
+            self.__arrays[version] = flatten((first, last, values)
+                                             for (network_version, first, last), values in self.__networks.items()
+                                             if network_version == version)
+
+    def lookup_all(self, address: Address) -> Tuple:
+        """
+        Values of all networks containing the address, from the least to the
+        most specific network.
+
+        Raises:
+            ValueError: If the address is not valid
+        """
+        if self.__arrays is None:
+            self.__build()
+        version, integer = parse_address(address)
+        starts, ends, values = self.__arrays[version]
+        index = bisect.bisect_right(starts, integer) - 1
+        if index >= 0 and integer <= ends[index]:
+            return values[index]
+        return ()
+
+    def lookup(self, address: Address, default: Any = None) -> Optional[Any]:
+        """
+        Value of the most specific network containing the address.
+
+        Raises:
+            ValueError: If the address is not valid
+        """
+        values = self.lookup_all(address)
+        return values[-1] if values else default
+
+    def __contains__(self, address: Address) -> bool:
+        """ If the address is in any of the networks, False for invalid addresses. """
+        try:
+            return bool(self.lookup_all(address))
+        except ValueError:
+            return False
@@ -1,16 +1,20 @@
 # -*- coding: utf-8 -*-
+import re
 import time
 import warnings
+import zlib
+from collections import defaultdict, deque
 from itertools import chain
-from typing import Dict, Optional, Union
+from typing import Callable, Dict, Iterable, List, Optional, Union
 
 import redis
 
 import intelmq.lib.exceptions as exceptions
+import intelmq.lib.message as libmessage
 import intelmq.lib.pipeline
 import intelmq.lib.utils as utils
 
-__all__ = ['Pipeline', 'PipelineFactory', 'Redis', 'Pythonlist', 'Amqp']
+__all__ = ['Pipeline', 'PipelineFactory', 'Redis', 'Pythonlist', 'Amqp', 'Chain']
 
 try:
     import pika
@@ -21,6 +25,68 @@
 except ImportError:
     pika = None
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def _compress_zstd(data: bytes) -> bytes:
+    return zstandard.ZstdCompressor().compress(data)
+
+
+def _decompress_zstd(data: bytes) -> bytes:
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+# name: (marker, compress, decompress, library)
+# The markers must not collide with the markers of the binary message encodings
+COMPRESSIONS = {'zlib': (b'\x02', zlib.compress, zlib.decompress, zlib),
+                'zstd': (b'\x03', _compress_zstd, _decompress_zstd, zstandard),
+                }
+COMPRESSION_MARKERS = {marker: name for name, (marker, *_) in COMPRESSIONS.items()}
+
+
+def decompress(message: Union[str, bytes]) -> Union[str, bytes]:
+    """
+    Decompresses a received message compressed by the sending pipeline and
+    decodes it, like Pipeline.receive does for uncompressed messages.
+    Other messages are returned unchanged.
+
+    The pipelines do not decompress the messages themselves, so a corrupt
+    message fails in the bot like any other invalid message and is dumped.
+
+    Raises:
+        ValueError: if the library of the compression is not installed
+        Exception: Errors of the decompression, e.g. zlib.error for corrupt data
+    """
+    if not isinstance(message, bytes) or message[:1] not in COMPRESSION_MARKERS:
+        return message
+    name = COMPRESSION_MARKERS[message[:1]]
+    _, _, decompress_message, library = COMPRESSIONS[name]
+    if library is None:
+        raise ValueError("To receive messages compressed with %r you must install the 'zstandard' library." % name)
+    message = decompress_message(message[1:])
+    if libmessage.is_binary(message):
+        return message
+    return utils.decode(message)
+
+
+def internal_queue_names(source_queue: str, processes: int = 1) -> List[str]:
+    """
+    Returns the internal queues of a bot running in the given number of
+    worker processes (parameter `instances_processes`): `[source-queue]-internal`
+    for a single process, otherwise `[source-queue]-internal.[n]` for every worker.
+    """
+    if processes > 1:
+        return ['%s-internal.%d' % (source_queue, i) for i in range(processes)]
+    return [source_queue + '-internal']
+
+
+def _internal_queue_pattern(source_queue: str):
+    """ Matches all internal queues of the source queue, of any number of worker processes. """
+    return re.compile(re.escape(source_queue) + r'-internal(\.[0-9]+)?')
+
 
 class PipelineFactory(object):
 
@@ -58,6 +124,10 @@ def create(parameters: object, logger: object,
 
 class Pipeline(object):
     has_internal_queues = False
+    # True if the pipeline implements receive_batch and acknowledge_batch
+    has_batch_support = False
+    # True if the pipeline sends and receives Message objects instead of serialized messages
+    has_message_support = False
 
     def __init__(self, parameters, logger):
         self.parameters = parameters
@@ -65,6 +135,11 @@ def __init__(self, parameters, logger):
         self.internal_queue = None
         self.source_queue = None
         self.logger = logger
+        # compression of large sent messages, disabled by default
+        self.compression = None
+        self.compression_threshold = 65536
+        # destination queue: [original size, sent size], in bytes
+        self.compression_stats = defaultdict(lambda: [0, 0])  # type: Dict[str, List[int]]
 
     def connect(self):
         raise NotImplementedError
@@ -104,19 +179,140 @@ def set_queues(self, queues, queues_type):
                     'queues', got=queues,
                     expected=["None", "list of strings", "dict (of strings or lists that should have the _default key)"])
             self.destination_queues = q
+            self.load_compression_configuration()
         else:
             raise exceptions.InvalidArgument('queues_type', got=queues_type, expected=['source', 'destination'])
 
+    def load_compression_configuration(self):
+        self.compression = getattr(self.parameters, "destination_pipeline_compression", None)
+        self.compression_threshold = int(getattr(self.parameters,
+                                                 "destination_pipeline_compression_threshold",
+                                                 65536))
+        if not self.compression:
+            return
+        if self.compression not in COMPRESSIONS:
+            raise exceptions.InvalidArgument('destination_pipeline_compression', got=self.compression,
+                                             expected=list(COMPRESSIONS))
+        if COMPRESSIONS[self.compression][3] is None:
+            raise ValueError("To use the compression 'zstd' you must install the 'zstandard' library.")
+
     def nonempty_queues(self) -> set:
         raise NotImplementedError
 
+    def find_internal_queues(self, source_queue: str) -> List[str]:
+        """
+        Returns the existing internal queues of the source queue, sorted, including
+        the ones of former worker processes, see internal_queue_names.
+        Pipelines without internal queues return an empty list.
+        """
+        return []
+
+    def requeue_internal_queues(self, keep: Iterable[str] = ()) -> Dict[str, int]:
+        """
+        Moves the messages of the internal queues of the source queue which are not
+        in `keep` back to the source queue, where they are received first again.
+        Used for internal queues of worker processes which do not exist anymore.
+
+        Returns:
+            The number of moved messages per internal queue
+        """
+        return {}
+
     def send(self, message, path="_default", path_permissive=False):
         raise NotImplementedError
 
+    def flush(self):
+        """
+        Sends all buffered messages, if the pipeline buffers messages at all.
+        """
+        pass
+
+    def _compress(self, message: bytes, queues: List[str]) -> bytes:
+        """
+        Compresses the encoded message if it is larger than the threshold and
+        counts the original and sent sizes per destination queue.
+
+        The compressed message is prefixed with the marker of the compression.
+        If the compression does not reduce the size, the message is sent unchanged.
+        """
+        if not self.compression:
+            return message
+        size = len(message)
+        if size >= self.compression_threshold:
+            marker, compress, _, _ = COMPRESSIONS[self.compression]
+            compressed = marker + compress(message)
+            if len(compressed) < size:
+                message = compressed
+        for queue in queues:
+            queue_stats = self.compression_stats[queue]
+            queue_stats[0] += size
+            queue_stats[1] += len(message)
+        return message
+
+    @staticmethod
+    def _decode(message: bytes) -> Union[str, bytes]:
+        """
+        Decodes a received message.
+
+        Compressed messages, messages with a binary encoding and invalid ones are
+        returned unchanged, the bot decompresses them, see decompress. Errors
+        in the pipeline would leave the message in the internal queue forever.
+        """
+        if message[:1] in COMPRESSION_MARKERS or libmessage.is_binary(message):
+            return message
+        try:
+            return utils.decode(message)
+        except ValueError:
+            return message
+
+    def receive_batch(self, count: int, timeout: int = 0) -> List[str]:
+        """
+        Receives up to `count` messages at once.
+
+        Blocks until at least one message is available or `timeout` seconds
+        passed, 0 blocks indefinitely. Returns the list of messages, oldest first,
+        which is empty if the timeout passed.
+        As long as the batch has not been acknowledged, the same messages are returned again.
+        """
+        raise NotImplementedError
+
+    def acknowledge_batch(self):
+        """
+        Acknowledges all messages of the last batch received with receive_batch.
+        """
+        raise NotImplementedError
+
 
 class Redis(Pipeline):
     has_internal_queues = True
+    has_batch_support = True
     pipe = None
+    # Moves up to ARGV[1] messages from the source to the internal queue in one atomic step
+    MOVE_BATCH_SCRIPT = """
+local messages = {}
+for i = 1, tonumber(ARGV[1]) do
+    local message = redis.call('RPOPLPUSH', KEYS[1], KEYS[2])
+    if not message then
+        break
+    end
+    messages[i] = message
+end
+return messages
+"""
+    # Moves all messages from the internal queue KEYS[1] back to the source queue KEYS[2],
+    # the oldest message is received first again
+    REQUEUE_SCRIPT = """
+local count = 0
+while true do
+    local message = redis.call('LPOP', KEYS[1])
+    if not message then
+        break
+    end
+    redis.call('RPUSH', KEYS[2], message)
+    count = count + 1
+end
+return count
+"""
 
     def load_configurations(self, queues_type):
         self.host = getattr(self.parameters,
@@ -136,6 +332,16 @@ def load_configurations(self, queues_type):
                                       None)
         self.load_balance = getattr(self.parameters, "load_balance", False)
         self.load_balance_iterator = 0
+        # buffering of sent messages, disabled by default
+        self.buffer_size = int(getattr(self.parameters,
+                                       "{}_pipeline_buffer_size".format(queues_type),
+                                       0))
+        self.buffer_time = getattr(self.parameters,
+                                   "{}_pipeline_buffer_time".format(queues_type),
+                                   1)
+        self.send_buffer = defaultdict(list)  # type: Dict[str, List[bytes]]
+        self.send_buffer_count = 0
+        self.send_buffer_start = None
 
     def connect(self):
         if self.host.startswith("/"):
@@ -152,6 +358,8 @@ def connect(self):
             }
 
         self.pipe = redis.Redis(db=self.db, password=self.password, **kwargs)
+        self.move_batch = self.pipe.register_script(self.MOVE_BATCH_SCRIPT)
+        self.requeue = self.pipe.register_script(self.REQUEUE_SCRIPT)
 
     def disconnect(self):
         pass
@@ -164,8 +372,6 @@ def send(self, message, path="_default", path_permissive=False):
         if path not in self.destination_queues and path_permissive:
             return
 
-        message = utils.encode(message)
-
         try:
             queues = self.destination_queues[path]
         except KeyError as exc:
@@ -176,17 +382,56 @@ def send(self, message, path="_default", path_permissive=False):
             if self.load_balance_iterator == len(self.destination_queues[path]):
                 self.load_balance_iterator = 0
 
-        for destination_queue in queues:
-            try:
-                self.pipe.lpush(destination_queue, message)
-            except Exception as exc:
-                if 'Cannot assign requested address' in exc.args[0] or \
-                        "OOM command not allowed when used memory > 'maxmemory'." in exc.args[0]:
-                    raise MemoryError(exc.args[0])
-                elif 'Redis is configured to save RDB snapshots, but is currently not able to persist on disk' in exc.args[0]:
-                    raise IOError(28, 'No space left on device or in memory. Redis can\'t save its snapshots. '
-                                      'Look at redis\'s logs.')
-                raise exceptions.PipelineError(exc)
+        message = self._compress(utils.encode(message), queues)
+
+        if self.buffer_size > 1:
+            for destination_queue in queues:
+                self.send_buffer[destination_queue].append(message)
+            self.send_buffer_count += 1
+            if self.send_buffer_start is None:
+                self.send_buffer_start = time.time()
+            if (self.send_buffer_count >= self.buffer_size or
+                    time.time() - self.send_buffer_start >= self.buffer_time):
+                self.flush()
+        else:
+            self._push({destination_queue: [message] for destination_queue in queues})
+
+    def flush(self):
+        """
+        Sends all buffered messages in one round trip.
+        """
+        if not self.send_buffer_count:
+            return
+        send_buffer = self.send_buffer
+        self.send_buffer = defaultdict(list)
+        self.send_buffer_count = 0
+        self.send_buffer_start = None
+        self._push(send_buffer)
+
+    def _push(self, messages: Dict[str, List[bytes]]):
+        """
+        Pushes the messages to the given queues, using one LPUSH per queue.
+
+        Parameters:
+            messages: Mapping of queue names to lists of messages, oldest first
+        """
+        try:
+            if len(messages) == 1:
+                for destination_queue, queue_messages in messages.items():
+                    self.pipe.lpush(destination_queue, *queue_messages)
+            else:
+                pipe = self.pipe.pipeline(transaction=False)
+                for destination_queue, queue_messages in messages.items():
+                    pipe.lpush(destination_queue, *queue_messages)
+                pipe.execute()
+        except Exception as exc:
+            if 'Cannot assign requested address' in exc.args[0] or \
+                    "OOM command not allowed when used memory > 'maxmemory'." in exc.args[0]:
+                raise MemoryError(exc.args[0])
+            elif 'Redis is configured to save RDB snapshots, but is currently not able to persist on disk' in exc.args[0]:
+                raise IOError(28, 'No space left on device or in memory. Redis can\'t save its snapshots. '
+                                  'Look at redis\'s logs.')
+            raise exceptions.PipelineError(exc)
 
     def receive(self):
         if self.source_queue is None:
@@ -202,7 +447,7 @@ def receive(self):
             if not retval:
                 retval = self.pipe.brpoplpush(self.source_queue,
                                               self.internal_queue, 0)
-            return utils.decode(retval)
+            return self._decode(retval)
         except Exception as exc:
             raise exceptions.PipelineError(exc)
 
@@ -212,6 +457,46 @@ def acknowledge(self):
         except Exception as e:
             raise exceptions.PipelineError(e)
 
+    def receive_batch(self, count: int, timeout: int = 0) -> List[str]:
+        if self.source_queue is None:
+            raise exceptions.ConfigurationError('pipeline', 'No source queue given.')
+        try:
+            while True:
+                try:
+                    # not yet acknowledged messages, the oldest is the last one
+                    retval = self.pipe.lrange(self.internal_queue, 0, -1)
+                except redis.exceptions.BusyLoadingError:  # Just wait at redis' startup #1334
+                    time.sleep(1)
+                else:
+                    break
+            if not retval:
+                retval = self.move_batch(keys=[self.source_queue, self.internal_queue],
+                                         args=[count])
+                if not retval:
+                    message = self.pipe.brpoplpush(self.source_queue,
+                                                   self.internal_queue, timeout)
+                    if message is None:
+                        return []
+                    retval = [message]
+                    if count > 1:
+                        retval.extend(self.move_batch(keys=[self.source_queue, self.internal_queue],
+                                                      args=[count - 1]))
+            else:
+                retval.reverse()
+            return [self._decode(message) for message in retval]
+        except Exception as exc:
+            raise exceptions.PipelineError(exc)
+
+    def acknowledge_batch(self):
+        """
+        The internal queue only holds the messages of the current batch,
+        so it can be removed as a whole.
+        """
+        try:
+            return self.pipe.delete(self.internal_queue)
+        except Exception as e:
+            raise exceptions.PipelineError(e)
+
     def count_queued_messages(self, *queues):
         queue_dict = {}
         for queue in queues:
@@ -236,11 +521,50 @@ def nonempty_queues(self) -> set:
             self.connect()
         return {queue.decode() for queue in self.pipe.keys()}
 
+    def find_internal_queues(self, source_queue: str) -> List[str]:
+        pattern = _internal_queue_pattern(source_queue)
+        # the queue name must not be interpreted as glob pattern
+        match = re.sub(r'([*?\[\]\\])', r'\\\1', source_queue) + '-internal*'
+        try:
+            queues = {utils.decode(queue) for queue in self.pipe.scan_iter(match=match)}
+        except Exception as exc:
+            raise exceptions.PipelineError(exc)
+        return sorted(queue for queue in queues if pattern.fullmatch(queue))
+
+    def requeue_internal_queues(self, keep: Iterable[str] = ()) -> Dict[str, int]:
+        moved = {}
+        for queue in self.find_internal_queues(self.source_queue):
+            if queue in keep:
+                continue
+            try:
+                count = self.requeue(keys=[queue, self.source_queue])
+            except Exception as exc:
+                raise exceptions.PipelineError(exc)
+            if count:
+                moved[queue] = count
+        return moved
+
 # Algorithm
 # ---------
 # [Receive]     B RPOP LPUSH   source_queue ->  internal_queue
 # [Send]        LPUSH          message      ->  destination_queue
 # [Acknowledge] RPOP           message      <-  internal_queue
+#
+# With a send buffer, the messages are collected per destination queue and pushed
+# with one (multi-value) LPUSH per queue in a single round trip, at the latest
+# right before the source message is acknowledged.
+#
+# Batches
+# -------
+# [Receive]     LRANGE         internal_queue (re-delivery of an unacknowledged batch)
+#               Lua script     N * RPOPLPUSH  source_queue ->  internal_queue
+#               B RPOP LPUSH   source_queue ->  internal_queue, only if the script moved nothing
+# [Acknowledge] DEL            internal_queue
+#
+# Internal queues of former worker processes
+# ------------------------------------------
+# [Find]        SCAN           [source_queue]-internal*
+# [Requeue]     Lua script     LPOP internal_queue, RPUSH source_queue, until empty
 
 
 class Pythonlist(Pipeline):
@@ -252,6 +576,7 @@ class Pythonlist(Pipeline):
     Data is saved as it comes (no conversion) and it is not blocking.
     """
 
+    has_batch_support = True
     state = {}  # type: Dict[str, list]
 
     def connect(self):
@@ -276,11 +601,12 @@ def send(self, message, path="_default", path_permissive=False):
         if path not in self.destination_queues and path_permissive:
             return
 
+        message = self._compress(utils.encode(message), self.destination_queues[path])
         for destination_queue in self.destination_queues[path]:
             if destination_queue in self.state:
-                self.state[destination_queue].append(utils.encode(message))
+                self.state[destination_queue].append(message)
             else:
-                self.state[destination_queue] = [utils.encode(message)]
+                self.state[destination_queue] = [message]
 
     def receive(self):
         """
@@ -289,7 +615,8 @@ def receive(self):
         Does not block unlike the other pipelines.
         """
         if len(self.state.get(self.internal_queue, [])) > 0:
-            return utils.decode(self.state[self.internal_queue].pop(0))
+            # the message stays in the internal queue until it is acknowledged
+            return self._decode(self.state[self.internal_queue][0])
 
         first_msg = self.state[self.source_queue].pop(0)
 
@@ -298,12 +625,51 @@ def receive(self):
         else:
             self.state[self.internal_queue] = [first_msg]
 
-        return utils.decode(first_msg)
+        return self._decode(first_msg)
 
     def acknowledge(self):
         """Removes a message from the internal queue and returns it"""
         return self.state.get(self.internal_queue, [None]).pop(0)
 
+    def receive_batch(self, count: int, timeout: int = 0) -> List[str]:
+        """
+        Receives up to count messages, the not yet acknowledged ones first.
+
+        Does not block unlike the other pipelines, like receive it raises
+        an IndexError if the source queue is empty.
+        """
+        if self.state.get(self.internal_queue):
+            return [self._decode(message) for message in self.state[self.internal_queue]]
+
+        if not self.state[self.source_queue]:
+            raise IndexError('pop from empty list')
+        batch = self.state[self.source_queue][:count]
+        del self.state[self.source_queue][:count]
+        self.state[self.internal_queue] = batch[:]
+
+        return [self._decode(message) for message in batch]
+
+    def acknowledge_batch(self):
+        """Removes all messages of the current batch from the internal queue"""
+        self.state[self.internal_queue] = []
+
+    def find_internal_queues(self, source_queue: str) -> List[str]:
+        """ Like with Redis, only non-empty queues exist. """
+        pattern = _internal_queue_pattern(source_queue)
+        return sorted(queue for queue, messages in self.state.items()
+                      if messages and pattern.fullmatch(queue))
+
+    def requeue_internal_queues(self, keep: Iterable[str] = ()) -> Dict[str, int]:
+        moved = {}
+        requeued = []
+        for queue in self.find_internal_queues(self.source_queue):
+            if queue not in keep:
+                moved[queue] = len(self.state[queue])
+                requeued.extend(self.state[queue])
+                self.state[queue] = []
+        self.state[self.source_queue] = requeued + self.state[self.source_queue]
+        return moved
+
     def count_queued_messages(self, *queues):
         """Returns the amount of queued messages
            over all given queue names.
@@ -420,7 +786,6 @@ def send(self, message: str, path="_default", path_permissive=False) -> None:
         if path not in self.destination_queues and path_permissive:
             return
 
-        message = utils.encode(message)
         try:
             queues = self.destination_queues[path]
         except KeyError as exc:
@@ -431,6 +796,7 @@ def send(self, message: str, path="_default", path_permissive=False) -> None:
             if self.load_balance_iterator == len(self.destination_queues[path]):
                 self.load_balance_iterator = 0
 
+        message = self._compress(utils.encode(message), queues)
         for destination_queue in queues:
             self._send(destination_queue, message)
 
@@ -441,7 +807,7 @@ def receive(self) -> str:
             method, header, body = next(self.channel.consume(self.source_queue))
             if method:
                 self.delivery_tag = method.delivery_tag
-                return utils.decode(body)
+                return self._decode(body)
         except Exception as exc:
             raise exceptions.PipelineError(exc)
 
@@ -494,3 +860,88 @@ def clear_queue(self, queue: str) -> bool:
     def nonempty_queues(self) -> set:
         result = self._get_queues()
         return {name for name, count in result.items() if count}
+
+
+class Chain(Pipeline):
+    """
+    In-memory pipeline between two bots of a fused chain running in one process.
+
+    Messages sent to the source queue of the next bot of the chain are kept as
+    Message objects and passed to this bot without serialization. They are
+    processed as soon as the pipeline is flushed, i.e. before the sending bot
+    acknowledges its own message. Messages for all other queues are serialized
+    and sent to the external pipeline.
+    """
+
+    has_message_support = True
+
+    def __init__(self, parameters, logger, queue: str, process: Callable[[], None],
+                 pipeline: Optional[Pipeline] = None):
+        """
+        queue: The source queue of the next bot
+        process: The next bot's process method
+        pipeline: The pipeline for all other destination queues, if any
+        """
+        super().__init__(parameters, logger)
+        self.queue = queue
+        self.process = process
+        self.pipeline = pipeline
+        self.messages = deque()
+
+    def connect(self):
+        pass
+
+    def disconnect(self):
+        self.messages.clear()
+        if self.pipeline:
+            self.pipeline.disconnect()
+            self.pipeline = None
+
+    def send(self, message, path="_default", path_permissive=False):
+        if path not in self.destination_queues and path_permissive:
+            return
+
+        try:
+            queues = self.destination_queues[path]
+        except KeyError as exc:
+            raise exceptions.PipelineError(exc)
+
+        if self.queue in queues:
+            self.messages.append(self.copy_message(message))
+        if self.pipeline and path in self.pipeline.destination_queues:
+            raw_message = libmessage.MessageFactory.serialize(
+                message, validated=getattr(self.parameters, 'trust_validated_messages', False),
+                encoding=getattr(self.parameters, 'pipeline_encoding', 'json'))
+            self.pipeline.send(raw_message, path=path)
+
+    def flush(self):
+        """
+        Processes all messages for the next bot of the chain and flushes the external pipeline.
+
+        If the next bot fails, the remaining messages are discarded, as the
+        sending bot processes its message again or dumps it.
+        """
+        try:
+            while self.messages:
+                self.process()
+        except Exception:
+            self.messages.clear()
+            raise
+        if self.pipeline:
+            self.pipeline.flush()
+
+    def receive(self) -> libmessage.Message:
+        return self.messages[0]
+
+    def acknowledge(self):
+        self.messages.popleft()
+
+    @staticmethod
+    def copy_message(original: libmessage.Message) -> libmessage.Message:
+        """
+        Copies the message without validating the already valid fields again.
+        """
+        copy = original.__class__.__new__(original.__class__)
+        copy.__dict__.update(original.__dict__)
+        dict.update(copy, original)
+        return copy
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Profiling of bots under real load.
+
+With the parameter `profiling`, a bot runs its normal loop under a profiler
+for `profiling_messages` messages or `profiling_seconds` seconds and writes
+the results next to its log file:
+
+* `cprofile`: deterministic profiling with cProfile, written as pstats file `<bot-id>.pstats`
+* `sampling`: samples the stack of the bot every few milliseconds of CPU time, which has
+  a lower overhead, written as collapsed stacks `<bot-id>.collapsed`, the input format of
+  flame graph tools
+
+Additionally, the shares of the pipeline I/O, the deserialization,
+`process` and the serialization in the profiled time are summarized.
+"""
+import cProfile
+import os
+import signal
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+__all__ = ['PROFILERS', 'Profiler', 'SamplingProfiler', 'summarize', 'format_summary']
+
+PROFILERS = ('cprofile', 'sampling')
+# file extensions of the results by profiler
+EXTENSIONS = {'cprofile': 'pstats',
+              'sampling': 'collapsed',
+              }
+
+
+class SamplingProfiler(object):
+    """
+    Records the stack of the main thread at a fixed interval of CPU time.
+
+    Uses the profiling timer (SIGPROF) and can therefore only be used in the main thread.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks = Counter()  # type: Counter
+        self.__previous_handler = None
+
+    def enable(self):
+        self.__previous_handler = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def disable(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self.__previous_handler or signal.SIG_DFL)
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('%s (%s:%d)' % (code.co_name, code.co_filename, code.co_firstlineno))
+            frame = frame.f_back
+        self.stacks[';'.join(reversed(stack))] += 1
+
+    def dump_stats(self, filename: str):
+        """ Writes the stacks in the collapsed format: frames separated by semicolons and the number of samples. """
+        with open(filename, 'w') as handle:
+            for stack, count in self.stacks.most_common():
+                handle.write('%s %d\n' % (stack, count))
+
+
+class Profiler(object):
+    """
+    Profiles a bot until the number of messages or the duration is reached.
+
+    Parameters:
+        profiler: One of PROFILERS
+        filename: Path of the results without extension
+        messages: Stop after this number of processed messages
+        seconds: Stop after this duration
+    """
+
+    def __init__(self, profiler: str, filename: str, messages: Optional[int] = None,
+                 seconds: Optional[float] = None):
+        if profiler not in PROFILERS:
+            raise ValueError('Invalid profiler %r, must be one of %s.' % (profiler, ', '.join(PROFILERS)))
+        self.filename = '%s.%s' % (filename, EXTENSIONS[profiler])
+        self.messages = messages
+        self.seconds = seconds
+        self.__profile = cProfile.Profile() if profiler == 'cprofile' else SamplingProfiler()
+        self.__start = None
+        self.__start_durations = None  # type: Optional[Dict[str, float]]
+
+    def start(self, durations: Dict[str, float]):
+        """ Parameters: durations: total durations of the operations of the bot so far. """
+        self.__start_durations = dict(durations)
+        self.__start = time.perf_counter()
+        self.__profile.enable()
+
+    def done(self, messages: int) -> bool:
+        """ If the number of processed messages or the duration has been reached. """
+        if self.messages and messages >= self.messages:
+            return True
+        return bool(self.seconds and time.perf_counter() - self.__start >= self.seconds)
+
+    def stop(self, durations: Dict[str, float], messages: int) -> dict:
+        """ Stops the profiler, writes the results and returns the summary. """
+        self.__profile.disable()
+        elapsed = time.perf_counter() - self.__start
+        os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+        self.__profile.dump_stats(self.filename)
+        summary = summarize({operation: duration - self.__start_durations.get(operation, 0)
+                             for operation, duration in durations.items()},
+                            elapsed, messages)
+        summary['filename'] = self.filename
+        return summary
+
+
+def summarize(durations: Dict[str, float], elapsed: float, messages: int) -> dict:
+    """
+    Splits the elapsed time into the parts of the bot's operations in seconds.
+
+    Parameters:
+        durations: Durations of the operations in intelmq.lib.stats.OPERATIONS during the profiling.
+            The duration of `process` includes the (un)serialization and sending.
+    """
+    pipeline = durations.get('receive', 0) + durations.get('send', 0)
+    unserialize = durations.get('unserialize', 0)
+    serialize = durations.get('serialize', 0)
+    process = durations.get('process', 0) - unserialize - serialize - durations.get('send', 0)
+    return {'messages': messages,
+            'elapsed': elapsed,
+            'pipeline': pipeline,
+            'unserialize': unserialize,
+            'process': max(process, 0),
+            'serialize': serialize,
+            'other': max(elapsed - pipeline - unserialize - max(process, 0) - serialize, 0),
+            }
+
+
+def format_summary(summary: dict) -> str:
+    parts = []
+    for key, name in (('pipeline', 'pipeline I/O'), ('unserialize', 'deserialization'),
+                      ('process', 'process()'), ('serialize', 'serialization'), ('other', 'other')):
+        share = summary[key] / summary['elapsed'] * 100 if summary['elapsed'] else 0
+        parts.append('%s %.3fs (%.1f%%)' % (name, summary[key], share))
+    return ('Profiled %d messages in %.3fs: %s. Results written to %r.'
+            '' % (summary['messages'], summary['elapsed'], ', '.join(parts), summary['filename']))
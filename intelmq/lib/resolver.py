@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent DNS resolution for lookup experts.
+
+The `Resolver` runs the queries in a pool of threads, so the answers of
+multiple names are awaited at once instead of one after another. Queries for
+a name which is already being resolved are not started again, the callers get
+the same future (`CoalescingExecutor`). Answers are kept in an in-process
+cache for their DNS TTL, negative answers (the name or the record does not
+exist) for a fixed time.
+"""
+import threading
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, Hashable, Iterable, Optional, Tuple
+
+import dns.resolver
+
+from intelmq.lib.cache import LRUCache
+
+__all__ = ['Answer', 'CoalescingExecutor', 'NEGATIVE_ANSWERS', 'Resolver']
+
+# the records as text and the expiration time as unix timestamp
+Answer = namedtuple('Answer', ['records', 'expiration'])
+# answers that the name or the record does not exist, cached like positive answers
+NEGATIVE_ANSWERS = (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer)
+# a cached negative answer, a new exception is created for every future, as
+# raising the same instance again would add to its traceback
+NegativeAnswer = namedtuple('NegativeAnswer', ['exception', 'args'])
+
+
+class CoalescingExecutor(object):
+    """
+    Runs queries concurrently in a pool of threads.
+
+    A query with the key of a query which is still in flight is not started again,
+    the future of the running query is returned instead.
+
+    Parameters:
+        workers: Maximum number of queries in flight
+    """
+
+    def __init__(self, workers: int):
+        self.__executor = ThreadPoolExecutor(max_workers=workers)
+        self.__in_flight = {}
+        # the done callback is run in the calling thread if the future is already done
+        self.__lock = threading.RLock()
+
+    def submit(self, key: Hashable, function: Callable, *args) -> Future:
+        with self.__lock:
+            future = self.__in_flight.get(key)
+            # the done callback may not have run yet
+            if future is None or future.done():
+                future = self.__executor.submit(function, *args)
+                self.__in_flight[key] = future
+                future.add_done_callback(partial(self.__done, key))
+            return future
+
+    def __done(self, key: Hashable, future: Future):
+        with self.__lock:
+            if self.__in_flight.get(key) is future:
+                del self.__in_flight[key]
+
+    def __contains__(self, key: Hashable) -> bool:
+        """ If a query with the key is in flight. """
+        with self.__lock:
+            future = self.__in_flight.get(key)
+            return future is not None and not future.done()
+
+    def __len__(self) -> int:
+        """ Number of queries in flight. """
+        with self.__lock:
+            return sum(not future.done() for future in self.__in_flight.values())
+
+    def shutdown(self, wait: bool = True):
+        self.__executor.shutdown(wait=wait)
+
+
+class Resolver(object):
+    """
+    Resolves DNS records concurrently, with an in-process cache of the answers.
+
+    The futures returned by `submit` resolve to an `Answer` or raise the exception
+    of dnspython. NXDOMAIN and NoAnswer are cached for `negative_ttl` seconds,
+    other errors like timeouts are not cached.
+
+    Parameters:
+        workers: Maximum number of queries in flight
+        cache_size: Maximum number of cached answers, 0 disables the cache
+        negative_ttl: Time in seconds to cache negative answers
+        counters: A `collections.Counter`, e.g. `Bot.stats_counters`, counting
+            `dns_queries`, `dns_cache_hits` and `dns_coalesced` queries
+    """
+
+    def __init__(self, workers: int = 16, cache_size: int = 10000, negative_ttl: int = 60,
+                 counters: Optional[Counter] = None):
+        self.executor = CoalescingExecutor(workers)
+        self.cache = LRUCache(cache_size) if cache_size else None
+        self.negative_ttl = negative_ttl
+        self.counters = Counter() if counters is None else counters
+        # the cache is written by the threads of the executor
+        self.__lock = threading.Lock()
+
+    def submit(self, name: str, rdtype: str = 'A') -> Future:
+        """ Resolves the records of the name, answered from the cache if possible. """
+        key = (name, rdtype)
+        if self.cache is not None:
+            with self.__lock:
+                cached = self.cache.get(key)
+            if cached is not None:
+                self.counters['dns_cache_hits'] += 1
+                future = Future()
+                if isinstance(cached, NegativeAnswer):
+                    future.set_exception(cached.exception(*cached.args))
+                else:
+                    future.set_result(cached)
+                return future
+        if key in self.executor:
+            self.counters['dns_coalesced'] += 1
+        else:
+            self.counters['dns_queries'] += 1
+        return self.executor.submit(key, self.__query, name, rdtype)
+
+    def resolve(self, name: str, rdtype: str = 'A') -> Answer:
+        return self.submit(name, rdtype).result()
+
+    def resolve_many(self, names: Iterable[str], rdtype: str = 'A') -> Dict[str, Tuple[Optional[Answer], Optional[Exception]]]:
+        """
+        Resolves the names concurrently.
+
+        Returns:
+            The names and a tuple of the answer and the exception, one of them is None
+        """
+        futures = {name: self.submit(name, rdtype) for name in dict.fromkeys(names)}
+        return {name: (None, future.exception()) if future.exception() else (future.result(), None)
+                for name, future in futures.items()}
+
+    def __query(self, name: str, rdtype: str) -> Answer:
+        try:
+            result = dns.resolver.query(name, rdtype)
+        except NEGATIVE_ANSWERS as exc:
+            self.__cache(name, rdtype, NegativeAnswer(type(exc), exc.args), self.negative_ttl)
+            raise
+        answer = Answer(tuple(str(record) for record in result), result.expiration)
+        self.__cache(name, rdtype, answer, answer.expiration - time.time())
+        return answer
+
+    def __cache(self, name: str, rdtype: str, value, ttl: float):
+        if self.cache is not None and ttl > 0:
+            with self.__lock:
+                self.cache.set((name, rdtype), value, ttl)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
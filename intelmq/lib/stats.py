@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Histograms with fixed buckets for the latency statistics of bots.
+
+Bots count the durations of their operations in histograms and write them
+to the statistics database, where `intelmqctl stats` reads them.
+"""
+import bisect
+import json
+from typing import Iterable, Optional
+
+__all__ = ['BUCKETS', 'TRACE_BUCKETS', 'OPERATIONS', 'Histogram']
+
+# upper bounds of the buckets in seconds, the last bucket counts all larger values
+BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+           0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# buckets for the latencies of traces, including the waiting times in the queues
+TRACE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 7200,
+                 21600, 86400)
+# measured operations of the bots:
+# process: duration of process() without the time blocked in receive
+# receive: time blocked while receiving messages from the source pipeline
+# unserialize, serialize: conversion of received and sent messages
+# send: sending of messages to the destination pipeline
+OPERATIONS = ('process', 'receive', 'unserialize', 'serialize', 'send')
+
+
+class Histogram(object):
+    """
+    Counts values in buckets with fixed upper bounds.
+
+    Percentiles are estimated as the upper bound of the bucket they fall in.
+    """
+    __slots__ = ('buckets', 'counts', 'sum')
+
+    def __init__(self, buckets: Iterable[float] = BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def add(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def merge(self, other: 'Histogram'):
+        """ Adds the counts of another histogram with the same buckets. """
+        if other.buckets != self.buckets:
+            raise ValueError('Histograms with different buckets can not be merged.')
+        self.counts = [own + their for own, their in zip(self.counts, other.counts)]
+        self.sum += other.sum
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def mean(self) -> Optional[float]:
+        count = self.count
+        if not count:
+            return None
+        return self.sum / count
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """
+        Returns the upper bound of the bucket containing the given percentile,
+        infinity if it is in the last bucket and None if the histogram is empty.
+        """
+        count = self.count
+        if not count:
+            return None
+        rank = count * percent / 100
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if bucket_count and seen >= rank:
+                break
+        if index < len(self.buckets):
+            return self.buckets[index]
+        return float('inf')
+
+    def summary(self) -> dict:
+        """ Count, mean and the 50th, 90th and 99th percentile. """
+        return {'count': self.count,
+                'mean': self.mean(),
+                'p50': self.percentile(50),
+                'p90': self.percentile(90),
+                'p99': self.percentile(99),
+                }
+
+    def serialize(self) -> str:
+        return json.dumps({'buckets': self.buckets, 'counts': self.counts,
+                           'sum': self.sum})
+
+    @classmethod
+    def unserialize(cls, raw: str) -> 'Histogram':
+        data = json.loads(raw)
+        histogram = cls(data['buckets'])
+        if len(data['counts']) != len(histogram.counts):
+            raise ValueError('Number of counts does not match the buckets.')
+        histogram.counts = data['counts']
+        histogram.sum = data['sum']
+        return histogram
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import unittest
+
+import intelmq.bin.intelmq_bench as bench
+import intelmq.lib.utils as utils
+from intelmq import DEFAULTS_CONF_FILE, RUNTIME_CONF_FILE
+from intelmq.lib import microbench
+
+
+class TestIntelMQBench(unittest.TestCase):
+
+    def test_find_bot(self):
+        bots = bench.load_bots()
+        self.assertEqual(bench.find_bot(bots, 'taxonomy'), 'Expert/Taxonomy')
+        self.assertEqual(bench.find_bot(bots, 'intelmq.bots.experts.taxonomy.expert'),
+                         'Expert/Taxonomy')
+        with self.assertRaises(ValueError):
+            bench.find_bot(bots, 'does-not-exist')
+
+    def test_run_bot(self):
+        bots = bench.load_bots()
+        events = microbench.generate_events(20)
+        result, output = bench.run_bot('Expert/Taxonomy', bots['Expert/Taxonomy'],
+                                       events, keep_output=True)
+        self.assertEqual(result['messages'], 20)
+        self.assertEqual(result['sent'], 20)
+        self.assertEqual(result['failures'], 0)
+        self.assertEqual(set(result['latency']), {'p50', 'p90', 'p99', 'max'})
+        self.assertEqual(len(output), 20)
+        self.assertIn('classification.taxonomy', json.loads(output[0]))
+
+    def test_run_bot_failures(self):
+        """ Failing messages are counted and skipped. """
+        definition = dict(bench.load_bots()['Expert/Taxonomy'])
+        events = microbench.generate_events(5)
+        events[2] = json.dumps({'__type': 'Event', 'source.ip': 'invalid'})
+        result, _ = bench.run_bot('Expert/Taxonomy', definition, events)
+        self.assertEqual(result['messages'], 5)
+        self.assertEqual(result['sent'], 4)
+        self.assertEqual(result['failures'], 1)
+
+    def test_injected_configuration(self):
+        """ The configuration and the logger are only replaced in the context. """
+        load_configuration, log = utils.load_configuration, utils.log
+        config = bench.benchmark_configuration('test-bot', 'Expert', 'intelmq.bots.experts.taxonomy.expert',
+                                               {'testing': False})
+        logger = logging.getLogger('test-bot')
+        with bench.injected_configuration(config, logger):
+            self.assertEqual(utils.load_configuration(RUNTIME_CONF_FILE)['test-bot']['parameters'],
+                             {'testing': False})
+            self.assertIn('logging_level', utils.load_configuration(DEFAULTS_CONF_FILE))
+            self.assertIs(utils.log('test-bot', log_level='DEBUG'), logger)
+            self.assertEqual(logger.level, logging.DEBUG)
+        self.assertIs(utils.load_configuration, load_configuration)
+        self.assertIs(utils.log, log)
+
+    def test_compare(self):
+        results = {'bots': {'Expert/A': {'events_per_second': 800},
+                            'Expert/B': {'events_per_second': 1000},
+                            'Expert/C': {'error': 'Timeout'}},
+                   'chains': {'a,b': {'events_per_second': 950}}}
+        baseline = {'bots': {'Expert/A': {'events_per_second': 1000},
+                             'Expert/B': {'events_per_second': 1000},
+                             'Expert/C': {'events_per_second': 1000}},
+                    'chains': {'a,b': {'events_per_second': 1000}}}
+        self.assertEqual(bench.compare(results, baseline, 10), ['Expert/A'])
+        self.assertEqual(results['bots']['Expert/A']['baseline_change'], -20)
+        self.assertEqual(results['chains']['a,b']['baseline_change'], -5)
+        self.assertNotIn('baseline_change', results['bots']['Expert/C'])
+
+    def test_compare_micro(self):
+        results = {'micro': {'message.hash': {'operations_per_second': 50000}}}
+        baseline = {'micro': {'message.hash': {'operations_per_second': 100000}}}
+        self.assertEqual(bench.compare(results, baseline, 10), ['message.hash'])
+
+
+if __name__ == '__main__':  # pragma: no cover
+    unittest.main()
@@ -1,2 +1,206 @@
 # -*- coding: utf-8 -*-
-import intelmq.bin.intelmqctl
+"""
+Tests the IntelMQController with a pipeline and runtime configuration of
+two bots, one of them running in two processes.
+"""
+import logging
+import os
+import unittest
+import unittest.mock as mock
+
+import redis
+
+import intelmq.bin.intelmqctl as intelmqctl
+import intelmq.lib.test as test
+from intelmq import DEFAULTS_CONF_FILE, PIPELINE_CONF_FILE, RUNTIME_CONF_FILE
+from intelmq.lib import stats
+from intelmq.lib.pipeline import PipelineFactory
+
+PIPELINE = {'test-bot': {'source-queue': 'test-bot-queue',
+                         'destination-queues': ['test-processes-bot-queue']},
+            'test-processes-bot': {'source-queue': 'test-processes-bot-queue'},
+            }
+RUNTIME = {'test-bot': {'group': 'Expert', 'module': 'intelmq.bots.experts.taxonomy.expert',
+                        'parameters': {}},
+           'test-processes-bot': {'group': 'Output', 'module': 'intelmq.bots.outputs.file.output',
+                                  'parameters': {'instances_processes': 2}},
+           }
+REDIS_PARAMETERS = {'source_pipeline_db': 4,
+                    'source_pipeline_password': os.environ.get('INTELMQ_TEST_REDIS_PASSWORD'),
+                    'statistics_database': 4,
+                    'statistics_password': os.environ.get('INTELMQ_TEST_REDIS_PASSWORD'),
+                    }
+
+
+def mocked_config(conf_file):
+    if conf_file == PIPELINE_CONF_FILE:
+        return PIPELINE
+    elif conf_file == RUNTIME_CONF_FILE:
+        return RUNTIME
+    config = test.mocked_config()(conf_file)
+    if conf_file == DEFAULTS_CONF_FILE:
+        config.update(REDIS_PARAMETERS)
+    return config
+
+
+def create_controller() -> intelmqctl.IntelMQController:
+    logger = logging.getLogger('intelmqctl')
+    logger.addHandler(logging.NullHandler())
+    with mock.patch('intelmq.lib.utils.load_configuration', new=mocked_config), \
+            mock.patch('intelmq.lib.utils.log', new=test.mocked_logger(logger)):
+        return intelmqctl.IntelMQController(interactive=False, quiet=True)
+
+
+class TestIntelMQController(unittest.TestCase):
+
+    def setUp(self):
+        self.intelmqctl = create_controller()
+
+    def test_get_internal_queues(self):
+        """ Without pipeline, the internal queues of worker processes are unknown. """
+        self.assertEqual(self.intelmqctl.get_internal_queues('test-processes-bot-queue'),
+                         ['test-processes-bot-queue-internal'])
+
+    def test_get_queues(self):
+        self.assertEqual(self.intelmqctl.get_queues(with_internal_queues=True)[2],
+                         {'test-bot-queue-internal', 'test-processes-bot-queue-internal'})
+
+
+@test.skip_redis()
+class TestIntelMQControllerRedis(unittest.TestCase):
+
+    def setUp(self):
+        self.intelmqctl = create_controller()
+        self.redis = redis.Redis(db=REDIS_PARAMETERS['source_pipeline_db'],
+                                 password=REDIS_PARAMETERS['source_pipeline_password'])
+        self.queues = ['test-bot-queue', 'test-bot-queue-internal', 'test-bot-queue-internal.0',
+                       'test-processes-bot-queue', 'test-processes-bot-queue-internal',
+                       'test-processes-bot-queue-internal.0', 'test-processes-bot-queue-internal.1',
+                       'test-processes-bot-queue-internal.2']
+        self.redis.delete(*self.queues)
+        self.addCleanup(self.redis.delete, *self.queues)
+
+    def test_get_internal_queues(self):
+        """ The existing internal queues are found, also the ones of former worker processes. """
+        self.redis.lpush('test-processes-bot-queue-internal.0', 'message')
+        self.redis.lpush('test-processes-bot-queue-internal.2', 'message')
+        pipeline = PipelineFactory.create(self.intelmqctl.parameters, logger=self.intelmqctl.logger)
+        pipeline.set_queues(None, 'source')
+        pipeline.connect()
+        self.assertEqual(self.intelmqctl.get_internal_queues('test-processes-bot-queue', pipeline),
+                         ['test-processes-bot-queue-internal',
+                          'test-processes-bot-queue-internal.0',
+                          'test-processes-bot-queue-internal.2'])
+
+    def test_list_queues(self):
+        """ The internal queues of the workers, also of former ones, are counted as internal queue of the bot. """
+        self.redis.lpush('test-processes-bot-queue', 'message')
+        self.redis.lpush('test-processes-bot-queue-internal.0', 'message')
+        self.redis.lpush('test-processes-bot-queue-internal.1', 'message', 'message')
+        self.redis.lpush('test-processes-bot-queue-internal.2', 'message')
+        retval, queues = self.intelmqctl.list_queues()
+        self.assertEqual(retval, 0)
+        self.assertEqual(queues['test-processes-bot'],
+                         {'source_queue': ('test-processes-bot-queue', 1),
+                          'internal_queue': 4})
+        self.assertEqual(queues['test-bot'],
+                         {'source_queue': ('test-bot-queue', 0),
+                          'internal_queue': 0,
+                          'destination_queues': [('test-processes-bot-queue', 1)]})
+
+    def test_clear_queue(self):
+        self.redis.lpush('test-processes-bot-queue-internal.1', 'message')
+        self.assertEqual(self.intelmqctl.clear_queue('test-processes-bot-queue-internal.1'),
+                         (0, 'success'))
+        self.assertEqual(self.redis.llen('test-processes-bot-queue-internal.1'), 0)
+        self.assertEqual(self.intelmqctl.clear_queue('test-processes-bot-queue-internal.2'),
+                         (2, 'not-found'))
+
+    def test_clear_former_worker_queue(self):
+        """ Internal queues of former worker processes can be cleared. """
+        self.redis.lpush('test-bot-queue-internal.0', 'message')
+        self.assertEqual(self.intelmqctl.clear_queue('test-bot-queue-internal.0'),
+                         (0, 'success'))
+        self.assertEqual(self.redis.llen('test-bot-queue-internal.0'), 0)
+
+
+@test.skip_redis()
+class TestIntelMQControllerStats(unittest.TestCase):
+    """ Statistics of a bot running in two instances, intelmqctl stats. """
+
+    def setUp(self):
+        self.intelmqctl = create_controller()
+        self.redis = redis.Redis(db=REDIS_PARAMETERS['statistics_database'],
+                                 password=REDIS_PARAMETERS['statistics_password'])
+        self.clear()
+        self.addCleanup(self.clear)
+        self.histograms = [stats.Histogram(), stats.Histogram()]
+        self.histograms[0].add(0.00002)
+        self.histograms[0].add(0.00002)
+        self.histograms[1].add(0.002)
+        self.redis.mset({'test-bot.0.stats.success': 10, 'test-bot.1.stats.success': 5,
+                         'test-bot.0.stats.failure': 1, 'test-bot.1.stats.failure': 2,
+                         'test-bot.0.stats.throughput': 2.5, 'test-bot.1.stats.throughput': 1.5,
+                         'test-bot.0.total._default': 10, 'test-bot.1.total._default': 4,
+                         'test-bot.1.total._on_error': 1,
+                         'test-bot.0.counter.cache_hits': 3, 'test-bot.1.counter.cache_hits': 4,
+                         'test-bot.0.compression.test.queue.original': 1000,
+                         'test-bot.0.compression.test.queue.sent': 200,
+                         'test-bot.1.compression.test.queue.original': 1000,
+                         'test-bot.1.compression.test.queue.sent': 300,
+                         'test-bot.0.latency.process': self.histograms[0].serialize(),
+                         'test-bot.1.latency.process': self.histograms[1].serialize(),
+                         'test-bot.1.trace.end_to_end': self.histograms[1].serialize(),
+                         # other bots
+                         'test-bot-2.stats.success': 100,
+                         'test-processes-bot.stats.success': 100,
+                         })
+
+    def clear(self):
+        for pattern in ('test-bot*', 'test-processes-bot*'):
+            for key in self.redis.scan_iter(match=pattern):
+                self.redis.delete(key)
+
+    def test_stats(self):
+        """ The statistics of the instances are summed up. """
+        retval, result = self.intelmqctl.read_bot_stats('test-bot')
+        self.assertEqual(retval, 0)
+        self.assertEqual(result['success'], 15)
+        self.assertEqual(result['failure'], 3)
+        self.assertAlmostEqual(result['throughput'], 4.0)
+        self.assertEqual(result['paths'], {'_default': 14, '_on_error': 1})
+        self.assertEqual(result['counters'], {'cache_hits': 7})
+        self.assertEqual(result['compression'],
+                         {'test.queue': {'original': 2000, 'sent': 500, 'ratio': 0.25}})
+
+    def test_histograms(self):
+        """ The histograms of the instances are merged. """
+        self.histograms[0].merge(self.histograms[1])
+        retval, result = self.intelmqctl.read_bot_stats('test-bot')
+        self.assertEqual(result['latency'], {'process': self.histograms[0].summary()})
+        self.assertEqual(result['latency']['process']['count'], 3)
+        self.assertEqual(result['trace'], {'end_to_end': self.histograms[1].summary()})
+
+    def test_single_instance(self):
+        retval, result = self.intelmqctl.read_bot_stats('test-processes-bot')
+        self.assertEqual(retval, 0)
+        self.assertEqual(result['success'], 100)
+        self.assertEqual(result['latency'], {})
+
+    def test_expired_keys(self):
+        """ Keys expiring between the scan and reading them are skipped. """
+        mget = redis.Redis.mget
+
+        def expiring_mget(client, keys, *args):
+            client.delete('test-bot.1.stats.failure', 'test-bot.1.latency.process')
+            return mget(client, keys, *args)
+
+        with mock.patch.object(redis.Redis, 'mget', new=expiring_mget):
+            retval, result = self.intelmqctl.read_bot_stats('test-bot')
+        self.assertEqual(retval, 0)
+        self.assertEqual(result['failure'], 1)
+        self.assertEqual(result['latency'], {'process': self.histograms[0].summary()})
+
+
+if __name__ == '__main__':  # pragma: no cover
+    unittest.main()
@@ -1,7 +1,39 @@
 # -*- coding: utf-8 -*-
+import argparse
+import io
+import json
+import logging
+import os
+import tempfile
 import unittest
+import unittest.mock as mock
+from contextlib import redirect_stderr, redirect_stdout
 
 import intelmq.bin.intelmqdump
+import intelmq.lib.pipeline as pipeline
+from intelmq.lib.dump import DumpFile
+
+
+class Parameters(object):
+    pass
+
+
+def entry(number, bot_id='test-bot', error='ValueError'):
+    return {'timestamp': '2019-09-0%dT12:00:00' % number, 'bot_id': bot_id,
+            'source_queue': bot_id + '-queue',
+            'message': json.dumps({'__type': 'Event', 'feed.name': str(number)}),
+            'traceback': ['Traceback (most recent call last):\n', '%s: %d\n' % (error, number)]}
+
+
+def pythonlist_pipeline(queues):
+    params = Parameters()
+    params.broker = 'Pythonlist'
+    params.raise_on_connect = False
+    pipe = pipeline.PipelineFactory.create(params, logger=logging.getLogger('intelmqdump'),
+                                           direction='destination', queues={})
+    for queue in queues:
+        pipe.state[queue] = []
+    return pipe
 
 
 class TestCompleter(unittest.TestCase):
@@ -31,5 +63,111 @@ def test_queues(self):
         self.assertEqual(comp.complete('a some-e', 0), 'a some-expert-queue')
 
 
+class TestDumpInfo(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'test-bot.dump')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_info_meta(self):
+        with DumpFile(self.filename) as dump:
+            for number in range(2):
+                dump.append({'timestamp': '2019-09-0%dT12:00:00' % number, 'bot_id': 'test-bot',
+                             'source_queue': 'test-bot-queue', 'message': '{}',
+                             'traceback': 'Traceback (most recent call last):\nValueError: %d' % number})
+        self.assertEqual(intelmq.bin.intelmqdump.dump_info(self.filename), '2 dumps')
+        with DumpFile(self.filename) as dump:
+            self.assertEqual(intelmq.bin.intelmqdump.load_meta(dump),
+                             [('2019-09-00T12:00:00', 'ValueError: 0'),
+                              ('2019-09-01T12:00:00', 'ValueError: 1')])
+
+    def test_info_legacy(self):
+        with open(self.filename, 'w') as handle:
+            json.dump({'2019-09-01T12:00:00': {'bot_id': 'test-bot', 'source_queue': 'test-bot-queue',
+                                               'message': '{}', 'traceback': 'ValueError'}},
+                      handle, indent=4)
+        self.assertEqual(intelmq.bin.intelmqdump.dump_info(self.filename), '1 dumps')
+
+    def test_info_invalid(self):
+        with open(self.filename, 'w') as handle:
+            handle.write('{\n')
+        self.assertIn('unable to load JSON', intelmq.bin.intelmqdump.dump_info(self.filename))
+
+
+class TestRecovery(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'test-bot.dump')
+        with DumpFile(self.filename) as dump:
+            for number in range(1, 6):
+                dump.append(entry(number, error='ConnectionError' if number % 2 else 'ValueError'))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_matches(self):
+        matches = intelmq.bin.intelmqdump.matches
+        self.assertTrue(matches(entry(1)))
+        self.assertTrue(matches(entry(1), bot='^test-', traceback_pattern='ValueError: 1'))
+        self.assertFalse(matches(entry(1), bot='^other-'))
+        self.assertFalse(matches(entry(1), traceback_pattern='ConnectionError'))
+        self.assertTrue(matches(entry(2), since='2019-09-02T12:00:00', until='2019-09-03T00:00:00'))
+        self.assertFalse(matches(entry(2), since='2019-09-02T12:00:01'))
+        self.assertFalse(matches(entry(2), until='2019-09-02T11:59:59'))
+
+    def test_parse_time(self):
+        parse_time = intelmq.bin.intelmqdump.parse_time
+        self.assertEqual(parse_time('2019-09-02 12:00'), '2019-09-02T12:00:00')
+        self.assertEqual(parse_time('2019-09-02T14:00+02:00'), '2019-09-02T12:00:00')
+
+    def test_recover(self):
+        """ The messages are sent in batches to the source queues or the given one. """
+        pipe = pythonlist_pipeline(['test-bot-queue', 'other-queue'])
+        recovered = []
+        progress = []
+        with DumpFile(self.filename) as dump:
+            intelmq.bin.intelmqdump.recover(
+                intelmq.bin.intelmqdump.select_entries(dump, traceback_pattern='ConnectionError'),
+                pipe, recovered, batch_size=2, progress=progress.append)
+            self.assertEqual(recovered, [0, 2, 4])
+            self.assertEqual(progress, [2, 3])
+            self.assertEqual([json.loads(msg.decode())['feed.name'] for msg in pipe.state['test-bot-queue']],
+                             ['1', '3', '5'])
+            intelmq.bin.intelmqdump.recover(intelmq.bin.intelmqdump.select_entries(dump, positions=[1]),
+                                            pipe, recovered, queue_name='other-queue')
+            self.assertEqual(len(pipe.state['other-queue']), 1)
+
+    def test_recover_raw(self):
+        """ Raw messages the bot could not unserialize are recovered unchanged. """
+        pipe = pythonlist_pipeline(['test-bot-queue'])
+        recovered = []
+        entries = [(0, dict(entry(1), message='{"invalid')),
+                   (1, dict(entry(2), message='AoGhYf8=', message_encoding='base64'))]
+        intelmq.bin.intelmqdump.recover(entries, pipe, recovered, runtime={'test-bot': {'group': 'Parser'}},
+                                        pipeline_pipes={'test-bot-queue': 'test-bot'})
+        self.assertEqual(recovered, [0, 1])
+        self.assertEqual(pipe.state['test-bot-queue'], [b'{"invalid', b'\x02\x81\xa1a\xff'])
+
+    def test_bulk_recover(self):
+        """ Recovered dumps are deleted from the dump file, the file is removed once empty. """
+        pipe = pythonlist_pipeline(['test-bot-queue'])
+        args = argparse.Namespace(bot='test', traceback='ConnectionError', since='2019-09-02', until=None,
+                                  queue=None, batch_size=500)
+        with mock.patch('intelmq.bin.intelmqdump.create_pipeline', return_value=(pipe, {})), \
+                redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()):
+            self.assertEqual(intelmq.bin.intelmqdump.bulk_recover([self.filename], args, None, {}), 0)
+            with DumpFile(self.filename) as dump:
+                self.assertEqual([value['timestamp'] for value in dump],
+                                 ['2019-09-01T12:00:00', '2019-09-02T12:00:00', '2019-09-04T12:00:00'])
+            args.since = args.traceback = None
+            self.assertEqual(intelmq.bin.intelmqdump.bulk_recover([self.filename], args, None, {}), 0)
+        self.assertEqual(len(pipe.state['test-bot-queue']), 5)
+        self.assertFalse(os.path.exists(self.filename))
+
+
 if __name__ == '__main__':  # pragma: no cover
     unittest.main()
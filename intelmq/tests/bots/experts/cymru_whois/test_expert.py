@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
+import json
 import os
 import unittest
+import unittest.mock as mock
 
 import intelmq.lib.test as test
 from intelmq.bots.experts.cymru_whois.expert import CymruExpertBot
+from intelmq.lib.harmonization import IPAddress
 
 EXAMPLE_INPUT = {"__type": "Event",
                  "source.ip": "93.184.216.34",  # example.com
@@ -126,5 +129,91 @@ def test_missing_asn(self):
         self.assertMessageEqual(0, NO_ASN_OUTPUT)
 
 
+PREFIX_RESULT = {'asn': '15133', 'registry': 'other'}
+ASN_RESULT = {'as_name': 'EDGECAST'}
+
+
+@test.skip_redis()
+class TestCymruExpertBot_Cache(test.BotTestCase, unittest.TestCase):
+    """
+    Cache lookups and batches with mocked queries.
+    """
+
+    @classmethod
+    def set_bot(cls):
+        cls.bot_reference = CymruExpertBot
+        cls.use_cache = True
+
+    def setUp(self):
+        super().setUp()
+        self.cache.flushdb()
+        self.addCleanup(self.cache.flushdb)
+
+    def test_batched_lookup(self):
+        """ Both addresses are looked up in one round trip and the results are cached. """
+        with mock.patch('intelmq.bots.experts.cymru_whois.expert.Cymru.query_ip',
+                        return_value=PREFIX_RESULT) as query_ip, \
+                mock.patch('intelmq.bots.experts.cymru_whois.expert.Cymru.query_asn',
+                           return_value=ASN_RESULT) as query_asn:
+            self.input_message = {"__type": "Event",
+                                  "source.ip": "93.184.216.34",
+                                  "destination.ip": "93.184.216.35"}
+            self.run_bot()
+            self.assertMessageEqual(0, {"__type": "Event",
+                                        "source.ip": "93.184.216.34",
+                                        "source.asn": 15133,
+                                        "source.as_name": "EDGECAST",
+                                        "destination.ip": "93.184.216.35",
+                                        "destination.asn": 15133,
+                                        "destination.as_name": "EDGECAST"})
+            self.assertEqual(query_ip.call_count, 1)
+            self.assertEqual(query_asn.call_count, 1)
+            self.assertEqual(self.bot.stats_counters['cache_misses'], 2)
+            # prefix, AS name and writing the results
+            self.assertEqual(self.bot.stats_counters['cache_round_trips'], 3)
+            self.input_message = {"__type": "Event", "source.ip": "93.184.216.36"}
+            self.run_bot()
+            self.assertEqual(query_ip.call_count, 1)
+            self.assertEqual(query_asn.call_count, 1)
+            self.assertEqual(self.bot.stats_counters['cache_hits'], 2)
+
+    def test_batch(self):
+        """ The AS name is cached separately and queried once for all prefixes. """
+        with mock.patch('intelmq.bots.experts.cymru_whois.expert.Cymru.query_ip',
+                        side_effect=[PREFIX_RESULT, None, PREFIX_RESULT]) as query_ip, \
+                mock.patch('intelmq.bots.experts.cymru_whois.expert.Cymru.query_asn',
+                           return_value=ASN_RESULT) as query_asn:
+            self.input_message = [{"__type": "Event", "source.ip": "93.184.216.34"},
+                                  {"__type": "Event", "source.ip": "10.0.0.1"},
+                                  {"__type": "Event", "source.ip": "93.184.217.34",
+                                   "destination.ip": "93.184.216.34"}]
+            self.prepare_bot(parameters={'batch_size': 3})
+            self.run_bot(prepare=False)
+            self.assertEqual(query_ip.call_count, 3)
+            self.assertEqual(query_asn.call_count, 1)
+            self.assertMessageEqual(1, {"__type": "Event", "source.ip": "10.0.0.1"})
+            self.assertMessageEqual(2, {"__type": "Event",
+                                        "source.ip": "93.184.217.34",
+                                        "source.asn": 15133,
+                                        "source.as_name": "EDGECAST",
+                                        "destination.ip": "93.184.216.34",
+                                        "destination.asn": 15133,
+                                        "destination.as_name": "EDGECAST"})
+            self.assertEqual(self.bot.stats_counters['dns_queries'], 4)
+
+    def test_legacy_cache(self):
+        """ Results cached by previous versions include the AS name. """
+        self.cache.set(bin(IPAddress.to_int("93.184.216.34"))[2:26],
+                       json.dumps(dict(PREFIX_RESULT, **ASN_RESULT)))
+        with mock.patch('intelmq.bots.experts.cymru_whois.expert.Cymru.query_asn') as query_asn:
+            self.input_message = {"__type": "Event", "source.ip": "93.184.216.34"}
+            self.run_bot()
+            query_asn.assert_not_called()
+        self.assertMessageEqual(0, {"__type": "Event",
+                                    "source.ip": "93.184.216.34",
+                                    "source.asn": 15133,
+                                    "source.as_name": "EDGECAST"})
+
+
 if __name__ == '__main__':  # pragma: no cover
     unittest.main()
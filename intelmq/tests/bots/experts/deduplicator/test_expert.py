@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import tempfile
 import unittest
 
 import intelmq.lib.message as message
@@ -33,7 +34,7 @@ def set_bot(cls):
         cls.use_cache = True
 
     def test_suppress(self):
-        msg = message.MessageFactory.from_dict(INPUT1, harmonization=self.harmonization)
+        msg = message.MessageFactory.from_dict(INPUT1.copy(), harmonization=self.harmonization)
         msg_hash = msg.hash()
         self.cache.set(msg_hash, 'hash')
         self.cache.expire(msg_hash, 3600)
@@ -85,6 +86,65 @@ def test_bypass(self):
         self.run_bot()
         self.assertMessageEqual(0, msg)
 
+    def test_local_cache(self):
+        """ Repeated hashes are found in the local cache without querying redis. """
+        self.cache.flushdb()
+        self.addCleanup(self.cache.flushdb)
+        self.input_message = [INPUT1, INPUT2, INPUT1, INPUT1]
+        self.prepare_bot(parameters={"local_cache_size": 10})
+        self.run_bot(prepare=False, iterations=4)
+        self.assertOutputQueueLen(2)
+        self.assertEqual(dict(self.bot.stats_counters),
+                         {'misses': 2, 'local_cache_hits': 2})
+
+    def test_redis_hits(self):
+        self.cache.flushdb()
+        self.addCleanup(self.cache.flushdb)
+        self.input_message = [INPUT1, INPUT1]
+        self.run_bot(iterations=2)
+        self.assertOutputQueueLen(1)
+        self.assertEqual(dict(self.bot.stats_counters), {'misses': 1, 'redis_hits': 1})
+
+
+class TestDeduplicatorExpertBot_File(test.BotTestCase, unittest.TestCase):
+    """
+    A TestCase for DeduplicatorExpertBot with the file backend.
+    """
+
+    @classmethod
+    def set_bot(cls):
+        cls.bot_reference = DeduplicatorExpertBot
+        cls.default_input_message = INPUT1
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.sysconfig = {"redis_cache_ttl": "86400",
+                         "filter_type": "blacklist",
+                         "filter_keys": "raw ,time.observation ",
+                         "backend": "file",
+                         "file_path": cls.directory.name,
+                         }
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+        super().tearDownClass()
+
+    def tearDown(self):
+        # the store stays locked by the bot instance of the test until the process ends
+        if getattr(self, 'bot', None) and getattr(self.bot, 'cache', None):
+            self.bot.cache.close()
+        super().tearDown()
+
+    def test_deduplicate(self):
+        self.input_message = [INPUT1, INPUT2, INPUT1]
+        self.run_bot(iterations=3)
+        self.assertOutputQueueLen(2)
+        self.assertMessageEqual(1, INPUT2)
+        self.assertEqual(dict(self.bot.stats_counters), {'misses': 2, 'file_hits': 1})
+        # the hashes are kept after a restart
+        self.bot.cache.close()
+        self.input_message = INPUT2
+        self.run_bot()
+        self.assertOutputQueueLen(0)
 
 
 if __name__ == '__main__':  # pragma: no cover
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+import unittest
+import unittest.mock as mock
+
+from intelmq.bots.experts.deduplicator.lib import MIN_CAPACITY, HashStore, Slice, fingerprint
+
+
+class TestHashStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = self.directory.name
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def slice_files(self):
+        return sorted(filename for filename in os.listdir(self.path) if filename.endswith('.slice'))
+
+    def test_add(self):
+        store = HashStore(self.path, 3600)
+        self.assertEqual(store.add('a'), (True, 3600))
+        added, remaining = store.add('a')
+        self.assertFalse(added)
+        self.assertGreater(remaining, 3590)
+        self.assertEqual(store.add('b')[0], True)
+        self.assertEqual(len(store), 2)
+        store.close()
+
+    def test_persistence(self):
+        store = HashStore(self.path, 3600)
+        for number in range(1000):
+            store.add(str(number))
+        store.close()
+        store = HashStore(self.path, 3600)
+        self.assertEqual(len(store), 1000)
+        self.assertFalse(store.add('999')[0])
+        self.assertTrue(store.add('1000')[0])
+        store.close()
+
+    def test_expiry(self):
+        """ Keys expire after the TTL, slices are deleted once all of their keys have expired. """
+        with mock.patch('time.time', return_value=80000):
+            store = HashStore(self.path, 800, slices=8)
+            store.add('a')
+            self.assertEqual(self.slice_files(), ['800.slice'])
+        with mock.patch('time.time', return_value=80500):
+            self.assertFalse(store.add('a')[0])
+            store.add('b')
+            self.assertEqual(self.slice_files(), ['800.slice', '805.slice'])
+        with mock.patch('time.time', return_value=80800):
+            self.assertTrue(store.add('a')[0])
+            self.assertEqual(self.slice_files(), ['805.slice', '808.slice'])
+            self.assertFalse(store.add('b')[0])
+        store.close()
+
+    def test_no_expiry(self):
+        store = HashStore(self.path, 0)
+        self.assertEqual(store.add('a'), (True, None))
+        self.assertEqual(store.add('a'), (False, None))
+        store.close()
+
+    def test_locked(self):
+        store = HashStore(self.path, 3600)
+        with self.assertRaises(ValueError):
+            HashStore(self.path, 3600)
+        store.close()
+
+
+class TestSlice(unittest.TestCase):
+
+    def test_grow(self):
+        with tempfile.TemporaryDirectory() as path:
+            filename = os.path.join(path, '1.slice')
+            current = Slice(filename)
+            for number in range(MIN_CAPACITY):
+                current.set(fingerprint(str(number)), 100)
+            self.assertEqual(current.capacity, MIN_CAPACITY * 2)
+            self.assertEqual(current.count, MIN_CAPACITY)
+            self.assertEqual(current.get(fingerprint('1'), 50), 100)
+            self.assertIsNone(current.get(fingerprint('1'), 100))
+            self.assertIsNone(current.get(fingerprint('-1'), 50))
+            current.close()
+            self.assertEqual(os.listdir(path), ['1.slice'])
+
+    def test_invalid(self):
+        with tempfile.NamedTemporaryFile() as handle:
+            handle.write(b'invalid' * 100)
+            handle.flush()
+            with self.assertRaises(ValueError):
+                Slice(handle.name)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    unittest.main()
@@ -3,7 +3,11 @@
 Testing GethostbynameExpertBot.
 """
 
+import time
 import unittest
+import unittest.mock as mock
+
+import dns.resolver
 
 import intelmq.lib.test as test
 from intelmq.bots.experts.gethostbyname.expert import GethostbynameExpertBot
@@ -47,5 +51,61 @@ def test_non_existing(self):
         self.run_bot()
         self.assertMessageEqual(0, NONEXISTING_INPUT)
 
+
+class FakeAnswer(list):
+
+    def __init__(self, records, ttl=3600):
+        super().__init__(records)
+        self.expiration = time.time() + ttl
+
+
+def fake_query(name, rdtype):
+    if name == 'example.invalid':
+        raise dns.resolver.NXDOMAIN
+    if name == 'timeout.example.com':
+        raise dns.resolver.Timeout
+    return FakeAnswer(['93.184.216.34'])
+
+
+class TestGethostbynameExpertBot_Mocked(test.BotTestCase, unittest.TestCase):
+    """
+    Batches and caching with mocked DNS queries.
+    """
+
+    @classmethod
+    def set_bot(cls):
+        cls.bot_reference = GethostbynameExpertBot
+
+    def test_batch(self):
+        """ Each name is resolved once per batch. """
+        self.input_message = [EXAMPLE_INPUT, NONEXISTING_INPUT, EXAMPLE_INPUT]
+        with mock.patch('dns.resolver.query', side_effect=fake_query) as query:
+            self.prepare_bot(parameters={'batch_size': 3})
+            self.run_bot(prepare=False)
+            self.assertEqual(query.call_count, 3)
+        self.assertMessageEqual(0, EXAMPLE_OUTPUT)
+        self.assertMessageEqual(1, NONEXISTING_INPUT)
+        self.assertMessageEqual(2, EXAMPLE_OUTPUT)
+        self.assertEqual(self.bot.stats_counters['dns_queries'], 3)
+
+    def test_cached(self):
+        """ Answers are cached in memory. """
+        self.input_message = [EXAMPLE_INPUT, EXAMPLE_INPUT]
+        with mock.patch('dns.resolver.query', side_effect=fake_query) as query:
+            self.run_bot(iterations=2)
+            self.assertEqual(query.call_count, 2)
+        self.assertMessageEqual(1, EXAMPLE_OUTPUT)
+        self.assertEqual(self.bot.stats_counters['dns_cache_hits'], 2)
+
+    def test_timeout(self):
+        """ Timeouts are temporary failures. """
+        self.input_message = {"__type": "Event", "source.fqdn": "timeout.example.com"}
+        self.allowed_error_count = 1
+        with mock.patch('dns.resolver.query', side_effect=fake_query):
+            self.run_bot()
+        self.assertLogMatches('Bot has found a problem.', levelname='ERROR')
+        self.assertOutputQueueLen(0)
+
+
 if __name__ == '__main__':  # pragma: no cover
     unittest.main()
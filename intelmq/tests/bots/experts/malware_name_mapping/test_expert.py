@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Testing the malware name mapping expert
+"""
+
+import unittest
+
+import pkg_resources
+
+import intelmq.lib.test as test
+from intelmq.bots.experts.malware_name_mapping.expert import (MalwareNameMapping, MalwareNameMappingExpertBot,
+                                                              literal_prefixes)
+
+MAPPING = pkg_resources.resource_filename('intelmq', 'tests/bots/experts/malware_name_mapping/mapping.csv')
+EXAMPLE_INPUT = {"__type": "Event",
+                 "malware.name": "zeusbot",
+                 "classification.identifier": "zeusbot",
+                 "time.observation": "2015-01-01T00:00:00+00:00",
+                 }
+EXAMPLE_OUTPUT = {"__type": "Event",
+                  "malware.name": "zeusbot",
+                  "classification.identifier": "zeus",
+                  "time.observation": "2015-01-01T00:00:00+00:00",
+                  }
+EXAMPLE_NO_MATCH = {"__type": "Event",
+                    "malware.name": "unknown",
+                    "time.observation": "2015-01-01T00:00:00+00:00",
+                    }
+
+
+class TestMalwareNameMappingExpertBot(test.BotTestCase, unittest.TestCase):
+    """
+    A TestCase for MalwareNameMappingExpertBot.
+    """
+
+    @classmethod
+    def set_bot(cls):
+        cls.bot_reference = MalwareNameMappingExpertBot
+        cls.sysconfig = {'mapping_file': MAPPING}
+
+    def test_mapping(self):
+        self.input_message = [EXAMPLE_INPUT, EXAMPLE_NO_MATCH, EXAMPLE_INPUT]
+        self.run_bot(iterations=3)
+        self.assertMessageEqual(0, EXAMPLE_OUTPUT)
+        self.assertMessageEqual(1, EXAMPLE_NO_MATCH)
+        self.assertMessageEqual(2, EXAMPLE_OUTPUT)
+        self.assertEqual(self.bot.stats_counters['cache_hits'], 1)
+
+    def test_no_overwrite(self):
+        self.input_message = EXAMPLE_INPUT
+        self.prepare_bot(parameters={'overwrite': False, 'cache_size': 0})
+        self.run_bot(prepare=False)
+        self.assertMessageEqual(0, EXAMPLE_INPUT)
+
+
+class TestMalwareNameMapping(unittest.TestCase):
+
+    def test_literal_prefixes(self):
+        self.assertEqual(literal_prefixes('^zeus(bot)?$'), ('zeus', ))
+        self.assertEqual(literal_prefixes('zeus'), ('zeus', ))
+        self.assertEqual(literal_prefixes('^a\\.b*'), ('a.', ))
+        self.assertEqual(literal_prefixes('^(zbot|zeus)$'), ('zbot', 'zeus'))
+        self.assertEqual(literal_prefixes('^(zbot|zeus-?p2p)$'), ())
+        self.assertEqual(literal_prefixes('^(?:a\\.b|c)$'), ('a.b', 'c'))
+        self.assertEqual(literal_prefixes('^(zbot|zeus)?x'), ())
+        self.assertEqual(literal_prefixes('zeus|zbot'), ())
+        self.assertEqual(literal_prefixes('.*mirai.*'), ())
+        self.assertEqual(literal_prefixes('\\dx'), ())
+
+    def test_lookup(self):
+        mapping = MalwareNameMapping.from_file(MAPPING)
+        self.assertEqual(len(mapping), 6)
+        self.assertEqual(mapping.lookup('ZeuS'), 'zeus')
+        self.assertEqual(mapping.lookup('zeusp2p'), 'zeus')
+        self.assertEqual(mapping.lookup('gozi-isfb'), 'gozi')
+        self.assertEqual(mapping.lookup('a.b'), 'ab')
+        self.assertEqual(mapping.lookup('axb'), None)
+        self.assertEqual(mapping.lookup('zeusmirai'), 'mirai')
+        self.assertEqual(mapping.lookup('unknown'), None)
+
+    def test_order(self):
+        """ The first matching expression wins, also if it is not indexed. """
+        mapping = MalwareNameMapping([('.*bot$', 'bot'), ('^zeus', 'zeus'), ('^zeusbot$', 'zeusbot')])
+        self.assertEqual(mapping.lookup('zeusbot'), 'bot')
+        self.assertEqual(mapping.lookup('zeus'), 'zeus')
+
+    def test_non_ascii(self):
+        """ Non-ASCII characters follow the case folding of the regular expressions. """
+        mapping = MalwareNameMapping([('^sality$', 'sality'), ('^kelihos', 'kelihos')])
+        self.assertEqual(mapping.lookup('ſality'), 'sality')
+        self.assertEqual(mapping.lookup('Kelihos'), 'kelihos')
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            MalwareNameMapping([('^zeus(', 'zeus')])
+
+
+if __name__ == '__main__':  # pragma: no cover
+    unittest.main()
@@ -77,6 +77,20 @@ def test_conversion(self):
         self.assertDictEqual(convert_config(old_config)[0],
                              new_config[0])
 
+    def test_reload_invalid(self):
+        """ Test if the previous rules are kept if the new configuration is invalid. """
+        self.input_message = INPUT[0]
+        self.prepare_bot()
+        program = self.bot.program
+        self.bot.parameters.configuration_path = resource_filename('intelmq',
+                                                                   'tests/bots/experts/modify/invalid.conf')
+        self.bot.init()
+        self.assertIs(self.bot.program, program)
+        self.allowed_error_count = 1
+        self.run_bot(prepare=False)
+        self.assertMessageEqual(0, OUTPUT[0])
+        self.assertLogMatches('Could not load the rules from .*, keeping the previous rules.', 'ERROR')
+
 
 
 if __name__ == '__main__':  # pragma: no cover
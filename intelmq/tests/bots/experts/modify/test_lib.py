@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the compiled rules of the modify expert.
+"""
+import logging
+import unittest
+
+from intelmq.bots.experts.modify.lib import Program, parse_literal
+
+LOGGER = logging.getLogger('test')
+
+
+class TestParseLiteral(unittest.TestCase):
+
+    def test_literals(self):
+        self.assertEqual(parse_literal('^zeus$'), ('equal', ('zeus', )))
+        self.assertEqual(parse_literal('^BlockList\\.de$'), ('equal', ('BlockList.de', )))
+        self.assertEqual(parse_literal('^zeus'), ('prefix', ('zeus', )))
+        self.assertEqual(parse_literal('zeus$'), ('suffix', ('zeus', )))
+        self.assertEqual(parse_literal('zeus'), ('contains', ('zeus', )))
+        self.assertEqual(parse_literal('^$'), ('equal', ('', )))
+
+    def test_alternatives(self):
+        self.assertEqual(parse_literal('^(zeus|zbot)$'), ('equal', ('zeus', 'zbot')))
+        self.assertEqual(parse_literal('^(?:80|443)$'), ('equal', ('80', '443')))
+
+    def test_regex(self):
+        self.assertIsNone(parse_literal('\\d+'))
+        self.assertIsNone(parse_literal('^zeus.*$'))
+        self.assertIsNone(parse_literal('^(zeus|zbot)x$'))
+        self.assertIsNone(parse_literal('^conficker(ab)?$'))
+        self.assertIsNone(parse_literal('(?i)zeus'))
+
+
+def rule(name, selection, action=None):
+    return {'rulename': name, 'if': selection, 'then': action or {}}
+
+
+class MockEvent(dict):
+
+    def add(self, key, value, overwrite=False):
+        self[key] = value
+
+
+class TestProgram(unittest.TestCase):
+
+    def test_matches(self):
+        """ Literal patterns behave like the regular expressions. """
+        program = Program([rule('a', {'malware.name': '^zeus$'}),
+                           rule('b', {'malware.name': 'eus$'}),
+                           rule('c', {'malware.name': '^Zeu'}),
+                           rule('d', {'source.port': '^(80|443)$'})],
+                          True, LOGGER)
+        self.assertIsNotNone(program.rules[0].matches({'malware.name': 'zeus'}))
+        self.assertIsNotNone(program.rules[0].matches({'malware.name': 'zeus\n'}))
+        self.assertIsNone(program.rules[0].matches({'malware.name': 'zeus2'}))
+        self.assertIsNotNone(program.rules[1].matches({'malware.name': 'zeus'}))
+        self.assertIsNone(program.rules[2].matches({'malware.name': 'zeus'}))
+        self.assertIsNotNone(program.rules[3].matches({'source.port': 443}))
+        self.assertIsNone(program.rules[3].matches({'source.port': 8080}))
+
+    def test_match_groups(self):
+        program = Program([rule('a', {'malware.name': '^zeus$'})], True, LOGGER)
+        matches = program.rules[0].matches({'malware.name': 'zeus'})
+        self.assertEqual(matches['malware.name'].group(0), 'zeus')
+
+    def test_ignore_case(self):
+        program = Program([rule('a', {'malware.name': '^zeus$'})], False, LOGGER)
+        self.assertIsNotNone(program.rules[0].matches({'malware.name': 'ZeuS'}))
+        self.assertEqual(program.candidates({'malware.name': 'ZeuS'}), [0])
+        # non-ASCII values are matched by the regular expression
+        self.assertEqual(program.candidates({'malware.name': 'ſeus'}), [0])
+        self.assertIsNone(program.rules[0].matches({'malware.name': 'ſeus'}))
+
+    def test_candidates(self):
+        program = Program([rule('a', {'malware.name': '^zeus$'}),
+                           rule('b', {'malware.name': 'zeus', 'feed.name': '^A$'}),
+                           rule('c', {'feed.name': '\\d'}),
+                           rule('d', {'malware.name': ''}),
+                           rule('e', {'malware.name': '^(zeus|zbot)$'})],
+                          True, LOGGER)
+        # rules on absent fields only are always candidates
+        self.assertEqual(program.candidates({'malware.name': 'zeus'}), [0, 3, 4])
+        self.assertEqual(program.candidates({'malware.name': 'zbot', 'feed.name': 'A'}), [1, 2, 3, 4])
+        self.assertEqual(program.candidates({'feed.name': 'B'}), [2, 3])
+        self.assertEqual(program.candidates({}), [3])
+
+    def test_process_order(self):
+        """ Later rules see the changes of earlier rules, also of indexed fields. """
+        program = Program([rule('a', {'malware.name': '^zbot$'}, {'malware.name': 'zeus'}),
+                           rule('b', {'malware.name': '^zeus$'}, {'classification.identifier': '{msg[malware.name]}'})],
+                          True, LOGGER)
+        event = MockEvent({'malware.name': 'zbot'})
+        program.process(event)
+        self.assertEqual(event, {'malware.name': 'zeus', 'classification.identifier': 'zeus'})
+
+
+if __name__ == '__main__':  # pragma: no cover
+    unittest.main()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Testing the network list expert
+"""
+
+import unittest
+
+import pkg_resources
+
+import intelmq.lib.test as test
+from intelmq.bots.experts.network_list.expert import NetworkListExpertBot
+
+NETWORKS = pkg_resources.resource_filename('intelmq', 'tests/bots/experts/network_list/networks.txt')
+EXAMPLE_INPUT = {"__type": "Event",
+                 "source.ip": "198.51.100.1",
+                 "destination.ip": "192.0.2.200",
+                 "time.observation": "2015-01-01T00:00:00+00:00",
+                 }
+EXAMPLE_OUTPUT = {"__type": "Event",
+                  "source.ip": "198.51.100.1",
+                  "destination.ip": "192.0.2.200",
+                  "extra.constituency": "documentation-upper",
+                  "time.observation": "2015-01-01T00:00:00+00:00",
+                  }
+EXAMPLE_IPV6 = {"__type": "Event",
+                "source.ip": "2001:db8::1",
+                "time.observation": "2015-01-01T00:00:00+00:00",
+                }
+EXAMPLE_NO_MATCH = {"__type": "Event",
+                    "source.ip": "198.51.100.1",
+                    "time.observation": "2015-01-01T00:00:00+00:00",
+                    }
+
+
+class TestNetworkListExpertBot(test.BotTestCase, unittest.TestCase):
+    """
+    A TestCase for NetworkListExpertBot.
+    """
+
+    @classmethod
+    def set_bot(cls):
+        cls.bot_reference = NetworkListExpertBot
+        cls.sysconfig = {'file': NETWORKS,
+                         'fields': 'source.ip,destination.ip',
+                         'tag_field': 'extra.constituency',
+                         }
+
+    def test_tag(self):
+        self.input_message = [EXAMPLE_INPUT, EXAMPLE_NO_MATCH]
+        self.run_bot(iterations=2)
+        self.assertMessageEqual(0, EXAMPLE_OUTPUT)
+        self.assertMessageEqual(1, EXAMPLE_NO_MATCH)
+
+    def test_default_value(self):
+        self.input_message = EXAMPLE_IPV6
+        self.run_bot()
+        output = EXAMPLE_IPV6.copy()
+        output['extra.constituency'] = True
+        self.assertMessageEqual(0, output)
+
+    def test_overwrite(self):
+        event = EXAMPLE_INPUT.copy()
+        event['extra.constituency'] = 'existing'
+        self.input_message = event
+        self.run_bot()
+        self.assertMessageEqual(0, event)
+        self.input_message = event
+        self.prepare_bot(parameters={'overwrite': True})
+        self.run_bot(prepare=False)
+        self.assertMessageEqual(0, EXAMPLE_OUTPUT)
+
+    def test_keep(self):
+        self.input_message = [EXAMPLE_INPUT, EXAMPLE_NO_MATCH]
+        self.prepare_bot(parameters={'action': 'keep'})
+        self.run_bot(iterations=2, prepare=False)
+        self.assertOutputQueueLen(1)
+        self.assertMessageEqual(0, EXAMPLE_OUTPUT)
+
+    def test_drop(self):
+        self.input_message = [EXAMPLE_INPUT, EXAMPLE_NO_MATCH]
+        self.prepare_bot(parameters={'action': 'drop'})
+        self.run_bot(iterations=2, prepare=False)
+        self.assertOutputQueueLen(1)
+        self.assertMessageEqual(0, EXAMPLE_NO_MATCH)
+
+    def test_paths(self):
+        self.input_message = [EXAMPLE_INPUT, EXAMPLE_NO_MATCH]
+        self.prepare_bot(destination_queues={'_default': 'default-queue',
+                                             'match': 'match-queue',
+                                             'no_match': 'no-match-queue'})
+        self.run_bot(iterations=2, prepare=False)
+        self.assertMessageEqual(0, EXAMPLE_OUTPUT, path='match')
+        self.assertMessageEqual(0, EXAMPLE_NO_MATCH, path='no_match')
+        self.assertOutputQueueLen(2)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    unittest.main()
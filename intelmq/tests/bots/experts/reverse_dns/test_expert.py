@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*-
-
+import time
 import unittest
+import unittest.mock as mock
+
+import dns.resolver
 
 import intelmq.lib.test as test
 from intelmq.bots.experts.reverse_dns.expert import ReverseDnsExpertBot
+from intelmq.lib.harmonization import IPAddress
 
 EXAMPLE_INPUT = {"__type": "Event",
                  "source.ip": "192.0.43.7",  # icann.org
@@ -80,5 +84,69 @@ def test_invalid_ptr2(self):
         self.assertMessageEqual(0, INVALID_PTR_OUT2)
 
 
+class FakeAnswer(list):
+
+    def __init__(self, records, ttl=3600):
+        super().__init__(records)
+        self.expiration = time.time() + ttl
+
+
+def fake_query(name, rdtype):
+    if name == '1.2.0.192.in-addr.arpa.':
+        raise dns.resolver.NXDOMAIN
+    return FakeAnswer(['example.com.'])
+
+
+@test.skip_redis()
+class TestReverseDnsExpertBot_Mocked(test.BotTestCase, unittest.TestCase):
+    """
+    Batches and caching with mocked DNS queries.
+    """
+
+    @classmethod
+    def set_bot(cls):
+        cls.bot_reference = ReverseDnsExpertBot
+        cls.use_cache = True
+
+    def setUp(self):
+        super().setUp()
+        self.cache.flushdb()
+        self.addCleanup(self.cache.flushdb)
+
+    def test_batch(self):
+        """ The addresses of all events are resolved at once and cached. """
+        self.input_message = [{"__type": "Event", "source.ip": "192.0.2.1"},
+                              {"__type": "Event", "source.ip": "198.51.100.1",
+                               "destination.ip": "203.0.113.1"},
+                              {"__type": "Event", "source.ip": "198.51.100.1"}]
+        with mock.patch('dns.resolver.query', side_effect=fake_query) as query:
+            self.prepare_bot(parameters={'batch_size': 3, 'cache_ttl_invalid_response': 1})
+            self.run_bot(prepare=False)
+            self.assertEqual(query.call_count, 3)
+        self.assertMessageEqual(0, {"__type": "Event", "source.ip": "192.0.2.1"})
+        self.assertMessageEqual(1, {"__type": "Event",
+                                    "source.ip": "198.51.100.1",
+                                    "source.reverse_dns": "example.com",
+                                    "destination.ip": "203.0.113.1",
+                                    "destination.reverse_dns": "example.com"})
+        self.assertMessageEqual(2, {"__type": "Event",
+                                    "source.ip": "198.51.100.1",
+                                    "source.reverse_dns": "example.com"})
+        # NXDOMAIN is cached with the default TTL, not cache_ttl_invalid_response
+        cache_key = bin(IPAddress.to_int("192.0.2.1"))[2:26]
+        self.assertEqual(self.cache.get(cache_key), b'__dns-exception')
+        self.assertGreater(self.cache.ttl(cache_key), 1)
+
+    def test_cached(self):
+        with mock.patch('dns.resolver.query', side_effect=fake_query) as query:
+            for _ in range(2):
+                self.input_message = {"__type": "Event", "source.ip": "198.51.100.1"}
+                self.run_bot()
+            self.assertEqual(query.call_count, 1)
+        self.assertMessageEqual(0, {"__type": "Event",
+                                    "source.ip": "198.51.100.1",
+                                    "source.reverse_dns": "example.com"})
+
+
 if __name__ == '__main__':  # pragma: no cover
     unittest.main()
@@ -975,6 +975,28 @@ def test_numeric_key(self):
         self.run_bot()
         self.assertMessageEqual(0, numeric_match_true)
 
+    def test_index(self):
+        """ Rules changing indexed keys are followed by the rules matching the changed event. """
+        self.sysconfig['file'] = os.path.join(os.path.dirname(__file__),
+                                              'test_sieve_files/test_index.sieve')
+
+        event = EXAMPLE_INPUT.copy()
+        expected = EXAMPLE_INPUT.copy()
+        expected['event_description.text'] = 'indexed'
+        self.input_message = event
+        self.run_bot()
+        self.assertMessageEqual(0, expected)
+
+        event = EXAMPLE_INPUT.copy()
+        event['source.ip'] = '192.0.2.1'
+        event['comment'] = 'loopback'
+        expected = event.copy()
+        expected['event_description.text'] = 'indexed'
+        del expected['comment']
+        self.input_message = event
+        self.run_bot()
+        self.assertMessageEqual(0, expected)
+
 
 if __name__ == '__main__':  # pragma: no cover
     unittest.main()
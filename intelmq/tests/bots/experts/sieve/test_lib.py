@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the rule indexes of the sieve expert.
+"""
+import unittest
+
+from intelmq.bots.experts.sieve.lib import AhoCorasick, RuleIndex
+
+
+class TestAhoCorasick(unittest.TestCase):
+
+    def test_search(self):
+        automaton = AhoCorasick()
+        for number, needle in enumerate(['he', 'she', 'his', 'hers', 'e']):
+            automaton.add(needle, number)
+        self.assertEqual(automaton.search('ushers'), {0, 1, 3, 4})
+        self.assertEqual(automaton.search('this'), {2})
+        self.assertEqual(automaton.search('xyz'), set())
+        self.assertEqual(automaton.search(''), set())
+
+    def test_same_value(self):
+        automaton = AhoCorasick()
+        automaton.add('/index.php', 'a')
+        automaton.add('id=', 'a')
+        automaton.add('example', 'b')
+        self.assertEqual(automaton.search('http://example.com/index.php?id=1'), {'a', 'b'})
+        automaton.add('com', 'c')
+        self.assertEqual(automaton.search('http://example.com/'), {'b', 'c'})
+
+    def test_empty(self):
+        with self.assertRaises(ValueError):
+            AhoCorasick().add('', 1)
+
+
+class TestRuleIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = RuleIndex()
+        self.index.add('equal', 'feed.name', ['A', 'B'], 0)
+        self.index.add_unindexed(1)
+        self.index.add('networks', 'source.ip', ['192.0.2.0/24', '192.0.0.0/16'], 2)
+        self.index.add('contains', 'source.url', ['/admin/', '.php'], 3)
+        self.index.add('numeric_equal', 'source.port', [80, 443], 4)
+        self.index.add('equal', 'feed.name', ['C'], 5)
+        self.index.add_modifying(['comment'], 6)
+        self.index.add_modifying(['extra.feed'], 7)
+        self.index.add_modifying(['source'], 8)
+
+    def test_candidates(self):
+        self.assertEqual(self.index.candidates({}), [1])
+        self.assertEqual(self.index.candidates({'feed.name': 'B', 'source.ip': '192.0.2.1'}), [0, 1, 2])
+        self.assertEqual(self.index.candidates({'feed.name': 'C', 'source.url': 'http://example.com/x.php'}),
+                         [1, 3, 5])
+        self.assertEqual(self.index.candidates({'source.port': '443'}), [1, 4])
+        self.assertEqual(self.index.candidates({'source.port': 443, 'feed.name': 'D'}), [1, 4])
+
+    def test_invalid_values(self):
+        """ Rules are evaluated for values which can not be looked up. """
+        self.assertEqual(self.index.candidates({'source.ip': 'invalid'}), [1, 2])
+        self.assertEqual(self.index.candidates({'source.url': 1}), [1, 3])
+        self.assertEqual(self.index.candidates({'source.port': 'http'}), [1])
+
+    def test_modifying(self):
+        self.assertEqual(self.index.modifying, {8: ['source']})
+
+
+if __name__ == '__main__':  # pragma: no cover
+    unittest.main()
@@ -3,12 +3,36 @@
 Tests the Bot class itself.
 """
 
+import logging
+import os
+import signal
 import sys
+import tempfile
 import unittest
+import unittest.mock as mock
 
 import intelmq.lib.test as test
+from intelmq.lib.bot import Bot
+from intelmq.lib.pipeline import Pythonlist
 from intelmq.tests.lib import test_parser_bot
 
+FORWARDED_SIGNALS = {signal.SIGHUP, signal.SIGTERM, signal.SIGINT}
+
+
+class ProcessWorkerBot(Bot):
+    """
+    Writes its id, internal queue and blocked signals to a file in
+    `workers_path` instead of processing messages.
+    """
+
+    def start(self, **kwargs):
+        self._Bot__connect_pipelines()
+        blocked = FORWARDED_SIGNALS & set(signal.pthread_sigmask(signal.SIG_BLOCK, []))
+        with open(os.path.join(self.parameters.workers_path, self._Bot__bot_id_full), 'w') as handle:
+            handle.write('%s %d' % (self._Bot__source_pipeline.internal_queue, len(blocked)))
+        if self._Bot__instance_id and self._Bot__instance_id == self.parameters.failing_worker:
+            sys.exit(1)
+
 
 class TestBot(test.BotTestCase, unittest.TestCase):
     """ Testing generic functionalities of Bot base class. """
@@ -64,5 +88,85 @@ def test_bot_group(self):
         self.assertEqual(self.bot.group, 'Parser')
 
 
+class TestProcessWorkers(unittest.TestCase):
+    """ Testing bots running in multiple processes, parameter instances_processes. """
+
+    def setUp(self):
+        self.state = Pythonlist.state
+        for queue in ('test-bot-input-internal.0', 'test-bot-input-internal.1', 'test-bot-input-internal.2'):
+            self.state[queue] = []
+            self.addCleanup(self.state.pop, queue)
+
+    def run_workers(self, failing_worker=None, processes=2):
+        """ Returns the exit code and the files written by the workers. """
+        for signum in FORWARDED_SIGNALS:
+            self.addCleanup(signal.signal, signum, signal.getsignal(signum))
+        logger = logging.getLogger('test-bot')
+        logger.addHandler(logging.NullHandler())
+        with tempfile.TemporaryDirectory() as workers_path:
+            config = test.mocked_config('test-bot', 'test-bot-input', {'_default': ['test-bot-output']},
+                                        sysconfig={'instances_processes': processes,
+                                                   'source_pipeline_broker': 'pythonlist',
+                                                   'destination_pipeline_broker': 'pythonlist',
+                                                   'raise_on_connect': False,
+                                                   'workers_path': workers_path,
+                                                   'failing_worker': failing_worker},
+                                        group='Expert', module=__name__)
+            with mock.patch('intelmq.lib.utils.load_configuration', new=config), \
+                    mock.patch('intelmq.lib.utils.log', new=test.mocked_logger(logger)):
+                if processes > 1:
+                    with self.assertRaises(SystemExit) as context:
+                        ProcessWorkerBot('test-bot')
+                    exitcode = context.exception.code
+                else:
+                    ProcessWorkerBot('test-bot').start()
+                    exitcode = 0
+            workers = {}
+            for worker_id in os.listdir(workers_path):
+                with open(os.path.join(workers_path, worker_id)) as handle:
+                    workers[worker_id] = handle.read()
+        return exitcode, workers
+
+    def test_workers(self):
+        """ Every worker has its own id and internal queue. """
+        exitcode, workers = self.run_workers()
+        self.assertEqual(exitcode, 0)
+        self.assertEqual(workers, {'test-bot.0': 'test-bot-input-internal.0 0',
+                                   'test-bot.1': 'test-bot-input-internal.1 0'})
+
+    def test_signals_unblocked(self):
+        """ The signals are only blocked while forking the workers. """
+        self.run_workers()
+        self.assertFalse(FORWARDED_SIGNALS & set(signal.pthread_sigmask(signal.SIG_BLOCK, [])))
+        self.assertEqual(signal.getsignal(signal.SIGTERM).__name__, 'forward_signal')
+
+    def test_failing_worker(self):
+        """ The bot fails if one of the workers fails. """
+        exitcode, workers = self.run_workers(failing_worker='1')
+        self.assertEqual(exitcode, 1)
+        self.assertEqual(set(workers), {'test-bot.0', 'test-bot.1'})
+
+    def test_reduced_processes(self):
+        """ Messages of internal queues of former workers are moved back to the source queue. """
+        self.state['test-bot-input-internal.1'] = [b'worker 1']
+        self.state['test-bot-input-internal.2'] = [b'worker 2 first', b'worker 2 second']
+        exitcode, workers = self.run_workers()
+        self.assertEqual(exitcode, 0)
+        # the workers run in their own processes, only the main process changed the queues here
+        self.assertEqual(self.state['test-bot-input'], [b'worker 2 first', b'worker 2 second'])
+        self.assertEqual(self.state['test-bot-input-internal.1'], [b'worker 1'])
+        self.assertEqual(self.state['test-bot-input-internal.2'], [])
+
+    def test_single_process(self):
+        """ A bot running in one process moves the messages of all former workers back. """
+        self.state['test-bot-input-internal.0'] = [b'worker 0']
+        self.state['test-bot-input-internal.1'] = [b'worker 1']
+        exitcode, workers = self.run_workers(processes=1)
+        self.assertEqual(workers, {'test-bot': 'test-bot-input-internal 0'})
+        self.assertEqual(self.state['test-bot-input'], [b'worker 0', b'worker 1'])
+        self.assertEqual(self.state['test-bot-input-internal.0'], [])
+        self.assertEqual(self.state['test-bot-input-internal.1'], [])
+
+
 if __name__ == '__main__':  # pragma: no cover
     unittest.main()
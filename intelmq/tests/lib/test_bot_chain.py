@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Tests fused chains of bots, pipeline configuration key 'chain'.
+
+The first bot of the chain is run like in production, with the Pythonlist
+pipeline, the following bots are initialized by it.
+"""
+import io
+import json
+import logging
+import os
+import signal
+import tempfile
+import unittest
+import unittest.mock as mock
+
+import intelmq.lib.test as test
+import intelmq.lib.utils as utils
+from intelmq import PIPELINE_CONF_FILE, RUNTIME_CONF_FILE
+from intelmq.lib.bot import Bot
+from intelmq.lib.dump import DumpFile
+from intelmq.lib.exceptions import ConfigurationError
+from intelmq.lib.pipeline import Chain
+
+EVENT = {'__type': 'Event', 'feed.name': 'Test', 'classification.type': 'phishing'}
+FAILING_EVENT = dict(EVENT, **{'feed.code': 'fail'})
+
+
+class HeadExpertBot(Bot):
+    """ Sends every event twice. """
+
+    def process(self):
+        event = self.receive_message()
+        self.send_message(event)
+        self.send_message(event)
+        self.acknowledge_message()
+
+
+class ChainedExpertBot(Bot):
+    """ Fails for events with the feed code 'fail'. """
+
+    stopped = False
+
+    def process(self):
+        event = self.receive_message()
+        if event.get('feed.code') == 'fail':
+            raise ValueError('Failing event.')
+        self.send_message(event)
+        self.acknowledge_message()
+
+    def shutdown(self):
+        self.stopped = True
+
+
+BOT = ChainedExpertBot
+
+
+class TestBotChain(unittest.TestCase):
+
+    def setUp(self):
+        self.pipeline = {'test-bot': {'source-queue': 'test-bot-input',
+                                      'destination-queues': ['test-chained-bot-input'],
+                                      'chain': ['test-chained-bot']},
+                         'test-chained-bot': {'source-queue': 'test-chained-bot-input',
+                                              'destination-queues': ['test-chained-bot-output']},
+                         }
+        self.modules = {'test-bot': __name__, 'test-chained-bot': __name__}
+        self.logging_path = tempfile.TemporaryDirectory()
+        self.addCleanup(self.logging_path.cleanup)
+        self.parameters = dict(test.BOT_CONFIG, source_pipeline_broker='pythonlist',
+                               destination_pipeline_broker='pythonlist',
+                               raise_on_connect=False)
+
+        self.log_stream = io.StringIO()
+        logger = logging.getLogger('test-bot-chain')
+        logger.setLevel('INFO')
+        handler = logging.StreamHandler(self.log_stream)
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+
+        for patcher in (mock.patch('intelmq.lib.utils.load_configuration', new=self.mocked_config),
+                        mock.patch('intelmq.lib.utils.log', new=test.mocked_logger(logger))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            self.addCleanup(signal.signal, signum, signal.getsignal(signum))
+
+    def mocked_config(self, conf_file):
+        if conf_file == PIPELINE_CONF_FILE:
+            return self.pipeline
+        elif conf_file == RUNTIME_CONF_FILE:
+            return {bot_id: {'group': 'Expert', 'module': module, 'parameters': self.parameters}
+                    for bot_id, module in self.modules.items()}
+        return test.mocked_config()(conf_file)
+
+    def connect(self, *events) -> HeadExpertBot:
+        """ Initializes the first bot of the chain and connects it, the events are its input. """
+        bot = HeadExpertBot('test-bot')
+        bot._Bot__connect_pipelines()
+        # connecting the Pythonlist pipeline clears the queues
+        bot._Bot__source_pipeline.state['test-bot-input'] = [utils.encode(json.dumps(event))
+                                                             for event in events]
+        return bot
+
+    def start(self, bot: HeadExpertBot):
+        bot.start(error_on_pipeline=False,
+                  source_pipeline=bot._Bot__source_pipeline,
+                  destination_pipeline=bot._Bot__destination_pipeline)
+
+    def test_chain(self):
+        """ The events are passed to the next bot and counted by it. """
+        self.modules['test-chained-bot'] = 'intelmq.bots.experts.taxonomy.expert'
+        bot = self.connect(EVENT)
+        chained, = bot._Bot__chain_bots
+        self.assertIsInstance(bot._Bot__destination_pipeline, Chain)
+        self.assertIs(chained._Bot__source_pipeline, bot._Bot__destination_pipeline)
+        source = bot._Bot__source_pipeline
+        self.start(bot)
+        output = [json.loads(utils.decode(message)) for message in source.state['test-chained-bot-output']]
+        self.assertEqual(output, [dict(EVENT, **{'classification.taxonomy': 'fraud'})] * 2)
+        self.assertEqual(source.state['test-bot-input'], [])
+        self.assertEqual(source.state['test-bot-input-internal'], [])
+        self.assertEqual(bot._Bot__message_counter['success'], 1)
+        self.assertEqual(chained._Bot__message_counter['success'], 2)
+        self.assertEqual(chained._Bot__message_counter['failure'], 0)
+
+    def test_not_configured(self):
+        self.pipeline['test-bot']['chain'] = ['test-missing-bot']
+        with self.assertRaisesRegex(ConfigurationError, "Bot 'test-missing-bot' of the chain is not configured."):
+            self.connect()
+
+    def test_not_sending(self):
+        self.pipeline['test-bot']['destination-queues'] = ['test-bot-output']
+        with self.assertRaisesRegex(ConfigurationError, "Bot 'test-bot' does not send to the next bot "
+                                                        "'test-chained-bot' of the chain."):
+            self.connect()
+
+    def test_invalid_chain_stops(self):
+        """ The bot stops instead of connecting again and again. """
+        self.pipeline['test-bot']['chain'] = ['test-missing-bot']
+        self.parameters['testing'] = False
+        bot = HeadExpertBot('test-bot')
+        with self.assertRaises(SystemExit):
+            bot.start()
+        self.assertIn("Bot 'test-missing-bot' of the chain is not configured.", self.log_stream.getvalue())
+        self.assertNotIn('Pipeline failed.', self.log_stream.getvalue())
+
+    def test_error_retry_dump(self):
+        """ Errors in the chain are handled by the first bot, it retries and dumps its message. """
+        self.parameters.update(error_max_retries=1, error_procedure='stop',
+                               error_dump_message=True, testing=False)
+        bot = self.connect(FAILING_EVENT)
+        # as parameter, it would replace the log handler of the test
+        bot.parameters.logging_path = self.logging_path.name
+        chained, = bot._Bot__chain_bots
+        source = bot._Bot__source_pipeline
+        with self.assertRaises(SystemExit):
+            self.start(bot)
+        self.assertEqual(self.log_stream.getvalue().count('Bot has found a problem.'), 2)
+        self.assertEqual(bot._Bot__message_counter['failure'], 2)
+        self.assertEqual(chained._Bot__message_counter['failure'], 2)
+        self.assertEqual(chained._Bot__message_counter['success'], 0)
+        with DumpFile(os.path.join(self.logging_path.name, 'test-bot.dump')) as dump_file:
+            dumped = list(dump_file)
+        self.assertEqual(len(dumped), 1)
+        self.assertEqual(json.loads(dumped[0]['message'])['feed.code'], 'fail')
+        self.assertIn('ValueError: Failing event.', ''.join(dumped[0]['traceback']))
+        self.assertEqual(source.state['test-bot-input-internal'], [])
+        self.assertEqual(source.state['test-chained-bot-output'], [])
+
+    def test_sighup(self):
+        """ The chain is shut down and connected again. """
+        bot = self.connect()
+        chained, = bot._Bot__chain_bots
+        os.kill(os.getpid(), signal.SIGHUP)
+        self.assertTrue(bot._Bot__sighup.is_set())
+        bot._Bot__handle_sighup()
+        self.assertTrue(chained.stopped)
+        self.assertIsNone(chained._Bot__source_pipeline)
+        new_chained, = bot._Bot__chain_bots
+        self.assertIsNot(new_chained, chained)
+        self.assertIs(new_chained._Bot__source_pipeline, bot._Bot__destination_pipeline)
+
+        source = bot._Bot__source_pipeline
+        source.state['test-bot-input'] = [utils.encode(json.dumps(EVENT))]
+        self.start(bot)
+        self.assertEqual(len(source.state['test-chained-bot-output']), 2)
+        self.assertEqual(new_chained._Bot__message_counter['success'], 2)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    unittest.main()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for intelmq.lib.cache
+"""
+import time
+import unittest
+import unittest.mock as mock
+from collections import Counter
+
+import intelmq.lib.test as test
+from intelmq.lib.cache import Cache, LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_eviction(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)  # 'b' is now the least recently used
+        cache.set('c', 3)
+        self.assertNotIn('b', cache)
+        self.assertIn('a', cache)
+        self.assertIn('c', cache)
+        self.assertEqual(len(cache), 2)
+
+    def test_ttl(self):
+        cache = LRUCache(10, ttl=60)
+        with mock.patch('time.monotonic', return_value=1000):
+            cache.set('a', 1)
+            cache.set('b', 2, ttl=120)
+            cache.set('c', None, ttl=0)
+        with mock.patch('time.monotonic', return_value=1090):
+            self.assertIsNone(cache.get('a'))
+            self.assertEqual(cache.get('b'), 2)
+            self.assertIn('c', cache)
+            self.assertEqual(len(cache), 2)
+
+    def test_delete(self):
+        cache = LRUCache(10)
+        cache.set('a', 1)
+        cache.delete('a')
+        cache.delete('b')
+        self.assertEqual(cache.get('a', 'default'), 'default')
+        cache.set('a', 1)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+
+@test.skip_redis()
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = Cache(test.BOT_CONFIG['redis_cache_host'], test.BOT_CONFIG['redis_cache_port'],
+                           test.BOT_CONFIG['redis_cache_db'], 3600, test.BOT_CONFIG['redis_cache_password'])
+        self.cache.flush()
+
+    def tearDown(self):
+        self.cache.flush()
+
+    def test_add(self):
+        self.assertEqual(self.cache.add('key', 'value', 60), (True, 60))
+        added, remaining = self.cache.add('key', 'other')
+        self.assertFalse(added)
+        self.assertGreater(remaining, 0)
+        self.assertLessEqual(remaining, 60)
+        self.assertEqual(self.cache.get('key'), 'value')
+        self.assertEqual(self.cache.add('permanent', 'value', 0), (True, None))
+
+    def test_set_ttl(self):
+        self.cache.set('key', 'value')
+        self.assertEqual(self.cache.get('key'), 'value')
+        self.assertGreater(self.cache.redis.ttl('key'), 3500)
+        self.cache.set('permanent', 'value', 0)
+        self.assertEqual(self.cache.redis.ttl('permanent'), -1)
+
+    def test_many(self):
+        self.cache.set_many({'a': 'value a', 'b': 'value b'}, ttls={'b': 60})
+        self.assertEqual(self.cache.counters['cache_round_trips'], 1)
+        self.assertEqual(self.cache.get_many(['a', 'missing', 'b']), ['value a', None, 'value b'])
+        self.assertEqual(self.cache.counters['cache_round_trips'], 2)
+        self.assertEqual(self.cache.counters['cache_hits'], 2)
+        self.assertEqual(self.cache.counters['cache_misses'], 1)
+        self.assertLessEqual(self.cache.redis.ttl('b'), 60)
+        self.assertGreater(self.cache.redis.ttl('a'), 60)
+        self.assertEqual(self.cache.exists_many(['a', 'missing']), [True, False])
+        self.assertTrue(self.cache.exists('b'))
+
+    def test_local_cache(self):
+        """ Values are read through the local cache, but not longer than they live in redis. """
+        counters = Counter()
+        cache = Cache(test.BOT_CONFIG['redis_cache_host'], test.BOT_CONFIG['redis_cache_port'],
+                      test.BOT_CONFIG['redis_cache_db'], 3600, test.BOT_CONFIG['redis_cache_password'],
+                      local_cache_size=10, counters=counters)
+        self.cache.set('remote', 'value')
+        self.cache.set('short', 'value', 60)
+        cache.set('own', 'value')
+        self.assertEqual(cache.get_many(['remote', 'short', 'own']), ['value'] * 3)
+        self.assertEqual(counters['cache_local_hits'], 1)
+        self.assertEqual(counters['cache_round_trips'], 2)
+        self.assertEqual(cache.get_many(['remote', 'own']), ['value'] * 2)
+        self.assertEqual(counters['cache_local_hits'], 3)
+        self.assertEqual(counters['cache_round_trips'], 2)
+        with mock.patch('time.monotonic', return_value=time.monotonic() + 120):
+            self.assertIsNone(cache.local_cache.get('short'))
+            self.assertEqual(cache.local_cache.get('remote'), 'value')
+
+
+if __name__ == '__main__':  # pragma: no cover
+    unittest.main()
@@ -54,13 +54,23 @@ def test_event(self):
 
     def test_missing_raw(self):
         """ Test if missing raw is detected and ignored. """
-        self.sysconfig['raw'] = False
+        self.sysconfig = dict(self.sysconfig, raw=False)
         self.allowed_warning_count = 1
         self.run_bot()
         self.assertAnyLoglineEqual(message='Ignoring report without raw field. '
                                            'Possible bug or misconfiguration of this bot.',
                                    levelname='WARNING')
 
+    def test_no_multiprocessing(self):
+        """ Test if collectors are not forked into multiple processes. """
+        self.sysconfig = dict(self.sysconfig, instances_processes=2)
+        self.allowed_error_count = 1
+        self.run_bot()
+        self.assertAnyLoglineEqual(message='Multiple processes are configured, but are not '
+                                           'available for this bot.',
+                                   levelname='ERROR')
+        self.assertMessageEqual(0, EXAMPLE_REPORT)
+
 
 if __name__ == '__main__':  # pragma: no cover
     unittest.main()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the dump files of intelmq.lib.dump
+"""
+import fcntl
+import json
+import os
+import tempfile
+import unittest
+
+from intelmq.lib.dump import DumpFile
+
+
+def entry(number):
+    return {'timestamp': '2019-09-0%dT12:00:00' % number,
+            'bot_id': 'test-bot',
+            'source_queue': 'test-bot-queue',
+            'traceback': ['Traceback (most recent call last):\n', 'ValueError: %d\n' % number],
+            'message': json.dumps({'__type': 'Event', 'raw': 'dGVzdA==', 'feed.name': str(number)}),
+            }
+
+
+class TestDumpFile(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'test-bot.dump')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def fill(self, count):
+        with DumpFile(self.filename) as dump:
+            for number in range(count):
+                dump.append(entry(number))
+
+    def test_append(self):
+        self.fill(3)
+        with DumpFile(self.filename) as dump:
+            self.assertEqual(len(dump), 3)
+            self.assertEqual(dump[1], entry(1))
+            self.assertEqual(list(dump), [entry(0), entry(1), entry(2)])
+            dump.append(entry(3))
+            self.assertEqual(len(dump), 4)
+            self.assertEqual(dump[3], entry(3))
+        with open(self.filename) as handle:
+            self.assertEqual([json.loads(line) for line in handle],
+                             [entry(number) for number in range(4)])
+
+    def test_delete(self):
+        self.fill(5)
+        with DumpFile(self.filename) as dump:
+            dump.delete([0, 2, 3])
+            self.assertEqual(list(dump), [entry(1), entry(4)])
+            dump.append(entry(5))
+        with DumpFile(self.filename) as dump:
+            self.assertEqual(list(dump), [entry(1), entry(4), entry(5)])
+        self.assertFalse(os.path.exists(self.filename + '.tmp'))
+
+    def test_remove(self):
+        self.fill(1)
+        with DumpFile(self.filename) as dump:
+            dump.remove()
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    def test_rebuild_index(self):
+        """ A missing or outdated index is rebuilt from the dump file. """
+        self.fill(3)
+        os.remove(self.filename + '.index')
+        with DumpFile(self.filename) as dump:
+            self.assertEqual(list(dump), [entry(0), entry(1), entry(2)])
+        with open(self.filename, 'a') as handle:
+            handle.write(json.dumps(entry(3)) + '\n')
+        with DumpFile(self.filename) as dump:
+            self.assertEqual(len(dump), 4)
+            self.assertEqual(dump[3], entry(3))
+
+    def test_interrupted_write(self):
+        """ An incomplete last line is kept as invalid entry and does not break the following entries. """
+        self.fill(1)
+        with open(self.filename, 'a') as handle:
+            handle.write('{"timestamp": "2019-')
+        with DumpFile(self.filename) as dump:
+            self.assertEqual(len(dump), 2)
+            with self.assertRaises(ValueError):
+                dump[1]
+            dump.append(entry(2))
+            self.assertEqual(dump[2], entry(2))
+            dump.delete([1])
+            self.assertEqual(list(dump), [entry(0), entry(2)])
+
+    def test_migrate(self):
+        """ Dump files of IntelMQ < 2.1 are converted. """
+        legacy = {}
+        for number in (2, 1):
+            value = entry(number)
+            legacy[value.pop('timestamp')] = value
+        with open(self.filename, 'w') as handle:
+            json.dump(legacy, handle, indent=4, sort_keys=True)
+        with DumpFile(self.filename) as dump:
+            self.assertEqual(list(dump), [entry(1), entry(2)])
+        with open(self.filename) as handle:
+            self.assertEqual(len(handle.readlines()), 2)
+
+    def test_migrate_invalid(self):
+        with open(self.filename, 'w') as handle:
+            handle.write('{\n    "2019-09-01T12:00:00": {')
+        with self.assertRaises(ValueError):
+            DumpFile(self.filename).open()
+
+    def test_locked(self):
+        self.fill(1)
+        with open(self.filename) as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            with self.assertRaises(BlockingIOError):
+                DumpFile(self.filename, timeout=0).open()
+
+
+if __name__ == '__main__':  # pragma: no cover
+    unittest.main()
@@ -1,7 +1,15 @@
+import base64
+import json
+import os
+import tempfile
+import time
 import unittest
+import unittest.mock as mock
+import zlib
 
 import intelmq.lib.test as test
 from intelmq.lib.bot import Bot
+from intelmq.lib.dump import DumpFile
 
 EXAMPLE = {'feed.name': 'Test', "__type": "Report"}
 QUEUES = {"_default", "other-way", "two-way"}
@@ -14,6 +22,31 @@ def process(self):
         self.acknowledge_message()
 
 
+class DummyBatchExpertBot(DummyExpertBot):
+
+    def process_batch(self, events):
+        self.logger.info('Processing batch of %d events.', len(events))
+        for event in events:
+            self.send_message(event)
+
+
+class FailingBatchExpertBot(DummyExpertBot):
+    """ Fails for events with the feed code 'fail', in batches and single. """
+
+    def process(self):
+        event = self.receive_message()
+        if event.get('feed.code') == 'fail':
+            raise ValueError('Failing event.')
+        self.send_message(event)
+        self.acknowledge_message()
+
+    def process_batch(self, events):
+        if any(event.get('feed.code') == 'fail' for event in events):
+            raise ValueError('Failing batch.')
+        for event in events:
+            self.send_message(event)
+
+
 class TestDummyExpertBot(test.BotTestCase, unittest.TestCase):
     """ Testing generic functionalities of Bot base class. """
 
@@ -48,6 +81,212 @@ def test_pipeline_multiple(self):
         self.assertOutputQueueLen(0, path="other-way")
         self.assertMessageEqual(0, input_message, path="two-way")
 
+    def test_batch(self):
+        """ Bots without process_batch process batches message by message. """
+        input_message = EXAMPLE.copy()
+        input_message["feed.code"] = "other-way"
+        self.input_message = [EXAMPLE, input_message, EXAMPLE]
+        self.prepare_bot(parameters={'batch_size': 2}, destination_queues=QUEUES)
+        self.run_bot(prepare=False, iterations=3)
+        self.assertOutputQueueLen(2, path="_default")
+        self.assertMessageEqual(0, input_message, path="other-way")
+        self.assertEqual(self.pipe.state['test-bot-input-internal'], [])
+
+    def test_compressed(self):
+        """ Compressed messages are decompressed by the bot. """
+        self.input_message = b'\x02' + zlib.compress(json.dumps(EXAMPLE).encode())
+        self.run_bot()
+        self.assertMessageEqual(0, EXAMPLE)
+
+    def test_dump_corrupt_compressed(self):
+        """ Corrupt compressed messages are retried and dumped, they do not block the pipeline. """
+        self.input_message = b'\x02not zlib data'
+        self.prepare_bot(parameters={'error_max_retries': 1, 'error_procedure': 'stop',
+                                     'error_dump_message': True})
+        with tempfile.TemporaryDirectory() as logging_path:
+            # as parameter, it would replace the log handler of the test
+            self.bot.parameters.logging_path = logging_path
+            # run until the error procedure stops the bot
+            self.bot.parameters.testing = False
+            with self.assertRaises(SystemExit):
+                self.run_bot(prepare=False)
+            with DumpFile(os.path.join(logging_path, 'test-bot.dump')) as dump_file:
+                dumped = list(dump_file)
+        self.assertEqual(len(dumped), 1)
+        self.assertEqual(dumped[0]['message_encoding'], 'base64')
+        self.assertEqual(base64.b64decode(dumped[0]['message']), b'\x02not zlib data')
+        self.assertIn('zlib.error', ''.join(dumped[0]['traceback']))
+        self.assertEqual(self.pipe.state['test-bot-input-internal'], [])
+        self.assertEqual(self.bot._Bot__message_counter['failure'], 2)
+
+    def test_tracing(self):
+        """ The bot adds its hop to the trace of the message. """
+        input_message = EXAMPLE.copy()
+        input_message['__trace'] = {'ingest': 1000.0,
+                                    'hops': [['collector', None, None, 1000.5]]}
+        self.input_message = input_message
+        self.prepare_bot(parameters={'tracing': True})
+        self.run_bot(prepare=False)
+        trace = json.loads(self.get_output_queue()[0])['__trace']
+        self.assertEqual(trace['ingest'], 1000.0)
+        self.assertEqual(trace['hops'][0], ['collector', None, None, 1000.5])
+        self.assertEqual(trace['hops'][1][:2], ['test-bot', 'test-bot-input'])
+        self.assertLessEqual(trace['hops'][1][2], trace['hops'][1][3])
+
+    def test_no_tracing(self):
+        """ Without tracing, the trace of the message is passed on unchanged. """
+        input_message = EXAMPLE.copy()
+        input_message['__trace'] = {'ingest': 1000.0, 'hops': []}
+        self.input_message = input_message
+        self.run_bot()
+        self.assertEqual(json.loads(self.get_output_queue()[0])['__trace'],
+                         {'ingest': 1000.0, 'hops': []})
+
+    def test_profiling(self):
+        """ The profile is written to the logging path and summarized in the log. """
+        with tempfile.TemporaryDirectory() as logging_path:
+            self.prepare_bot(parameters={'profiling': 'cprofile'})
+            # as parameter, it would replace the log handler of the test
+            self.bot.parameters.logging_path = logging_path
+            self.run_bot(prepare=False)
+            self.assertTrue(os.path.exists(os.path.join(logging_path, 'test-bot.pstats')))
+        self.assertRegexpMatches(self.loglines_buffer, r'Profiled \d+ messages in .*pipeline I/O .*'
+                                                       r'deserialization .*process\(\) .*serialization')
+
+    def test_profiling_seconds_idle(self):
+        """ The profiling ends after profiling_seconds, also if no messages arrive. """
+        self.input_message = []
+        self.prepare_bot(parameters={'profiling': 'cprofile', 'profiling_seconds': 0.1})
+        # as for `intelmqctl run <bot> profile`
+        self.bot._Bot__profiling_exit = True
+        self.bot.parameters.testing = False
+        # the pipeline waits for the next message
+        self.pipe.receive = lambda: time.sleep(30)
+        with tempfile.TemporaryDirectory() as logging_path:
+            # as parameter, it would replace the log handler of the test
+            self.bot.parameters.logging_path = logging_path
+            start = time.perf_counter()
+            with self.assertRaises(SystemExit):
+                self.run_bot(prepare=False)
+            self.assertLess(time.perf_counter() - start, 30)
+            self.assertTrue(os.path.exists(os.path.join(logging_path, 'test-bot.pstats')))
+
+    def test_profiling_sighup(self):
+        """ After a reload, the bot is profiled again. """
+        with tempfile.TemporaryDirectory() as logging_path:
+            self.prepare_bot(parameters={'profiling': 'cprofile', 'logging_path': logging_path,
+                                         'source_pipeline_broker': 'pythonlist',
+                                         'destination_pipeline_broker': 'pythonlist',
+                                         'raise_on_connect': False})
+            with mock.patch('intelmq.lib.utils.load_configuration', new=self.mocked_config), \
+                    mock.patch('intelmq.lib.utils.log', self.mocked_log):
+                self.bot._Bot__sighup.set()
+                self.bot._Bot__handle_sighup()
+                self.assertIsNotNone(self.bot._Bot__profiler)
+                self.bot.stop()
+            self.assertIsNone(self.bot._Bot__profiler)
+            self.assertTrue(os.path.exists(os.path.join(logging_path, 'test-bot.pstats')))
+
+    def test_profiling_invalid(self):
+        self.prepare_bot(parameters={'profiling': 'invalid'})
+        self.run_bot(prepare=False)
+        self.assertAnyLoglineEqual("Could not start profiling: Invalid profiler 'invalid', "
+                                   "must be one of cprofile, sampling.")
+
+
+class TestDummyBatchExpertBot(test.BotTestCase, unittest.TestCase):
+    """ Testing batch processing of the Bot base class. """
+
+    @classmethod
+    def set_bot(cls):
+        cls.bot_reference = DummyBatchExpertBot
+        cls.default_input_message = EXAMPLE.copy()
+
+    def test_process_batch(self):
+        self.input_message = [EXAMPLE] * 3
+        self.prepare_bot(parameters={'batch_size': 2})
+        self.run_bot(prepare=False, iterations=2)
+        self.assertOutputQueueLen(3)
+        self.assertLogMatches('Processing batch of 2 events.', levelname='INFO')
+        self.assertLogMatches('Processing batch of 1 events.', levelname='INFO')
+        self.assertEqual(self.pipe.state['test-bot-input-internal'], [])
+        # counted per message, not per batch
+        self.assertEqual(self.bot._Bot__message_counter['success'], 3)
+
+    def test_no_batch(self):
+        """ With the default batch_size, process is used. """
+        self.input_message = [EXAMPLE] * 2
+        self.prepare_bot()
+        self.run_bot(prepare=False, iterations=2)
+        self.assertOutputQueueLen(2)
+        self.assertNotRegexpMatchesLog('Processing batch')
+
+
+class TestFailingBatchExpertBot(test.BotTestCase, unittest.TestCase):
+    """ Testing failing batches of the Bot base class. """
+
+    @classmethod
+    def set_bot(cls):
+        cls.bot_reference = FailingBatchExpertBot
+        cls.default_input_message = EXAMPLE.copy()
+        cls.allowed_error_count = 1
+
+    def test_fallback(self):
+        """ After a failed batch, its messages are processed one by one. """
+        self.input_message = [EXAMPLE, EXAMPLE]
+        self.prepare_bot(parameters={'batch_size': 2})
+        # fail the first batch
+        self.bot.process_batch = lambda events: 1 / 0
+        self.run_bot(prepare=False, iterations=3)
+        self.assertLogMatches('Processing the messages of the failed batch one by one.', levelname='INFO')
+        self.assertOutputQueueLen(2)
+        self.assertEqual(self.bot._Bot__message_counter['success'], 2)
+        self.assertEqual(self.bot._Bot__message_counter['failure'], 0)
+
+    def test_dump_failing_message(self):
+        """ Only the failing message of a failed batch is dumped. """
+        failing = EXAMPLE.copy()
+        failing['feed.code'] = 'fail'
+        self.input_message = [EXAMPLE, EXAMPLE, failing]
+        self.prepare_bot(parameters={'batch_size': 3, 'error_max_retries': 0,
+                                     'error_procedure': 'stop', 'error_dump_message': True})
+        with tempfile.TemporaryDirectory() as logging_path:
+            # as parameter, it would replace the log handler of the test
+            self.bot.parameters.logging_path = logging_path
+            # run until the error procedure stops the bot
+            self.bot.parameters.testing = False
+            with self.assertRaises(SystemExit):
+                self.run_bot(prepare=False)
+            with DumpFile(os.path.join(logging_path, 'test-bot.dump')) as dump_file:
+                dumped = list(dump_file)
+        self.assertEqual(len(dumped), 1)
+        self.assertEqual(json.loads(dumped[0]['message'])['feed.code'], 'fail')
+        self.assertIn('ValueError: Failing event.', ''.join(dumped[0]['traceback']))
+        self.assertEqual(len(self.get_output_queue()), 2)
+        self.assertEqual(self.bot._Bot__message_counter['success'], 2)
+        self.assertEqual(self.bot._Bot__message_counter['failure'], 1)
+
+    def test_dump_invalid_message(self):
+        """ A message of a batch which can not be unserialized is retried and dumped. """
+        self.input_message = [EXAMPLE, '{"invalid', EXAMPLE]
+        self.prepare_bot(parameters={'batch_size': 3, 'error_max_retries': 1,
+                                     'error_procedure': 'stop', 'error_dump_message': True})
+        with tempfile.TemporaryDirectory() as logging_path:
+            # as parameter, it would replace the log handler of the test
+            self.bot.parameters.logging_path = logging_path
+            # run until the error procedure stops the bot
+            self.bot.parameters.testing = False
+            with self.assertRaises(SystemExit):
+                self.run_bot(prepare=False)
+            with DumpFile(os.path.join(logging_path, 'test-bot.dump')) as dump_file:
+                dumped = list(dump_file)
+        self.assertEqual(len(dumped), 1)
+        self.assertEqual(dumped[0]['message'], '{"invalid')
+        self.assertIn('JSONDecodeError', ''.join(dumped[0]['traceback']))
+        self.assertEqual(len(self.get_output_queue()), 1)
+        self.assertEqual(self.bot._Bot__message_counter['success'], 1)
+        self.assertEqual(self.bot._Bot__message_counter['failure'], 2)
+
 
 if __name__ == '__main__':  # pragma: no cover
     unittest.main()
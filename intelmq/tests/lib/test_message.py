@@ -365,6 +365,92 @@ def test_factory_serialize(self):
         self.assertDictEqual(json.loads(expected),
                              json.loads(actual))
 
+    def test_factory_serialize_validated(self):
+        """ Test MessageFactory serialize method with validated marker. """
+        event = self.new_event()
+        event.add('source.ip', '192.0.2.1')
+        actual = message.MessageFactory.serialize(event, validated=True)
+        self.assertDictEqual({'__type': 'Event', '__validated': True, 'source.ip': '192.0.2.1'},
+                             json.loads(actual))
+        self.assertNotIn('__validated', event)
+        self.assertEqual(event.serialize(), '{"source.ip": "192.0.2.1", "__type": "Event"}')
+
+    def test_factory_unserialize_trusted(self):
+        """ Test if validated messages are not validated again if trusted. """
+        raw = '{"__type": "Event", "__validated": true, "source.asn": "foo"}'
+        event = message.MessageFactory.unserialize(raw, harmonization=HARM, trusted=True)
+        self.assertIsInstance(event, message.Event)
+        self.assertDictEqual({'source.asn': 'foo'}, dict(event))
+        with self.assertRaises(exceptions.InvalidValue):
+            event.change('source.asn', 'bar')
+
+    def test_factory_unserialize_untrusted(self):
+        """ Test if the validated marker is ignored if not trusted. """
+        raw = '{"__type": "Event", "__validated": true, "source.asn": "foo"}'
+        with self.assertRaises(exceptions.InvalidValue):
+            message.MessageFactory.unserialize(raw, harmonization=HARM)
+        raw = '{"__type": "Event", "__validated": true, "source.asn": 1}'
+        event = message.MessageFactory.unserialize(raw, harmonization=HARM)
+        self.assertDictEqual({'source.asn': 1}, dict(event))
+
+    def test_factory_unserialize_trusted_unmarked(self):
+        """ Test if unmarked messages are validated even if trusted. """
+        raw = '{"__type": "Event", "source.asn": "foo"}'
+        with self.assertRaises(exceptions.InvalidValue):
+            message.MessageFactory.unserialize(raw, harmonization=HARM, trusted=True)
+
+    @unittest.skipIf(message.msgpack is None, 'msgpack is not installed.')
+    def test_factory_serialize_msgpack(self):
+        """ Test MessageFactory serialize and unserialize with msgpack encoding. """
+        report = self.new_report(auto=True)
+        report.add('feed.name', 'Example')
+        report.add('raw', LOREM_BASE64, sanitize=False)
+        actual = message.MessageFactory.serialize(report, encoding='msgpack')
+        self.assertIsInstance(actual, bytes)
+        self.assertEqual(actual[:1], b'\x01')
+        self.assertIn(b'lorem ipsum', actual)
+        self.assertTrue(message.is_binary(actual))
+        self.assertEqual(message.MessageFactory.unserialize(actual, harmonization=HARM),
+                         report)
+
+    @unittest.skipIf(message.msgpack is None, 'msgpack is not installed.')
+    def test_factory_serialize_msgpack_noncanonical(self):
+        """ Test if Base64 values which can't be restored exactly are kept as string. """
+        report = self.new_report(auto=True)
+        report.add('raw', 'bG9yZW0g\naXBzdW0=', sanitize=False)
+        actual = message.MessageFactory.serialize(report, encoding='msgpack', validated=True)
+        unserialized = message.MessageFactory.unserialize(actual, harmonization=HARM, trusted=True)
+        self.assertEqual(unserialized['raw'], 'bG9yZW0g\naXBzdW0=')
+
+    def test_trace(self):
+        """ Test if the trace is serialized and unserialized, but is no field. """
+        event = self.new_event()
+        event.add('feed.name', 'Example')
+        event.trace = {'ingest': 1.0, 'hops': [['collector', None, None, 2.0]]}
+        self.assertNotIn('__trace', event)
+        unserialized = message.MessageFactory.unserialize(event.serialize(), harmonization=HARM)
+        self.assertEqual(unserialized.trace, event.trace)
+        self.assertEqual(unserialized, event)
+        self.assertNotIn('__trace', unserialized.to_dict())
+
+    @unittest.skipIf(message.msgpack is None, 'msgpack is not installed.')
+    def test_trace_msgpack(self):
+        event = self.new_event()
+        event.trace = {'ingest': 1.0, 'hops': []}
+        unserialized = message.MessageFactory.unserialize(event.serialize(validated=True, encoding='msgpack'),
+                                                          harmonization=HARM, trusted=True)
+        self.assertEqual(unserialized.trace, event.trace)
+
+    def test_factory_serialize_invalid_encoding(self):
+        """ Test MessageFactory serialize with an unknown encoding. """
+        with self.assertRaises(exceptions.InvalidArgument):
+            message.MessageFactory.serialize(self.new_report(), encoding='foo')
+
+    def test_is_binary(self):
+        """ Test if JSON is not detected as binary encoding. """
+        self.assertFalse(message.is_binary(b'{"__type": "Event"}'))
+        self.assertFalse(message.is_binary('{"__type": "Event"}'))
+
     def test_deep_copy_content(self):
         """ Test if deep_copy does return the same items. """
         report = self.new_report(examples=True)
@@ -756,6 +842,28 @@ def test_invalid_harm_key(self):
         with self.assertRaises(exceptions.InvalidKey):
             message.Event(harmonization={'event': {'foo.bar.': {}}})
 
+    def test_compiled_harmonization_shared(self):
+        """ Test if messages with the same harmonization share the compiled fields. """
+        event1 = message.Event(harmonization=HARM)
+        event2 = message.Event(harmonization=HARM)
+        self.assertIs(event1._fields, event2._fields)
+        self.assertIs(message.compile_harmonization(HARM['event']), event1._fields)
+        self.assertIsNot(message.Report(harmonization=HARM)._fields, event1._fields)
+
+    def test_compiled_field_checks(self):
+        """ Test the precompiled length and regex checks. """
+        harmonization = {'event': {'foo': {'type': 'String', 'length': 3, 'regex': '^[a-z]+$'},
+                                   'bar': {'type': 'String', 'iregex': '^[a-z]+$'}}}
+        event = message.Event(harmonization=harmonization)
+        event.add('foo', 'abc')
+        event.add('bar', 'ABC')
+        with self.assertRaisesRegex(exceptions.InvalidValue, 'too long: 4 > 3.'):
+            event.add('foo', 'abcd', overwrite=True)
+        with self.assertRaisesRegex(exceptions.InvalidValue, 'regex did not match.'):
+            event.add('foo', 'AB', overwrite=True)
+        with self.assertRaisesRegex(exceptions.InvalidValue, r'regex \(case insensitive\) did not match.'):
+            event.add('bar', '123', overwrite=True)
+
 
 class TestReport(unittest.TestCase):
     """
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Testing the microbenchmarks of the harmonization types and messages.
+"""
+import importlib.util
+import json
+import unittest
+
+import pkg_resources
+
+import intelmq.lib.harmonization as harmonization
+import intelmq.lib.microbench as microbench
+from intelmq.lib.utils import load_configuration
+
+
+class TestMicrobench(unittest.TestCase):
+
+    def test_generate_events(self):
+        """ The corpus is reproducible. """
+        events = microbench.generate_events(50, seed=3)
+        self.assertEqual(events, microbench.generate_events(50, seed=3))
+        self.assertNotEqual(events, microbench.generate_events(50, seed=4))
+        for raw in events:
+            self.assertEqual(json.loads(raw)['__type'], 'Event')
+
+    def test_generators(self):
+        """ All types of the harmonization are covered and most values are valid after sanitation. """
+        config = load_configuration(pkg_resources.resource_filename('intelmq', 'etc/harmonization.conf'))
+        types = {field['type'] for message in config.values() for field in message.values()}
+        self.assertLessEqual(types, set(microbench.GENERATORS))
+        for type_name in microbench.GENERATORS:
+            values = microbench.generate_values(type_name, count=100)
+            self.assertEqual(values, microbench.generate_values(type_name, count=100))
+            type_class = getattr(harmonization, type_name)
+            valid = [value for value in values if type_class.is_valid(value, sanitize=True)]
+            self.assertGreater(len(valid), 50, type_name)
+
+    @unittest.skipIf(importlib.util.find_spec('textx') is None, 'textx is not installed')
+    def test_generate_sieve(self):
+        """ The sieve file is reproducible and valid. """
+        from intelmq.bots.experts.sieve.expert import SieveExpertBot
+
+        sieve = microbench.generate_sieve(20, seed=3)
+        self.assertEqual(sieve, microbench.generate_sieve(20, seed=3))
+        config = load_configuration(pkg_resources.resource_filename('intelmq', 'etc/harmonization.conf'))
+        SieveExpertBot.harmonization = config['event']
+        model = SieveExpertBot.init_metamodel().model_from_str(sieve)
+        self.assertEqual(len(model.rules), 20)
+
+    def test_generate_modify(self):
+        """ The modify configuration is reproducible and some rules match the events. """
+        from intelmq.bots.experts.modify.lib import Program
+
+        config = microbench.generate_modify(40, seed=3)
+        self.assertEqual(config, microbench.generate_modify(40, seed=3))
+        program = Program(config, True, None)
+        self.assertEqual(len(program.rules), 40)
+        events = [json.loads(raw) for raw in microbench.generate_events(200, seed=3)]
+        self.assertTrue(any(rule.matches(event) is not None for rule in program.rules for event in events))
+
+    def test_select(self):
+        self.assertEqual(microbench.select(), list(microbench.BENCHMARKS))
+        self.assertEqual(microbench.select([r'^message\.to_dict']),
+                         ['message.to_dict', 'message.to_dict_hierarchical'])
+        self.assertEqual(microbench.select(['does-not-exist']), [])
+
+    def test_run(self):
+        """ All benchmarks run. """
+        results = microbench.run(microbench.select(), count=10, repeat=1)
+        self.assertEqual(set(results), set(microbench.BENCHMARKS))
+        for result in results.values():
+            self.assertGreater(result['operations_per_second'], 0)
+            self.assertGreater(result['nanoseconds'], 0)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    unittest.main()
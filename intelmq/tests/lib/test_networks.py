@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the network lists of intelmq.lib.networks
+"""
+import ipaddress
+import os
+import random
+import tempfile
+import unittest
+
+from intelmq.lib.networks import NetworkMap, flatten, parse_address
+
+
+class TestNetworkMap(unittest.TestCase):
+
+    def setUp(self):
+        self.networks = NetworkMap([('10.0.0.0/8', 'a'),
+                                    ('10.1.0.0/16', 'b'),
+                                    ('10.1.2.3', 'c'),
+                                    ('10.1.255.0/24', 'd'),
+                                    ('192.0.2.77/24', 'e'),
+                                    ('2001:db8::/32', 'f'),
+                                    ('2001:db8:1::/48', 'g'),
+                                    ])
+
+    def test_lookup(self):
+        self.assertEqual(self.networks.lookup('10.1.2.3'), 'c')
+        self.assertEqual(self.networks.lookup('10.1.2.4'), 'b')
+        self.assertEqual(self.networks.lookup('10.1.255.255'), 'd')
+        self.assertEqual(self.networks.lookup('10.2.0.0'), 'a')
+        self.assertEqual(self.networks.lookup('10.255.255.255'), 'a')
+        self.assertEqual(self.networks.lookup('192.0.2.1'), 'e')
+        self.assertEqual(self.networks.lookup(ipaddress.ip_address('2001:db8:1::1')), 'g')
+        self.assertEqual(self.networks.lookup('2001:db8:2::1'), 'f')
+        self.assertIsNone(self.networks.lookup('11.0.0.0'))
+        self.assertEqual(self.networks.lookup('9.255.255.255', default=False), False)
+        self.assertIsNone(self.networks.lookup('::ffff:10.0.0.1'))
+
+    def test_lookup_all(self):
+        self.assertEqual(self.networks.lookup_all('10.1.2.3'), ('a', 'b', 'c'))
+        self.assertEqual(self.networks.lookup_all('10.1.3.0'), ('a', 'b'))
+        self.assertEqual(self.networks.lookup_all('2001:db8:1::1'), ('f', 'g'))
+        self.assertEqual(self.networks.lookup_all('172.16.0.1'), ())
+
+    def test_contains(self):
+        self.assertIn('10.0.0.1', self.networks)
+        self.assertNotIn('172.16.0.1', self.networks)
+        self.assertNotIn('invalid', self.networks)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            self.networks.lookup('10.0.0.256')
+        with self.assertRaises(ValueError):
+            self.networks.add('10.0.0.0/33')
+
+    def test_add(self):
+        """ Networks can be added after lookups, duplicates keep all values. """
+        self.assertEqual(self.networks.lookup('172.16.0.1'), None)
+        self.networks.add('172.16.0.0/12', 'h')
+        self.networks.add('10.0.0.0/8', 'i')
+        self.assertEqual(self.networks.lookup('172.16.0.1'), 'h')
+        self.assertEqual(self.networks.lookup_all('10.1.2.3'), ('a', 'i', 'b', 'c'))
+        self.assertEqual(len(self.networks), 8)
+
+    def test_default(self):
+        networks = NetworkMap(['0.0.0.0/0', '::/0'])
+        self.assertIs(networks.lookup('1.2.3.4'), True)
+        self.assertIs(networks.lookup('::1'), True)
+
+    def test_from_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'networks.txt')
+            with open(filename, 'w') as handle:
+                handle.write('# constituency networks\n'
+                             '192.0.2.0/24 example constituency\n'
+                             '\n'
+                             '198.51.100.1\n')
+            networks = NetworkMap.from_file(filename, default='default')
+            self.assertEqual(networks.lookup('192.0.2.1'), 'example constituency')
+            self.assertEqual(networks.lookup('198.51.100.1'), 'default')
+            self.assertIsNone(networks.lookup('198.51.100.2'))
+            with open(filename, 'a') as handle:
+                handle.write('invalid\n')
+            with self.assertRaisesRegex(ValueError, 'line 5'):
+                NetworkMap.from_file(filename)
+
+    def test_random(self):
+        """ The lookup returns the same as comparing with every network. """
+        rand = random.Random(1)
+        networks = [ipaddress.ip_network((rand.choice((0x0a000000, 0xc0a80000)) + rand.getrandbits(16),
+                                          rand.randint(8, 32)), strict=False)
+                    for _ in range(500)]
+        network_map = NetworkMap((str(network), number) for number, network in enumerate(networks))
+        for _ in range(2000):
+            address = ipaddress.ip_address(rand.choice((0x0a000000, 0xc0a80000)) + rand.getrandbits(16))
+            matching = [number for number, network in enumerate(networks) if address in network]
+            self.assertEqual(sorted(network_map.lookup_all(address)), matching)
+            if matching:
+                longest = max(networks[number].prefixlen for number in matching)
+                self.assertEqual(networks[network_map.lookup(address)].prefixlen, longest)
+
+
+class TestFunctions(unittest.TestCase):
+
+    def test_parse_address(self):
+        self.assertEqual(parse_address('10.0.0.1'), (4, 0x0a000001))
+        self.assertEqual(parse_address('2001:db8::1'), (6, (0x20010db8 << 96) + 1))
+        self.assertEqual(parse_address('fe80::1%eth0'), (6, (0xfe80 << 112) + 1))
+        self.assertEqual(parse_address(ipaddress.ip_address('10.0.0.1')), (4, 0x0a000001))
+        self.assertEqual(parse_address(0x0a000001), (4, 0x0a000001))
+        for invalid in ('10.0.0.256', '010.0.0.1', ' 10.0.0.1', 'invalid', ''):
+            with self.assertRaises(ValueError):
+                parse_address(invalid)
+
+    def test_flatten(self):
+        self.assertEqual(flatten([(0, 15, ['a']), (4, 7, ['b']), (20, 23, ['c']), (4, 5, ['d', 'e'])]),
+                         ([0, 4, 6, 8, 20], [3, 5, 7, 15, 23],
+                          [('a',), ('a', 'b', 'd', 'e'), ('a', 'b'), ('a',), ('c',)]))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    unittest.main()
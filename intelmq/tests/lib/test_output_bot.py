@@ -0,0 +1,50 @@
+import time
+import unittest
+
+import intelmq.lib.test as test
+from intelmq.lib.bot import Bot
+
+EXAMPLE = {'feed.name': 'Test', "__type": "Event"}
+
+
+class DummyOutputBot(Bot):
+
+    def process(self):
+        self.receive_message()
+        self.acknowledge_message()
+
+
+class TestDummyOutputBot(test.BotTestCase, unittest.TestCase):
+    """ Testing the output specific functionalities of the Bot base class. """
+
+    @classmethod
+    def set_bot(cls):
+        cls.bot_reference = DummyOutputBot
+        cls.default_input_message = EXAMPLE.copy()
+
+    def test_tracing(self):
+        """ The latencies of the traces are counted. """
+        now = time.time()
+        input_message = EXAMPLE.copy()
+        input_message['__trace'] = {'ingest': now - 9.9,
+                                    'hops': [['collector', None, None, now - 9],
+                                             ['expert', 'expert-queue', now - 7, now - 6]]}
+        self.input_message = input_message
+        self.prepare_bot(parameters={'tracing': True})
+        self.run_bot(prepare=False)
+        histograms = self.bot._Bot__trace_histograms
+        self.assertEqual(set(histograms), {'end_to_end', 'wait.expert-queue', 'wait.test-bot-input'})
+        self.assertEqual(histograms['end_to_end'].percentile(50), 10)
+        self.assertEqual(histograms['wait.expert-queue'].percentile(50), 2.5)
+        self.assertEqual(histograms['wait.test-bot-input'].percentile(50), 10)
+
+    def test_no_tracing(self):
+        input_message = EXAMPLE.copy()
+        input_message['__trace'] = {'ingest': time.time(), 'hops': []}
+        self.input_message = input_message
+        self.run_bot()
+        self.assertEqual(dict(self.bot._Bot__trace_histograms), {})
+
+
+if __name__ == '__main__':  # pragma: no cover
+    unittest.main()
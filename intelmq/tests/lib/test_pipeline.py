@@ -12,9 +12,19 @@
 import os
 import time
 import unittest
+import unittest.mock as mock
+import zlib
 
+import pkg_resources
+
+import intelmq.lib.exceptions as exceptions
+import intelmq.lib.message as message
 import intelmq.lib.pipeline as pipeline
 import intelmq.lib.test as test
+from intelmq.lib.utils import load_configuration
+
+HARM = load_configuration(pkg_resources.resource_filename('intelmq',
+                                                          'etc/harmonization.conf'))
 
 SAMPLES = {'normal': [b'Lorem ipsum dolor sit amet',
                       'Lorem ipsum dolor sit amet'],
@@ -84,6 +94,80 @@ def test_send_unicode(self):
         self.assertEqual(SAMPLES['unicode'][0],
                          self.pipe.state['test-bot-output'][0])
 
+    def test_receive_binary(self):
+        """ Binary encoded messages are not decoded. """
+        self.pipe.state['test-bot-input'] = [b'\x01\x81\xa1a\xff']
+        self.assertEqual(b'\x01\x81\xa1a\xff', self.pipe.receive())
+
+    def test_send_compression(self):
+        """ Messages larger than the threshold are compressed and transparently decompressed. """
+        self.pipe.parameters.destination_pipeline_compression = 'zlib'
+        self.pipe.parameters.destination_pipeline_compression_threshold = 100
+        self.pipe.set_queues('test-bot-output', 'destination')
+        message = SAMPLES['normal'][1] * 10
+        self.pipe.send(SAMPLES['normal'][1])
+        self.pipe.send(message)
+        self.assertEqual(SAMPLES['normal'][0], self.pipe.state['test-bot-output'][0])
+        compressed = self.pipe.state['test-bot-output'][1]
+        self.assertEqual(compressed[:1], b'\x02')
+        self.assertLess(len(compressed), len(message))
+        self.assertEqual(self.pipe.compression_stats['test-bot-output'],
+                         [len(message) + 26, len(compressed) + 26])
+        self.pipe.state['test-bot-input'] = self.pipe.state['test-bot-output'][1:]
+        # the bot decompresses the received message
+        self.assertEqual(compressed, self.pipe.receive())
+        self.assertEqual(message, pipeline.decompress(compressed))
+
+    @unittest.skipIf(pipeline.zstandard is None, 'zstandard is not installed.')
+    def test_send_compression_zstd(self):
+        self.pipe.parameters.destination_pipeline_compression = 'zstd'
+        self.pipe.parameters.destination_pipeline_compression_threshold = 0
+        self.pipe.set_queues('test-bot-output', 'destination')
+        message = SAMPLES['unicode'][1] * 20
+        self.pipe.send(message)
+        self.assertEqual(self.pipe.state['test-bot-output'][0][:1], b'\x03')
+        self.pipe.state['test-bot-input'] = self.pipe.state['test-bot-output'][:]
+        self.assertEqual(message, pipeline.decompress(self.pipe.receive()))
+
+    def test_receive_compression_corrupt(self):
+        """ Corrupt compressed messages are received unchanged, decompressing them fails. """
+        self.pipe.state['test-bot-input'] = [b'\x02not zlib data']
+        self.assertEqual(b'\x02not zlib data', self.pipe.receive())
+        with self.assertRaises(zlib.error):
+            pipeline.decompress(b'\x02not zlib data')
+
+    def test_decompress_missing_library(self):
+        with mock.patch.dict(pipeline.COMPRESSIONS, zstd=(b'\x03', None, None, None)):
+            with self.assertRaisesRegex(ValueError, "install the 'zstandard' library"):
+                pipeline.decompress(b'\x03data')
+
+    def test_receive_invalid_unicode(self):
+        """ Messages which are no valid UTF-8 are received unchanged. """
+        self.pipe.state['test-bot-input'] = [b'{"\xff"}']
+        self.assertEqual(b'{"\xff"}', self.pipe.receive())
+
+    def test_requeue_internal_queues(self):
+        """ Messages of internal queues not in use are received again first. """
+        self.addCleanup(self.pipe.state.pop, 'test-bot-input-internal.0')
+        self.pipe.state['test-bot-input'] = [b'new']
+        self.pipe.state['test-bot-input-internal'] = [b'old']
+        self.pipe.state['test-bot-input-internal.0'] = [b'first', b'second']
+        self.assertEqual(self.pipe.find_internal_queues('test-bot-input'),
+                         ['test-bot-input-internal', 'test-bot-input-internal.0'])
+        self.assertEqual(self.pipe.requeue_internal_queues(keep=['test-bot-input-internal']),
+                         {'test-bot-input-internal.0': 2})
+        self.assertEqual(self.pipe.state['test-bot-input'], [b'first', b'second', b'new'])
+        self.assertEqual(self.pipe.find_internal_queues('test-bot-input'), ['test-bot-input-internal'])
+
+    def test_internal_queue_names(self):
+        self.assertEqual(pipeline.internal_queue_names('queue'), ['queue-internal'])
+        self.assertEqual(pipeline.internal_queue_names('queue', 2), ['queue-internal.0', 'queue-internal.1'])
+
+    def test_send_compression_invalid(self):
+        self.pipe.parameters.destination_pipeline_compression = 'foo'
+        with self.assertRaises(exceptions.InvalidArgument):
+            self.pipe.set_queues('test-bot-output', 'destination')
+
     def test_count(self):
         self.pipe.send(SAMPLES['normal'][0])
         self.pipe.send(SAMPLES['normal'][1])
@@ -98,6 +182,25 @@ def test_count_multi(self):
         self.assertEqual(self.pipe.count_queued_messages('test-bot-input', 'test-bot-output'),
                          {'test-bot-input': 1, 'test-bot-output': 2})
 
+    def test_receive_batch(self):
+        self.pipe.state['test-bot-input'] = [SAMPLES['normal'][0], SAMPLES['unicode'][0],
+                                             SAMPLES['normal'][0]]
+        self.assertEqual([SAMPLES['normal'][1], SAMPLES['unicode'][1]],
+                         self.pipe.receive_batch(2))
+        self.assertEqual(self.pipe.count_queued_messages('test-bot-input', 'test-bot-input-internal'),
+                         {'test-bot-input': 1, 'test-bot-input-internal': 2})
+
+    def test_receive_batch_unacknowledged(self):
+        """ A not acknowledged batch is returned again. """
+        self.pipe.state['test-bot-input'] = [SAMPLES['normal'][0], SAMPLES['unicode'][0]]
+        self.pipe.receive_batch(1)
+        self.assertEqual([SAMPLES['normal'][1]], self.pipe.receive_batch(2))
+        self.pipe.acknowledge_batch()
+        self.assertEqual([SAMPLES['unicode'][1]], self.pipe.receive_batch(2))
+        self.pipe.acknowledge_batch()
+        self.assertEqual(self.pipe.count_queued_messages('test-bot-input', 'test-bot-input-internal'),
+                         {'test-bot-input': 0, 'test-bot-input-internal': 0})
+
     def tearDown(self):
         self.pipe.state = {}
 
@@ -142,11 +245,131 @@ def test_count(self):
         self.pipe.send(SAMPLES['unicode'][0])
         self.assertEqual(self.pipe.count_queued_messages('test'), {'test': 3})
 
+    def test_receive_batch(self):
+        self.clear()
+        self.pipe.send(SAMPLES['normal'][0])
+        self.pipe.send(SAMPLES['unicode'][0])
+        self.pipe.send(SAMPLES['normal'][0])
+        self.assertEqual([SAMPLES['normal'][1], SAMPLES['unicode'][1]],
+                         self.pipe.receive_batch(2))
+        self.assertEqual(self.pipe.count_queued_messages('test', 'test-internal'),
+                         {'test': 1, 'test-internal': 2})
+        # not yet acknowledged
+        self.assertEqual([SAMPLES['normal'][1], SAMPLES['unicode'][1]],
+                         self.pipe.receive_batch(2))
+        self.pipe.acknowledge_batch()
+        self.assertEqual([SAMPLES['normal'][1]], self.pipe.receive_batch(2))
+        self.pipe.acknowledge_batch()
+        self.assertEqual(self.pipe.count_queued_messages('test', 'test-internal'),
+                         {'test': 0, 'test-internal': 0})
+
+    def test_receive_compression_corrupt(self):
+        """ A corrupt compressed message does not break the pipeline. """
+        self.clear()
+        self.pipe.send(b'\x02not zlib data')
+        self.assertEqual(b'\x02not zlib data', self.pipe.receive())
+        self.assertEqual(b'\x02not zlib data', self.pipe.receive())
+        self.pipe.acknowledge()
+        self.assertEqual(self.pipe.count_queued_messages('test', 'test-internal'),
+                         {'test': 0, 'test-internal': 0})
+
+    def test_requeue_internal_queues(self):
+        """ Messages of internal queues not in use are received again first. """
+        self.clear()
+        self.addCleanup(self.pipe.clear_queue, 'test-internal.0')
+        self.addCleanup(self.pipe.clear_queue, 'test-internal.1')
+        self.addCleanup(self.pipe.clear_queue, 'test-internal-other')
+        self.pipe.send(SAMPLES['normal'][0])
+        self.pipe.pipe.lpush('test-internal.0', 'first', 'second')
+        self.pipe.pipe.lpush('test-internal.1', 'worker 1')
+        self.pipe.pipe.lpush('test-internal-other', 'other')
+        self.assertEqual(self.pipe.find_internal_queues('test'), ['test-internal.0', 'test-internal.1'])
+        self.assertEqual(self.pipe.requeue_internal_queues(keep=['test-internal.1']),
+                         {'test-internal.0': 2})
+        self.assertEqual(self.pipe.find_internal_queues('test'), ['test-internal.1'])
+        self.assertEqual([self.pipe.receive_batch(3)], [['first', 'second', SAMPLES['normal'][1]]])
+
+    def test_receive_batch_timeout(self):
+        self.clear()
+        self.assertEqual([], self.pipe.receive_batch(2, timeout=1))
+
+    def test_send_buffer(self):
+        """ Messages are sent as soon as the buffer is full. """
+        self.clear()
+        self.pipe.parameters.destination_pipeline_buffer_size = 2
+        self.pipe.set_queues('test', 'destination')
+        self.pipe.send(SAMPLES['normal'][0])
+        self.assertEqual(self.pipe.count_queued_messages('test'), {'test': 0})
+        self.pipe.send(SAMPLES['unicode'][0])
+        self.assertEqual(self.pipe.count_queued_messages('test'), {'test': 2})
+        self.assertEqual(SAMPLES['normal'][1], self.pipe.receive())
+
+    def test_send_buffer_flush(self):
+        self.clear()
+        self.pipe.parameters.destination_pipeline_buffer_size = 10
+        self.pipe.set_queues('test', 'destination')
+        self.pipe.send(SAMPLES['normal'][0])
+        self.pipe.send(SAMPLES['unicode'][0])
+        self.assertEqual(self.pipe.count_queued_messages('test'), {'test': 0})
+        self.pipe.flush()
+        self.assertEqual(self.pipe.count_queued_messages('test'), {'test': 2})
+        self.assertEqual([SAMPLES['normal'][1], SAMPLES['unicode'][1]],
+                         self.pipe.receive_batch(2))
+
     def tearDown(self):
         self.pipe.disconnect()
         self.clear()
 
 
+class TestChain(unittest.TestCase):
+
+    def setUp(self):
+        params = Parameters()
+        params.broker = 'Pythonlist'
+        logger = logging.getLogger('foo')
+        logger.addHandler(logging.NullHandler())
+        self.external = pipeline.PipelineFactory.create(params, logger=logger)
+        self.external.set_queues({'_default': ['other-output']}, 'destination')
+        self.external.state['other-output'] = []
+        self.processed = []
+        self.pipe = pipeline.Chain(params, logger=logger, queue='next-input',
+                                   process=self.process, pipeline=self.external)
+        self.pipe.set_queues({'_default': ['next-input', 'other-output']}, 'destination')
+        self.event = message.Event({'source.ip': '192.0.2.1'}, harmonization=HARM)
+
+    def process(self):
+        self.processed.append(self.pipe.receive())
+        self.pipe.acknowledge()
+
+    def test_send(self):
+        """ Messages are passed as objects to the next bot on flush. """
+        self.pipe.send(self.event)
+        self.assertEqual(self.processed, [])
+        self.pipe.flush()
+        self.assertEqual(self.processed, [self.event])
+        self.assertIsNot(self.processed[0], self.event)
+        self.assertIsInstance(self.processed[0], message.Event)
+        self.assertEqual(self.external.state['other-output'],
+                         [message.MessageFactory.serialize(self.event).encode()])
+
+    def test_copy(self):
+        """ Changes by the sending bot after sending do not affect the sent message. """
+        self.pipe.send(self.event)
+        self.event.add('source.port', 80)
+        self.pipe.flush()
+        self.assertNotIn('source.port', self.processed[0])
+        self.processed[0].add('source.asn', 64496)
+        self.assertNotIn('source.asn', self.event)
+
+    def test_flush_error(self):
+        """ Failed messages are discarded, the sending bot handles the error. """
+        self.pipe.send(self.event)
+        self.pipe.process = lambda: 1 / 0
+        with self.assertRaises(ZeroDivisionError):
+            self.pipe.flush()
+        self.assertEqual(len(self.pipe.messages), 0)
+
+
 @test.skip_exotic()
 class TestAmqp(unittest.TestCase):
 
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Testing the profiling of bots.
+"""
+import os
+import pstats
+import tempfile
+import time
+import unittest
+
+from intelmq.lib.profiling import Profiler, SamplingProfiler, format_summary, summarize
+
+
+def busy(seconds: float):
+    end = time.process_time() + seconds
+    while time.process_time() < end:
+        pass
+
+
+class TestProfiling(unittest.TestCase):
+
+    def test_summarize(self):
+        summary = summarize({'process': 5, 'receive': 2, 'unserialize': 1,
+                             'serialize': 0.5, 'send': 1.5}, 10, 100)
+        self.assertEqual(summary, {'messages': 100, 'elapsed': 10, 'pipeline': 3.5,
+                                   'unserialize': 1, 'process': 2, 'serialize': 0.5,
+                                   'other': 3})
+        summary['filename'] = 'bot.pstats'
+        self.assertEqual(format_summary(summary),
+                         "Profiled 100 messages in 10.000s: pipeline I/O 3.500s (35.0%), "
+                         "deserialization 1.000s (10.0%), process() 2.000s (20.0%), "
+                         "serialization 0.500s (5.0%), other 3.000s (30.0%). "
+                         "Results written to 'bot.pstats'.")
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            Profiler('invalid', 'bot')
+
+    def test_cprofile(self):
+        with tempfile.TemporaryDirectory() as directory:
+            profiler = Profiler('cprofile', os.path.join(directory, 'bot'), messages=2)
+            profiler.start({'process': 1})
+            busy(0.01)
+            self.assertFalse(profiler.done(1))
+            self.assertTrue(profiler.done(2))
+            summary = profiler.stop({'process': 1.5}, 2)
+            self.assertEqual(summary['filename'], os.path.join(directory, 'bot.pstats'))
+            self.assertEqual(summary['process'], 0.5)
+            stats = pstats.Stats(summary['filename'])
+            self.assertIn('busy', {function for _, _, function in stats.stats})
+
+    def test_seconds(self):
+        profiler = Profiler('sampling', 'bot', seconds=0.01)
+        profiler.start({})
+        self.assertFalse(profiler.done(0))
+        time.sleep(0.02)
+        self.assertTrue(profiler.done(0))
+        profiler._Profiler__profile.disable()
+
+    def test_sampling(self):
+        profiler = SamplingProfiler(interval=0.001)
+        profiler.enable()
+        busy(0.2)
+        profiler.disable()
+        self.assertTrue(any('busy' in stack for stack in profiler.stacks))
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'bot.collapsed')
+            profiler.dump_stats(filename)
+            with open(filename) as handle:
+                stack, count = handle.readline().rsplit(' ', 1)
+            self.assertIn(';', stack)
+            self.assertGreater(int(count), 0)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    unittest.main()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for intelmq.lib.resolver
+"""
+import threading
+import time
+import unittest
+import unittest.mock as mock
+
+import dns.resolver
+
+from intelmq.lib.resolver import Answer, CoalescingExecutor, Resolver
+
+
+class TestCoalescingExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = CoalescingExecutor(4)
+        self.addCleanup(self.executor.shutdown)
+        self.release = threading.Event()
+        self.calls = []
+
+    def query(self, argument):
+        self.calls.append(argument)
+        self.release.wait(5)
+        return argument * 2
+
+    def test_coalesce(self):
+        """ Queries with the key of a query in flight are not started again. """
+        first = self.executor.submit('a', self.query, 1)
+        second = self.executor.submit('a', self.query, 1)
+        other = self.executor.submit('b', self.query, 2)
+        self.assertIs(first, second)
+        self.assertEqual(len(self.executor), 2)
+        self.release.set()
+        self.assertEqual(first.result(), 2)
+        self.assertEqual(other.result(), 4)
+        self.assertEqual(sorted(self.calls), [1, 2])
+
+    def test_done(self):
+        """ Finished queries are started again. """
+        self.release.set()
+        self.assertEqual(self.executor.submit('a', self.query, 1).result(), 2)
+        self.assertEqual(self.executor.submit('a', self.query, 1).result(), 2)
+        self.assertEqual(self.calls, [1, 1])
+        self.assertEqual(len(self.executor), 0)
+
+
+class FakeAnswer(list):
+
+    def __init__(self, records, ttl):
+        super().__init__(records)
+        self.expiration = time.time() + ttl
+
+
+class TestResolver(unittest.TestCase):
+
+    def setUp(self):
+        self.resolver = Resolver(workers=4)
+        self.addCleanup(self.resolver.shutdown)
+
+    def test_cache(self):
+        """ Answers are cached for their TTL. """
+        with mock.patch('dns.resolver.query', return_value=FakeAnswer(['192.0.2.1'], 60)) as query:
+            answer = self.resolver.resolve('example.com')
+            self.assertEqual(answer.records, ('192.0.2.1',))
+            self.assertIsInstance(answer, Answer)
+            self.assertEqual(self.resolver.resolve('example.com'), answer)
+            self.assertEqual(query.call_count, 1)
+            self.resolver.resolve('example.com', 'AAAA')
+            self.assertEqual(query.call_count, 2)
+        self.assertEqual(self.resolver.counters['dns_queries'], 2)
+        self.assertEqual(self.resolver.counters['dns_cache_hits'], 1)
+        with mock.patch('time.monotonic', return_value=time.monotonic() + 61):
+            self.assertIsNone(self.resolver.cache.get(('example.com', 'A')))
+
+    def test_negative(self):
+        """ Negative answers are cached, other errors are not. """
+        with mock.patch('dns.resolver.query', side_effect=dns.resolver.NXDOMAIN) as query:
+            for _ in range(2):
+                with self.assertRaises(dns.resolver.NXDOMAIN):
+                    self.resolver.resolve('invalid.example.com')
+            self.assertEqual(query.call_count, 1)
+        with mock.patch('dns.resolver.query', side_effect=dns.resolver.Timeout) as query:
+            result = self.resolver.resolve_many(['example.com', 'example.com'])
+            self.assertEqual(list(result), ['example.com'])
+            self.assertIsNone(result['example.com'][0])
+            self.assertIsInstance(result['example.com'][1], dns.resolver.Timeout)
+            self.resolver.resolve_many(['example.com'])
+            self.assertEqual(query.call_count, 2)
+
+    def test_negative_new_exception(self):
+        """ Every answer from the cache gets a new exception. """
+        with mock.patch('dns.resolver.query', side_effect=dns.resolver.NXDOMAIN):
+            with self.assertRaises(dns.resolver.NXDOMAIN):
+                self.resolver.resolve('invalid.example.com')
+            first = self.resolver.submit('invalid.example.com').exception()
+            second = self.resolver.submit('invalid.example.com').exception()
+        self.assertEqual(self.resolver.counters['dns_cache_hits'], 2)
+        self.assertIsInstance(first, dns.resolver.NXDOMAIN)
+        self.assertIsInstance(second, dns.resolver.NXDOMAIN)
+        self.assertIsNot(first, second)
+        self.assertIsNone(first.__traceback__)
+
+    def test_coalesce(self):
+        """ Names which are being resolved are not queried again. """
+        release = threading.Event()
+
+        def query(name, rdtype):
+            release.wait(5)
+            return FakeAnswer([name], 60)
+
+        with mock.patch('dns.resolver.query', side_effect=query) as mocked:
+            first = self.resolver.submit('example.com')
+            second = self.resolver.submit('example.com')
+            self.assertIs(first, second)
+            release.set()
+            self.assertEqual(first.result().records, ('example.com',))
+            self.assertEqual(mocked.call_count, 1)
+        self.assertEqual(self.resolver.counters['dns_coalesced'], 1)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    unittest.main()
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Testing the histograms of the bot statistics.
+"""
+import unittest
+
+from intelmq.lib.stats import Histogram
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_empty(self):
+        histogram = Histogram()
+        self.assertEqual(histogram.count, 0)
+        self.assertIsNone(histogram.mean())
+        self.assertIsNone(histogram.percentile(50))
+
+    def test_percentile(self):
+        histogram = Histogram((1, 2, 5))
+        for value in (0.5, 1, 1.5, 4, 4, 10):
+            histogram.add(value)
+        self.assertEqual(histogram.counts, [2, 1, 2, 1])
+        self.assertEqual(histogram.count, 6)
+        self.assertEqual(histogram.mean(), 3.5)
+        self.assertEqual(histogram.percentile(0), 1)
+        self.assertEqual(histogram.percentile(50), 2)
+        self.assertEqual(histogram.percentile(80), 5)
+        self.assertEqual(histogram.percentile(99), float('inf'))
+
+    def test_merge(self):
+        histogram = Histogram((1, 2))
+        histogram.add(0.5)
+        other = Histogram((1, 2))
+        other.add(1.5)
+        other.add(3)
+        histogram.merge(other)
+        self.assertEqual(histogram.counts, [1, 1, 1])
+        self.assertEqual(histogram.sum, 5)
+        with self.assertRaises(ValueError):
+            histogram.merge(Histogram((1, 3)))
+
+    def test_serialize(self):
+        histogram = Histogram()
+        histogram.add(0.003)
+        unserialized = Histogram.unserialize(histogram.serialize())
+        self.assertEqual(unserialized.buckets, histogram.buckets)
+        self.assertEqual(unserialized.counts, histogram.counts)
+        self.assertEqual(unserialized.summary(), histogram.summary())
+
+
+if __name__ == '__main__':  # pragma: no cover
+    unittest.main()
@@ -62,6 +62,12 @@
             'Cerberus',
             'pyyaml',
         ],
+        'msgpack': [
+            'msgpack',
+        ],
+        'zstd': [
+            'zstandard',
+        ],
     },
     packages=find_packages(),
     include_package_data=True,
@@ -92,6 +98,7 @@
     data_files=DATA,
     entry_points={
         'console_scripts': [
+            'intelmq-bench = intelmq.bin.intelmq_bench:main',
             'intelmqctl = intelmq.bin.intelmqctl:main',
             'intelmqdump = intelmq.bin.intelmqdump:main',
             'intelmq_psql_initdb = intelmq.bin.intelmq_psql_initdb:main',